@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+import traceback
+import time
+import queue
+import sys
+
+from agent.client import Worker
+
+import options
+flags = options.get()
+
+def run_actor(argv, thread_index, trajectory_queue, weights_queue, stop_event, global_step):
+	""" Entry point of an actor process. """
+	flags(argv, known_only=True) # flags are not parsed in a spawned process
+	config = tf.ConfigProto(device_count={'GPU': 0}, intra_op_parallelism_threads=1, inter_op_parallelism_threads=1) # a CPU copy of the policy, one core per actor
+	session = tf.Session(config=config)
+	actor = ActorWorker(thread_index=thread_index, session=session, trajectory_queue=trajectory_queue, weights_queue=weights_queue, stop_event=stop_event, global_step=global_step)
+	session.run(tf.global_variables_initializer())
+	actor.run()
+
+class ActorWorker(Worker):
+	# Acts in its own process, with its own environment and its own copy of the policy.
+	# Trajectories are shipped to the learner process, weights are received from it.
+
+	def __init__(self, thread_index, session, trajectory_queue, weights_queue, stop_event, global_step):
+		self.trajectory_queue = trajectory_queue
+		self.weights_queue = weights_queue
+		self.stop_event = stop_event
+		self.global_step = global_step
+		super().__init__(thread_index=thread_index, session=session, global_network=None, device="/cpu:0", training=True, acting_only=True) # the buffers and the inference server belong to the learner process
+
+	def get_latest_weights(self, block):
+		weights = self.weights_queue.get() if block else None
+		while True: # skip stale weights
+			try:
+				weights = self.weights_queue.get_nowait()
+			except queue.Empty:
+				return weights
+
+	def initialize_batch(self):
+		weights = self.get_latest_weights(block=False)
+		if weights is not None:
+			self.local_network.set_weights(weights)
+		self.local_network.initialize_new_batch()
+
+	def train_batch(self, global_step, step):
+		stats = None
+		if self.terminal:
+			self.update_statistics()
+			stats = self.stats
+		self.trajectory_queue.put( (self.thread_index, self.local_network.batch, stats, self.terminated_episodes, step) )
+
+	def run(self):
+		self.local_network.set_weights(self.get_latest_weights(block=True)) # wait for the learner
+		self.set_start_time(time.time())
+		while not self.stop_event.is_set():
+			self.process(self.global_step.value)
+		self.stop()
+
+class LearnerWorker(Worker):
+	# Trains, in the learner process, the trajectories streamed by one actor process.
+	# A central learner trains the trajectories of all the actors, sharing their trajectory queue: it takes up to flags.central_learner_batch_count
+	# waiting trajectories at once and trains them together, as the batches of a synchronous round.
+
+	def __init__(self, thread_index, session, global_network, device, environment, context, trajectory_queue=None):
+		self.shape_environment = environment # used only for getting shapes
+		self.trajectory_queue = trajectory_queue if trajectory_queue is not None else context.Queue(maxsize=flags.actor_queue_size)
+		self.weights_queue = context.Queue()
+		self.stop_event = context.Event()
+		self.batch_count = 0
+		self.actors = {thread_index: self} # the actors whose trajectories are trained by this learner
+		super().__init__(thread_index=thread_index, session=session, global_network=global_network, device=device, training=True)
+		
+	def set_actors(self, learner_list):
+		self.actors = {learner.thread_index: learner for learner in learner_list}
+
+	def create_environment(self):
+		return self.shape_environment
+
+	def start_actor(self, context, global_step):
+		self.send_weights()
+		self.actor_process = context.Process(target=run_actor, args=(sys.argv, self.thread_index, self.trajectory_queue, self.weights_queue, self.stop_event, global_step))
+		self.actor_process.daemon = True
+		self.actor_process.start()
+
+	def send_weights(self):
+		self.weights_queue.put(self.global_network.get_weights())
+
+	def stop(self):
+		for actor in self.actors.values():
+			actor.stop_event.set()
+
+	def get_trajectories(self, max_count): # waits at most a second for the first trajectory, then takes only those already waiting
+		trajectories = []
+		try:
+			trajectories.append(self.trajectory_queue.get(timeout=1))
+			while len(trajectories) < max_count:
+				trajectories.append(self.trajectory_queue.get_nowait())
+		except queue.Empty:
+			pass
+		return trajectories
+
+	def process(self, global_step=0):
+		trajectories = self.get_trajectories(flags.central_learner_batch_count if flags.central_learner else 1)
+		if len(trajectories) == 0:
+			return 0
+		try:
+			self.terminal = False
+			for (thread_index, _, stats, terminated_episodes, _) in trajectories:
+				if stats is not None:
+					self.terminal = True
+					actor = self.actors[thread_index]
+					actor.stats = stats
+					actor.stats.update(self.local_network.get_statistics())
+					actor.terminated_episodes = terminated_episodes
+			if flags.central_learner: # one large gradient step for all the trajectories
+				batches = [self.local_network.compute_discounted_cumulative_reward(batch) for (_, batch, _, _, _) in trajectories]
+				self.local_network.train_round(batches, global_step)
+			else:
+				self.local_network.sync()
+				self.local_network.batch = trajectories[0][1]
+				self.local_network.process_batch(global_step)
+			for (thread_index, _, _, _, _) in trajectories:
+				actor = self.actors[thread_index]
+				actor.batch_count += 1
+				if actor.batch_count % flags.actor_sync_interval == 0:
+					actor.send_weights()
+			return sum(step for (_, _, _, _, step) in trajectories)
+		except:
+			traceback.print_exc()
+			return 0
@@ -1,53 +1,242 @@
 # -*- coding: utf-8 -*-
+import copy
+from collections import deque
 import numpy as np
+from scipy.signal import lfilter
 
 def is_tuple(val):
 	return type(val) in [list,tuple]
 
+def discount(sequence, gamma): # y[t] = sequence[t] + gamma*y[t+1]
+	return lfilter([1], [1, -gamma], sequence[::-1])[::-1]
+
+def flatten_into_record(record, name, value): # tuples (eg: LSTM states) are flattened into one field per element
+	if isinstance(value, tuple):
+		for i, element in enumerate(value):
+			flatten_into_record(record, '{}#{}'.format(name, i), element)
+	else:
+		record[name] = None if value is None else np.asarray(value)
+		
+def unflatten_from_record(record, name):
+	if name in record:
+		value = record[name]
+		return value[()] if value is not None and value.ndim == 0 else value
+	element_names = set(key[len(name)+1:].split('#')[0] for key in record if key.startswith(name+'#'))
+	return tuple(unflatten_from_record(record, '{}#{}'.format(name, i)) for i in range(len(element_names)))
+
+def get_byte_size(value): # bytes of the arrays in value
+	if value is None:
+		return 0
+	if is_tuple(value) or isinstance(value, tuple):
+		return sum(get_byte_size(element) for element in value)
+	return np.asarray(value).nbytes
+
+class StepArray(object):
+	# The per-step values of a field of an agent, in a preallocated array grown by doubling its capacity.
+	# The array is allocated on the first value, with its shape. None values (eg: unused concatenations) are only counted.
+
+	def __init__(self, capacity, dtype=None):
+		self.capacity = max(1, capacity)
+		self.dtype = dtype # if None, the type of the first value
+		self.array = None
+		self.size = 0
+		
+	def clear(self):
+		self.size = 0
+		
+	def append(self, value):
+		if value is None:
+			self.size += 1
+			return
+		value = np.asarray(value, dtype=self.dtype)
+		if self.array is None:
+			self.array = np.empty((self.capacity,)+value.shape, dtype=value.dtype)
+		elif self.size == len(self.array): # full
+			self.array = np.concatenate([self.array, np.empty_like(self.array)])
+		self.array[self.size] = value
+		self.size += 1
+		
+	def view(self):
+		if self.array is None:
+			return [None]*self.size
+		return self.array[:self.size]
+		
+	def __setitem__(self, pos, value):
+		self.view()[pos] = value
+		
+	def get_byte_size(self): # allocated bytes
+		return 0 if self.array is None else self.array.nbytes
+		
+	def get_array(self): # the stored values, None if all the values are None
+		if self.array is None:
+			return None
+		return self.array[:self.size]
+		
+	def set_array(self, array, size):
+		self.array = array if array is not None and len(array) > 0 else None
+		self.size = size
+		
+class ActionArray(StepArray):
+	# Discrete actions are stored as integer indices and viewed as one-hot vectors
+
+	def __init__(self, capacity, depth):
+		self.depth = depth # 0 for continuous control
+		super().__init__(capacity, dtype=np.int32 if self.is_discrete() else None)
+		
+	def is_discrete(self):
+		return self.depth > 1
+		
+	def append(self, value):
+		super().append(np.argmax(value, -1) if self.is_discrete() else value)
+		
+	def view(self):
+		if not self.is_discrete():
+			return super().view()
+		return np.eye(self.depth, dtype=np.float32)[super().view()]
+
+class BurnInWindow(object):
+	# The last steps of an agent, kept as burn-in prefix of its next batch.
+	# R2D2 (Kapturowski, Steven, et al. "Recurrent experience replay in distributed reinforcement learning." ICLR 2019) refreshes the internal state
+	# of a replayed sequence by running the current network on its prefix, starting from the internal state stored before the prefix.
+
+	def __init__(self, length):
+		self.steps = deque(maxlen=length)
+		
+	def clear(self):
+		self.steps.clear()
+		
+	def append(self, state, concat, internal_state): # state must be encoded, internal_state is the one before the step
+		self.steps.append((state, concat, internal_state))
+		
+	def get_prefix(self): # states, concats and the internal state before the first step
+		if len(self.steps) == 0:
+			return None, None, None
+		states, concats, internal_states = zip(*self.steps)
+		return np.array(states), (None if concats[0] is None else np.array(concats, dtype=np.float32)), internal_states[0]
+
 class ExperienceBatch(object):
+	step_keys = ['states','concats','actions','policies','rewards','values']
 
-	def __init__(self, model_size):
+	def __init__(self, model_size, capacity=8, action_depths=None, state_codec=None):
+		# capacity is the number of steps of an agent that fit in the batch without allocating memory
 		self.model_size = model_size
-		# action info
-		self.states = [[] for _ in range(model_size)] # do NOT use [[]]*model_size
-		self.concats = [[] for _ in range(model_size)]
-		self.actions = [[] for _ in range(model_size)]
-		self.policies = [[] for _ in range(model_size)]
-		self.rewards = [[] for _ in range(model_size)]
-		self.values = [[] for _ in range(model_size)]
-		self.internal_states = [[] for _ in range(model_size)]
+		self.state_codec = state_codec # if not None, states are stored encoded
+		if action_depths is None:
+			action_depths = [0]*model_size
+		# action info, as structure of arrays
+		self.step_arrays = {key: [StepArray(capacity) for _ in range(model_size)] for key in self.step_keys}
+		self.step_arrays['actions'] = [ActionArray(capacity, depth) for depth in action_depths]
+		self.clear()
+		
+	def clear(self): # keeps the allocated arrays, for reusing the batch
+		for arrays in self.step_arrays.values():
+			for array in arrays:
+				array.clear()
+		# recurrent states, only at the start and at the end of every agent sequence
+		self.start_internal_states = [None]*self.model_size
+		self.last_internal_states = [None]*self.model_size
+		# burn-in prefix: the steps of every agent before the batch, with the internal state before them
+		self.burn_in_states = [None]*self.model_size
+		self.burn_in_concats = [None]*self.model_size
+		self.burn_in_internal_states = [None]*self.model_size
 		# cumulative info
-		self.discounted_cumulative_rewards = [None]*model_size
-		self.generalized_advantage_estimators = [None]*model_size
+		self.discounted_cumulative_rewards = [None]*self.model_size
+		self.generalized_advantage_estimators = [None]*self.model_size
 		
 		self.bootstrap = {}
 		self.agent_position_list = []
 		
+	def get_field(self, key): # one view per agent
+		if key == 'internal_states':
+			return self.internal_states
+		if key in self.step_arrays:
+			return [array.view() for array in self.step_arrays[key]]
+		return self.__dict__[key]
+		
+	@property
+	def states(self):
+		return self.get_field('states')
+		
+	@property
+	def concats(self):
+		return self.get_field('concats')
+		
+	@property
+	def actions(self):
+		return self.get_field('actions')
+		
+	@property
+	def policies(self):
+		return self.get_field('policies')
+		
+	@property
+	def rewards(self):
+		return self.get_field('rewards')
+		
+	@property
+	def values(self):
+		return self.get_field('values')
+		
+	@property
+	def internal_states(self): # the internal state at the start of every agent sequence
+		return [[internal_state] for internal_state in self.start_internal_states]
+		
 	def reset_internal_states(self):
-		self.internal_states = [[None] for _ in range(self.model_size)]
+		self.start_internal_states = [None]*self.model_size
+		self.last_internal_states = [None]*self.model_size
+		self.burn_in_internal_states = [None]*self.model_size
+		
+	def set_burn_in(self, agent, states, concats, internal_state):
+		self.burn_in_states[agent] = states
+		self.burn_in_concats[agent] = concats
+		self.burn_in_internal_states[agent] = internal_state
+		
+	def get_burn_in_size(self, agent):
+		states = self.burn_in_states[agent]
+		return 0 if states is None else len(states)
+		
+	def get_internal_state(self, agent, pos):
+		size = self.get_agent_size(agent)
+		if pos < 0:
+			pos += size
+		if pos == 0:
+			return self.start_internal_states[agent]
+		if pos == size-1:
+			return self.last_internal_states[agent]
+		raise IndexError("only the internal states at the start and at the end of a sequence are stored")
+		
+	def get_step_value(self, key, agent, pos):
+		if key == 'internal_states':
+			return self.get_internal_state(agent, pos)
+		if key in self.step_arrays:
+			return self.step_arrays[key][agent].view()[pos]
+		return self.__dict__[key][agent][pos]
 	
 	def get_action(self, action, agent, pos):
 		if not is_tuple(action):
-			return self.__dict__[action][agent][pos]
-		return (self.__dict__[key][agent][pos] for key in action)
+			return self.get_step_value(action, agent, pos)
+		return tuple(self.get_step_value(key, agent, pos) for key in action)
 		
-	def set_action(self, feed_dict, agent, pos):
+	def set_action(self, feed_dict, agent, pos): # pos can also be a slice
 		for (key, value) in feed_dict.items():
-			q = self.__dict__[key][agent]
-			if len(q) <= pos: # add missing steps
-				q.extend([None]*(pos-len(q)+1))
-			q[pos] = value
+			self.step_arrays[key][agent][pos] = value
 
 	def add_action(self, agent_id, state, concat, action, policy, reward, value, internal_state=None):
-		self.states[agent_id].append(state)
-		self.concats[agent_id].append(concat)
-		self.internal_states[agent_id].append(internal_state)
-		self.rewards[agent_id].append(reward) # extrinsic + intrinsic reward
-		self.values[agent_id].append(value)
-		self.actions[agent_id].append(action)
-		self.policies[agent_id].append(policy)
+		if self.get_agent_size(agent_id) == 0:
+			self.start_internal_states[agent_id] = internal_state
+		self.last_internal_states[agent_id] = internal_state
+		step_arrays = self.step_arrays
+		step_arrays['states'][agent_id].append(state if self.state_codec is None else self.state_codec.encode_state(state))
+		step_arrays['concats'][agent_id].append(concat)
+		step_arrays['rewards'][agent_id].append(reward) # extrinsic + intrinsic reward
+		step_arrays['values'][agent_id].append(value)
+		step_arrays['actions'][agent_id].append(action)
+		step_arrays['policies'][agent_id].append(policy)
+		
+		self.agent_position_list.append( (agent_id, self.get_agent_size(agent_id)-1) ) # (agent_id, batch_position)
 		
-		self.agent_position_list.append( (agent_id, len(self.states[agent_id])-1) ) # (agent_id, batch_position)
+	def get_agent_size(self, agent):
+		return self.step_arrays['states'][agent].size
 		
 	def get_cumulative_reward(self, agents=None):
 		if agents is None:
@@ -56,8 +245,8 @@ class ExperienceBatch(object):
 		
 	def get_size(self, agents=None):
 		if agents is None:
-			return sum(len(s) for s in self.states)
-		return sum(len(s) for agent,s in enumerate(self.states) if agent in agents)
+			return len(self.agent_position_list)
+		return sum(self.get_agent_size(agent) for agent in range(self.model_size) if agent in agents)
 
 	def step_generator(self, agents=None):
 		if agents is None:
@@ -67,6 +256,18 @@ class ExperienceBatch(object):
 			return ((agent,pos) for pos in range(self.get_size(agents)))
 		return ((agent,pos) for (agent,pos) in self.agent_position_list if agent in agents)
 		
+	def get_flat_field(self, key, agents=None): # the values of the given agents as a single array, in the order their steps were taken; None if there are no steps
+		agent_list = [agent for agent in range(self.model_size) if self.get_agent_size(agent) > 0 and (agents is None or agent in agents)]
+		if len(agent_list) == 0:
+			return None
+		views = self.get_field(key)
+		if len(agent_list) == 1:
+			return np.asarray(views[agent_list[0]])
+		offsets = np.zeros(self.model_size, dtype=np.int64) # the position of the first step of every agent in the concatenated views
+		offsets[agent_list] = np.cumsum([0]+[self.get_agent_size(agent) for agent in agent_list[:-1]])
+		step_array = np.array(list(self.step_generator(agents)), dtype=np.int64)
+		return np.concatenate([views[agent] for agent in agent_list])[offsets[step_array[:,0]] + step_array[:,1]]
+		
 	def reversed_step_generator(self, agents=None):
 		if agents is None:
 			return reversed(self.agent_position_list)
@@ -76,33 +277,120 @@ class ExperienceBatch(object):
 		return ((agent,pos) for (agent,pos) in reversed(self.agent_position_list) if agent in agents)
 		
 	def compute_discounted_cumulative_reward(self, agents, last_value, gamma, lambd):
-		# prepare batch
 		for i in agents:
 			self.discounted_cumulative_rewards[i]=[]
 			self.generalized_advantage_estimators[i]=[]
-		# bootstrap
-		discounted_cumulative_reward = last_value
-		generalized_advantage_estimator = 0.0
+		# flatten the steps of the given agents, in the order they were taken
+		step_list = list(self.step_generator(agents))
+		if len(step_list) == 0:
+			return
+		step_agents = np.array([agent for (agent,_) in step_list])
+		agent_rewards = self.rewards
+		agent_values = self.values
+		rewards = np.array([np.sum(agent_rewards[agent][pos]) for (agent,pos) in step_list], dtype=np.float64) # extrinsic + intrinsic reward
+		values = np.array([agent_values[agent][pos] for (agent,pos) in step_list], dtype=np.float64).reshape(-1)
+		next_values = np.append(values[1:], last_value) # bootstrap
 		# compute cumulative reward and advantage
-		for (agent,pos) in self.reversed_step_generator(agents):
-			reward, value = self.get_action(['rewards','values'], agent, pos)
-			reward = np.sum(reward) # extrinsic + intrinsic reward
-			discounted_cumulative_reward = reward + gamma*discounted_cumulative_reward
-			generalized_advantage_estimator = reward + gamma*last_value - value + gamma*lambd*generalized_advantage_estimator
-			feed_dict = {'discounted_cumulative_rewards':discounted_cumulative_reward, 'generalized_advantage_estimators':generalized_advantage_estimator}
-			self.set_action(feed_dict, agent, pos)
-			# update last value
-			last_value = value
+		discounted_cumulative_rewards = discount(np.append(rewards, last_value), gamma)[:-1]
+		generalized_advantage_estimators = discount(rewards + gamma*next_values - values, gamma*lambd)
+		# scatter them back to the agents, their steps are in increasing position order
+		for i in agents:
+			agent_mask = step_agents == i
+			self.discounted_cumulative_rewards[i] = list(discounted_cumulative_rewards[agent_mask])
+			self.generalized_advantage_estimators[i] = list(generalized_advantage_estimators[agent_mask])
+			
+	def get_byte_size(self): # bytes of the batch arrays, the python objects overhead is not counted
+		byte_size = sum(array.get_byte_size() for arrays in self.step_arrays.values() for array in arrays)
+		byte_size += get_byte_size(self.discounted_cumulative_rewards) + get_byte_size(self.generalized_advantage_estimators)
+		byte_size += get_byte_size(self.start_internal_states) + get_byte_size(self.last_internal_states)
+		byte_size += get_byte_size(self.burn_in_states) + get_byte_size(self.burn_in_concats) + get_byte_size(self.burn_in_internal_states)
+		byte_size += get_byte_size(list(self.bootstrap.values()))
+		return byte_size
+		
+	def get_state_arrays(self): # the states of every agent, None if there are none
+		return [array.get_array() for array in self.step_arrays['states']]
+		
+	def copy_with_state_arrays(self, state_arrays): # a shallow copy of the batch, with the given states for every agent
+		batch = copy.copy(self)
+		batch.step_arrays = dict(self.step_arrays)
+		batch.step_arrays['states'] = []
+		for (array, state_array) in zip(self.step_arrays['states'], state_arrays):
+			state_step_array = StepArray(1)
+			state_step_array.set_array(state_array, array.size)
+			batch.step_arrays['states'].append(state_step_array)
+		return batch
+		
+	def copy_with_own_values(self): # a shallow copy of the batch, whose values, bootstrap and cumulative info can be recomputed without changing the batch
+		batch = copy.copy(self)
+		batch.step_arrays = dict(self.step_arrays)
+		batch.step_arrays['values'] = []
+		for array in self.step_arrays['values']:
+			value_array = array.get_array()
+			value_step_array = StepArray(1)
+			value_step_array.set_array(None if value_array is None else value_array.copy(), array.size)
+			batch.step_arrays['values'].append(value_step_array)
+		batch.bootstrap = dict(self.bootstrap)
+		batch.discounted_cumulative_rewards = list(self.discounted_cumulative_rewards)
+		batch.generalized_advantage_estimators = list(self.generalized_advantage_estimators)
+		return batch
+		
+	def get_record(self):
+		# The batch as a dict of numpy arrays (or None values), for storing it without pickling. Fields with the 'steps.' prefix have one row per step.
+		record = {
+			'agent_sizes': np.array([self.get_agent_size(agent) for agent in range(self.model_size)], dtype=np.int32),
+			'action_depths': np.array([array.depth for array in self.step_arrays['actions']], dtype=np.int32),
+		}
+		agent_steps = [[] for _ in range(self.model_size)]
+		for (step, (agent, _)) in enumerate(self.agent_position_list):
+			agent_steps[agent].append(step)
+		for agent in range(self.model_size):
+			record['steps.agent{}.order'.format(agent)] = np.array(agent_steps[agent], dtype=np.int32) # the position of every step in agent_position_list
+			for key in self.step_keys:
+				record['steps.agent{}.{}'.format(agent, key)] = self.step_arrays[key][agent].get_array() # actions are stored as indices
+			for key in ['discounted_cumulative_rewards', 'generalized_advantage_estimators']:
+				record['steps.agent{}.{}'.format(agent, key)] = self.__dict__[key][agent]
+			flatten_into_record(record, 'agent{}.start_internal_state'.format(agent), self.start_internal_states[agent])
+			flatten_into_record(record, 'agent{}.last_internal_state'.format(agent), self.last_internal_states[agent])
+			if self.get_burn_in_size(agent) > 0:
+				record['steps.agent{}.burn_in_states'.format(agent)] = self.burn_in_states[agent]
+				record['steps.agent{}.burn_in_concats'.format(agent)] = self.burn_in_concats[agent]
+				flatten_into_record(record, 'agent{}.burn_in_internal_state'.format(agent), self.burn_in_internal_states[agent])
+		for (key, value) in self.bootstrap.items():
+			flatten_into_record(record, 'bootstrap.{}'.format(key), value)
+		return record
+		
+	@staticmethod
+	def from_record(record): # the inverse of get_record
+		agent_sizes = [int(size) for size in record['agent_sizes']]
+		batch = ExperienceBatch(len(agent_sizes), capacity=1, action_depths=[int(depth) for depth in record['action_depths']])
+		batch.agent_position_list = [None]*sum(agent_sizes)
+		for (agent, size) in enumerate(agent_sizes):
+			for key in batch.step_keys:
+				batch.step_arrays[key][agent].set_array(record['steps.agent{}.{}'.format(agent, key)], size)
+			for (pos, step) in enumerate(record['steps.agent{}.order'.format(agent)]):
+				batch.agent_position_list[step] = (agent, pos)
+			for key in ['discounted_cumulative_rewards', 'generalized_advantage_estimators']:
+				batch.__dict__[key][agent] = record['steps.agent{}.{}'.format(agent, key)]
+			batch.start_internal_states[agent] = unflatten_from_record(record, 'agent{}.start_internal_state'.format(agent))
+			batch.last_internal_states[agent] = unflatten_from_record(record, 'agent{}.last_internal_state'.format(agent))
+			if record.get('steps.agent{}.burn_in_states'.format(agent)) is not None:
+				batch.set_burn_in(agent, 
+					states=record['steps.agent{}.burn_in_states'.format(agent)], 
+					concats=record['steps.agent{}.burn_in_concats'.format(agent)], 
+					internal_state=unflatten_from_record(record, 'agent{}.burn_in_internal_state'.format(agent))
+				)
+		bootstrap_keys = set(name[len('bootstrap.'):].split('#')[0] for name in record if name.startswith('bootstrap.'))
+		batch.bootstrap = {key: unflatten_from_record(record, 'bootstrap.{}'.format(key)) for key in bootstrap_keys}
+		return batch
 			
 	def append(self, batch):
-		pos_base = [len(self.states[agent]) for agent in range(self.model_size)]
-		self.agent_position_list.extend((agent, pos+pos_base[agent]) for (agent,pos) in batch.agent_position_list)
-		for i in range(self.model_size):
-			self.states[i].extend(batch.states[i])
-			self.concats[i].extend(batch.concats[i])
-			self.actions[i].extend(batch.actions[i])
-			self.policies[i].extend(batch.policies[i])
-			self.rewards[i].extend(batch.rewards[i])
-			self.values[i].extend(batch.values[i])
-			self.internal_states[i].extend(batch.internal_states[i])
-		self.bootstrap = batch.bootstrap
\ No newline at end of file
+		for agent in range(self.model_size):
+			if self.get_agent_size(agent) == 0:
+				self.start_internal_states[agent] = batch.start_internal_states[agent]
+			if batch.get_agent_size(agent) > 0:
+				self.last_internal_states[agent] = batch.last_internal_states[agent]
+		for (agent,pos) in batch.agent_position_list:
+			for key in self.step_keys:
+				self.step_arrays[key][agent].append(batch.get_step_value(key, agent, pos))
+			self.agent_position_list.append( (agent, self.get_agent_size(agent)-1) )
+		self.bootstrap = batch.bootstrap
@@ -13,6 +13,7 @@ import time
 import utils.plots as plt
 
 from environment.environment import Environment
+from environment.vectorized_environment import VectorizedEnvironment
 from agent.manager import *
 # from utils.schedules import LinearSchedule
 
@@ -29,7 +30,7 @@ class Worker(object):
 			return "BasicManager"
 		return flags.partitioner_type + "Partitioner"
 			
-	def __init__(self, thread_index, session, global_network, device, training=True):
+	def __init__(self, thread_index, session, global_network, device, training=True, acting_only=False):
 		self.training = training
 		self.thread_index = thread_index
 		self.global_network = global_network
@@ -49,7 +50,7 @@ class Worker(object):
 			self.reward_logger.setLevel(logging.DEBUG)
 			self.max_reward = float("-inf")
 		# build network
-		self.environment = Environment.create_environment(flags.env_type, self.thread_index, self.training)
+		self.environment = self.create_environment()
 		state_shape = self.environment.get_state_shape()
 		action_shape = self.environment.get_action_shape()
 		concat_size = self.environment.get_concatenation_size() if flags.use_concatenation else 0
@@ -61,7 +62,9 @@ class Worker(object):
 			concat_size=concat_size,
 			state_shape=state_shape, 
 			global_network=self.global_network,
-			training=self.training
+			training=self.training,
+			state_codec=self.environment.get_state_codec(),
+			acting_only=acting_only
 		)
 		self.terminal = True
 		self.local_t = 0
@@ -70,6 +73,9 @@ class Worker(object):
 		self.stats = {}
 		# self.batch_schedule = LinearSchedule(flags.max_time_step-flags.steps_before_increasing_batch_size, initial_p=flags.min_batch_size, final_p=flags.min_batch_size)
 
+	def create_environment(self):
+		return Environment.create_environment(flags.env_type, self.thread_index, self.training)
+
 	def update_statistics(self):
 		self.stats = self.environment.get_statistics()
 		self.stats.update(self.local_network.get_statistics())
@@ -187,11 +193,17 @@ class Worker(object):
 			# return flags.min_batch_size
 		# return self.batch_schedule.value(global_step-flags.steps_before_increasing_batch_size)
 				
+	def initialize_batch(self): # copy weights from shared to local
+		self.local_network.periodic_sync()
+		self.local_network.initialize_new_batch()
+		
+	def train_batch(self, global_step, step):
+		self.local_network.process_batch(global_step)
+				
 	# run simulations
 	def run_batch(self, global_step):
-		if self.training: # Copy weights from shared to local
-			self.local_network.sync()
-			self.local_network.initialize_new_batch()
+		if self.training:
+			self.initialize_batch()
 		step = 0
 		# max_batch_size = self.get_batch_size(global_step)
 		# while step < max_batch_size and not self.terminal:
@@ -214,7 +226,7 @@ class Worker(object):
 		if self.training: # train using batch
 			if not self.terminal:
 				self.local_network.bootstrap(state=new_state, concat=self.environment.get_concatenation() if flags.use_concatenation else None)
-			self.local_network.process_batch(global_step)
+			self.train_batch(global_step, step)
 		return step
 
 	def process(self, global_step=0):
@@ -228,4 +240,70 @@ class Worker(object):
 		except:
 			traceback.print_exc()
 			self.terminal = True
-			return 0
\ No newline at end of file
+			return 0
+
+class VectorizedWorker(Worker):
+	# Steps flags.environment_count environments together, acting on all of them with a single forward pass.
+	# Episode frames are never saved.
+	
+	def __init__(self, thread_index, session, global_network, device, training=True):
+		if flags.partition_count > 1:
+			raise ValueError("vectorized environments do not support partitions, set partition_count to 1")
+		super().__init__(thread_index=thread_index, session=session, global_network=global_network, device=device, training=training)
+		self.environment_terminals = None
+		
+	def create_environment(self):
+		return VectorizedEnvironment(flags.env_type, self.thread_index, self.training, flags.environment_count)
+		
+	def prepare(self): # initialize a new episode for every environment
+		environment_count = self.environment.get_environment_count()
+		self.terminal = False
+		self.environment_terminals = [False]*environment_count
+		self.episode_rewards = np.zeros(environment_count)
+		self.environment.reset()
+		self.local_network.reset_environments(environment_count)
+		self.frame_info_list = []
+		self.save_frame_info = False
+		
+	def run_batch(self, global_step):
+		if self.training: # Copy weights from shared to local
+			self.local_network.periodic_sync()
+			self.local_network.initialize_new_environment_batches()
+		self.terminal = False # True if at least one episode terminates in this batch
+		step = 0
+		while step < flags.batch_size:
+			step += 1
+			states = self.environment.get_last_states()
+			new_states, values, actions, rewards, self.environment_terminals, policies = self.local_network.act_in_environments( 
+				act_function=self.environment.process, 
+				states=states,
+				concats=self.environment.get_concatenations() if flags.use_concatenation else None
+			)
+			for i, terminal in enumerate(self.environment_terminals):
+				self.episode_rewards[i] += sum(rewards[i])
+				if terminal: # an episode has terminated, start a new one
+					self.terminal = True
+					self.terminated_episodes += 1
+					self.episode_reward = self.episode_rewards[i]
+					self.episode_rewards[i] = 0
+					self.local_network.complete_environment_batch(i)
+					self.environment.reset_environment(i)
+			
+		if self.training: # train using batches
+			self.local_network.bootstrap_environments(states=self.environment.get_last_states(), concats=self.environment.get_concatenations() if flags.use_concatenation else None)
+			self.local_network.process_environment_batches(global_step)
+		return step*len(self.environment_terminals)
+		
+	def process(self, global_step=0):
+		try:
+			if self.environment_terminals is None:
+				self.prepare()
+			step = self.run_batch(global_step)
+			if self.training:
+				self.log(global_step, step)
+			return step
+		except:
+			traceback.print_exc()
+			self.environment_terminals = None
+			self.terminal = True
+			return 0
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+import traceback
+import time
+from collections import deque
+from concurrent.futures import Future
+
+class InferenceServer(object):
+	# Workers submit single-state act requests and get back futures.
+	# A scheduler thread coalesces the pending requests of each model into one batched session.run,
+	# waiting at most max_wait seconds for a batch to reach max_batch_size requests.
+
+	def __init__(self, model_list, max_batch_size, max_wait):
+		self.model_list = model_list
+		self.max_batch_size = max_batch_size
+		self.max_wait = max_wait
+		self.condition = threading.Condition()
+		self.pending = [deque() for _ in model_list] # one request queue per model
+		self.running = False
+		self.thread = None
+		# Statistics
+		self._batch_count = 0
+		self._request_count = 0
+
+	def start(self):
+		if self.running:
+			return
+		self.running = True
+		self.thread = threading.Thread(target=self.serve)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		with self.condition:
+			self.running = False
+			self.condition.notify_all()
+
+	def predict_action(self, model_id, state, concat=None, internal_state=None):
+		future = Future()
+		with self.condition:
+			self.pending[model_id].append( (state, concat, internal_state, future, time.time()) )
+			self.condition.notify_all()
+		return future
+
+	def get_oldest_request_model(self):
+		oldest_model_id = None
+		oldest_time = float("inf")
+		for model_id, queue in enumerate(self.pending):
+			if len(queue) > 0 and queue[0][-1] < oldest_time:
+				oldest_time = queue[0][-1]
+				oldest_model_id = model_id
+		return oldest_model_id, oldest_time
+
+	def get_requests(self): # blocks until there is something to run
+		with self.condition:
+			model_id = None
+			while self.running and model_id is None:
+				model_id, oldest_time = self.get_oldest_request_model()
+				if model_id is None:
+					self.condition.wait()
+			if not self.running:
+				return None, []
+			# wait for the batch to fill up, until the deadline of the oldest request
+			deadline = oldest_time + self.max_wait
+			queue = self.pending[model_id]
+			while self.running and len(queue) < self.max_batch_size:
+				remaining_time = deadline - time.time()
+				if remaining_time <= 0:
+					break
+				self.condition.wait(remaining_time)
+			requests = [queue.popleft() for _ in range(min(len(queue), self.max_batch_size))]
+			return model_id, requests
+
+	def serve(self):
+		while self.running:
+			model_id, requests = self.get_requests()
+			if len(requests) > 0:
+				self.run(model_id, requests)
+
+	def run(self, model_id, requests):
+		states, concats, internal_states, futures, _ = zip(*requests)
+		try:
+			action_batch, value_batch, policy_batch, new_internal_states = self.model_list[model_id].predict_parallel_action(states=states, concats=concats, internal_states=internal_states)
+		except Exception as e:
+			traceback.print_exc()
+			for future in futures:
+				future.set_exception(e)
+			return
+		for i, future in enumerate(futures):
+			future.set_result( (action_batch[i], value_batch[i], policy_batch[i], new_internal_states[i]) )
+		# statistics
+		self._batch_count += 1
+		self._request_count += len(requests)
+
+	def get_statistics(self):
+		if self._batch_count == 0:
+			return {}
+		return {"inference_batch_size_avg": self._request_count/self._batch_count}
@@ -11,9 +11,10 @@ flags = options.get()
 
 class PolicyLoss(object):
 
-	def __init__(self, cliprange, cross_entropy, old_cross_entropy, advantage, entropy, beta):
+	def __init__(self, cliprange, cross_entropy, old_cross_entropy, advantage, entropy, beta, step_mask=None):
 		self.cliprange = cliprange
-		self.advantage = advantage
+		self.step_mask = step_mask # ignore the padding steps of sequences shorter than the longest one
+		self.advantage = self.mask(advantage)
 		# entropy
 		self.beta = beta
 		self.entropy = tf.maximum(0.,entropy) if flags.only_non_negative_entropy else entropy
@@ -26,9 +27,19 @@ class PolicyLoss(object):
 			self.old_cross_entropy = tf.reduce_sum(self.old_cross_entropy, -1)
 		if len(self.entropy.get_shape()) > 1:
 			self.entropy = tf.reduce_sum(self.entropy, -1)
+		# log ratio of every step, padding included: it keeps the (time-major) sequence layout
+		self.sequence_log_ratio = self.old_cross_entropy - self.cross_entropy
+		self.entropy = self.mask(self.entropy)
+		self.cross_entropy = self.mask(self.cross_entropy)
+		self.old_cross_entropy = self.mask(self.old_cross_entropy)
 		# reduction function
 		self.reduce_function = eval('tf.reduce_{}'.format(flags.loss_type))
 		
+	def mask(self, tensor):
+		if self.step_mask is None:
+			return tensor
+		return tf.boolean_mask(tensor, self.step_mask)
+		
 	def get(self):
 		if flags.policy_loss == 'Vanilla':
 			return self.vanilla()
@@ -44,8 +55,14 @@ class PolicyLoss(object):
 	def get_entropy_contribution(self):
 		return self.reduce_function(self.entropy)*self.beta
 		
+	def get_log_ratio(self):
+		return self.old_cross_entropy - self.cross_entropy
+		
+	def get_sequence_log_ratio(self):
+		return self.sequence_log_ratio
+		
 	def get_ratio(self):
-		return tf.exp(self.old_cross_entropy - self.cross_entropy)
+		return tf.exp(self.get_log_ratio())
 			
 	def vanilla(self):
 		policy = self.reduce_function(self.advantage*self.cross_entropy)
@@ -10,13 +10,19 @@ import options
 flags = options.get()
 
 class ValueLoss(object):
-	def __init__(self, cliprange, value, old_value, reward):
+	def __init__(self, cliprange, value, old_value, reward, step_mask=None):
 		self.cliprange = cliprange
-		self.value = value
-		self.old_value = old_value
-		self.reward = reward
+		self.step_mask = step_mask # ignore the padding steps of sequences shorter than the longest one
+		self.value = self.mask(value)
+		self.old_value = self.mask(old_value)
+		self.reward = self.mask(reward)
 		self.reduce_function = eval('tf.reduce_{}'.format(flags.loss_type))
 		
+	def mask(self, tensor):
+		if self.step_mask is None:
+			return tensor
+		return tf.boolean_mask(tensor, self.step_mask)
+		
 	def get(self):
 		if flags.value_loss == 'Vanilla':
 			return self.vanilla()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+class VTrace(object):
+	# Espeholt, Lasse, et al. "IMPALA: Scalable distributed deep-RL with importance weighted actor-learner architectures." arXiv preprint arXiv:1802.01561 (2018).
+	# Off-policy corrected value targets and policy advantages for time-ordered sequences, generated by a (stale) behaviour policy.
+	# Inputs are flat time-major batches of sequence_count sequences (padded to the same length, valid_mask is False for padding), bootstrap_value has one value per sequence.
+
+	def __init__(self, log_ratio, value, bootstrap_value, reward, discount, rho_clip, c_clip, valid_mask, sequence_count):
+		self.sequence_count = sequence_count
+		self.valid = self.to_sequences(tf.to_float(valid_mask))
+		ratio = tf.exp(self.to_sequences(log_ratio)) # target/behaviour probability ratio
+		self.clipped_rho = tf.minimum(rho_clip, ratio)*self.valid # padding steps have no delta
+		self.clipped_c = tf.minimum(c_clip, ratio)
+		self.value = self.to_sequences(value)
+		self.bootstrap_value = bootstrap_value
+		self.reward = self.to_sequences(reward)
+		self.discount = discount
+
+	def to_sequences(self, batch): # shape: (steps, sequences)
+		return tf.reshape(batch, [-1, self.sequence_count])
+
+	def get_next(self, sequence):
+		# the next value of the last valid step of a sequence is its bootstrap value
+		next_valid = tf.concat([self.valid[1:], tf.zeros_like(self.valid[:1])], 0)
+		shifted_sequence = tf.concat([sequence[1:], tf.zeros_like(sequence[:1])], 0)
+		return next_valid*shifted_sequence + (1.-next_valid)*tf.expand_dims(self.bootstrap_value, 0)
+
+	def get_target_value(self): # v_s
+		deltas = self.clipped_rho*(self.reward + self.discount*self.get_next(self.value) - self.value)
+		# v_s - V(x_s) = delta_s + discount*c_s*(v_{s+1} - V(x_{s+1}))
+		value_correction = tf.scan(
+			fn=lambda accumulator, delta_and_c: delta_and_c[0] + self.discount*delta_and_c[1]*accumulator,
+			elems=(deltas, self.clipped_c),
+			initializer=tf.zeros_like(self.bootstrap_value),
+			reverse=True
+		)
+		return tf.stop_gradient(tf.reshape(value_correction + self.value, [-1]))
+
+	def get_advantage(self, target_value):
+		target_value = self.to_sequences(target_value)
+		return tf.stop_gradient(tf.reshape(self.clipped_rho*(self.reward + self.discount*self.get_next(target_value) - self.value), [-1]))
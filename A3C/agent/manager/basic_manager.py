@@ -4,25 +4,46 @@ from __future__ import division
 from __future__ import print_function
 
 from collections import deque
+import copy
+import functools
+import os
+import threading
+import time
 import tensorflow as tf
 import numpy as np
 from agent.network import *
 from utils.buffer import Buffer, PrioritizedBuffer
+from utils.memory_mapped_buffer import MemoryMappedBuffer, MemoryMappedPrioritizedBuffer
+from utils.compression import BatchCompressor
+from utils.sharded_buffer import ShardedBuffer
+from utils.replay_server import ReplayClient
+from utils.reward_prediction_buffer import RewardPredictionBuffer
 # from utils.schedules import LinearSchedule
-from agent.batch import ExperienceBatch
+from agent.batch import ExperienceBatch, BurnInWindow
+from utils.observation_codec import ObservationCodec
+from agent.inference_server import InferenceServer
+from agent.train_pipeline import TrainPipeline
 from sklearn.random_projection import SparseRandomProjection
 
 import options
 flags = options.get()
 
+BATCH_POOL_SIZE = 4 # max. number of batches kept for reuse
+
+def get_worker_byte_budget(megabytes): # a global budget in megabytes, split among the workers
+	return int(megabytes*2**20/flags.parallel_size)
+
 class BasicManager(object):
 	
-	def __init__(self, session, device, id, action_shape, state_shape, concat_size=0, global_network=None, training=True):
+	def __init__(self, session, device, id, action_shape, state_shape, concat_size=0, global_network=None, training=True, state_codec=None, acting_only=False):
+		# An acting only manager (the policy copy of an actor process) ships its batches to a learner: it has no buffer and no inference server.
 		self.training = training
+		self.acting_only = acting_only
 		self.session = session
 		self.id = id
 		self.device = device
 		self.state_shape = state_shape
+		self.state_codec = state_codec if state_codec is not None else ObservationCodec(state_shape) # batches keep encoded states
 		self.set_model_size()
 		if self.training:
 			self.global_network = global_network
@@ -35,29 +56,95 @@ class BasicManager(object):
 			self.model_list = []
 			self.build_agents(state_shape=state_shape, action_shape=action_shape, concat_size=concat_size)
 			# Build experience buffer
-			if flags.replay_ratio > 0:
-				if flags.prioritized_replay:
-					self.experience_buffer = PrioritizedBuffer(size=flags.replay_buffer_size)
-					# self.beta_schedule = LinearSchedule(flags.max_time_step, initial_p=0.4, final_p=1.0)
-				else:
-					self.experience_buffer = Buffer(size=flags.replay_buffer_size)
-			if flags.predict_reward:
-				self.reward_prediction_buffer = Buffer(size=flags.reward_prediction_buffer_size)
+			if flags.replay_ratio > 0 and not self.acting_only:
+				self.experience_buffer = self.build_experience_buffer()
+				# self.beta_schedule = LinearSchedule(flags.max_time_step, initial_p=0.4, final_p=1.0)
+			if flags.predict_reward and not self.acting_only:
+				self.reward_prediction_buffer = RewardPredictionBuffer(size=flags.reward_prediction_buffer_size, window_size=3, byte_budget=get_worker_byte_budget(flags.reward_prediction_buffer_megabytes), name='reward_prediction_buffer')
 			# Bind optimizer to global
 			if not self.is_global_network():
 				self.bind_to_global(self.global_network)
+			# Parameter versions: global models count their updates, local models remember the version of their last sync
+			if self.is_global_network():
+				self.model_versions = [0]*self.model_size
+				self.version_lock = threading.Lock()
+				# Steps collected in the environments and steps replayed, by all the workers and replay learners
+				self.step_count_condition = threading.Condition()
+				self.env_step_count = 0
+				self.replayed_step_count = 0
+			else:
+				self.model_versions = [-1]*self.model_size
+				self.model_bytes = [sum(np.prod(var.get_shape().as_list())*var.dtype.size for var in model.get_shared_keys()) for model in self.model_list]
+				self.sync_count = 0 # number of calls to periodic_sync
+				self._sync_bytes = 0
+				self._sync_start_time = time.time()
 			# Count based exploration	
 			if flags.use_count_based_exploration_reward:
 				self.projection = None
 				self.projection_dataset = []
 			if flags.print_loss:
 				self._loss_list = [{} for _ in range(self.model_size)]
+				self._loss_lock = threading.Lock() # losses are added by the train pipeline thread, while statistics are read by the worker
+			# Train input pipeline
+			self.train_pipeline = TrainPipeline(capacity=flags.train_pipeline_capacity)
+			if flags.use_train_pipeline and not self.is_global_network():
+				self.train_pipeline.start()
+			# Fused training
+			self._train_callables = {}
+			# Gradient accumulation
+			self.accumulating_models = set() # models with accumulated gradients, not applied yet
+			# Synchronous training
+			self.round_batches = [] # batches waiting for the end of the round
+			# Batched inference
+			self.inference_server = None
+			if flags.use_inference_server and not self.acting_only:
+				if self.is_global_network():
+					self.inference_server = InferenceServer(
+						model_list=self.model_list, 
+						max_batch_size=flags.inference_batch_size if flags.inference_batch_size > 0 else flags.parallel_size, 
+						max_wait=flags.inference_max_wait
+					)
+				else:
+					self.inference_server = self.global_network.inference_server
 		else:
 			self.global_network = None
 			self.model_list = global_network.model_list
+			self.inference_server = None
+		# Batches
+		self.action_depths = [0 if model.is_continuous_control() else model.policy_depth for model in self.model_list]
+		self.batch_pool = [] # batches not referenced anymore, ready for reuse
 		# Statistics
 		self._model_usage_list = deque()
 			
+	def build_experience_buffer(self):
+		if flags.replay_server_address: # every worker has its own connection to the server
+			return ReplayClient(address=flags.replay_server_address, authkey=flags.replay_server_authkey.encode(), batch_from_record=ExperienceBatch.from_record, name='experience_buffer')
+		if not flags.shared_replay:
+			return self.build_replay_buffer(directory_name=str(self.id))
+		if not self.is_global_network(): # the global network owns the buffer of all the workers
+			return self.global_network.experience_buffer
+		return ShardedBuffer([self.build_replay_buffer(directory_name='shared/shard_{}'.format(i)) for i in range(flags.parallel_size)]) # one shard per worker
+		
+	def build_replay_buffer(self, directory_name):
+		if flags.replay_backend not in ('Memory', 'MemoryMapped'):
+			raise ValueError("unknown replay_backend {}, use Memory or MemoryMapped".format(flags.replay_backend))
+		byte_budget = get_worker_byte_budget(flags.replay_buffer_megabytes)
+		if flags.replay_backend == 'MemoryMapped': # batches are stored on disk, in files that survive restarts
+			if byte_budget > 0: # record files are preallocated, evicting batches would not free any byte
+				raise ValueError("replay_buffer_megabytes is not supported with replay_backend MemoryMapped, limit replay_buffer_size instead")
+			directory = os.path.join(flags.checkpoint_dir, 'replay', directory_name)
+			if flags.prioritized_replay:
+				return MemoryMappedPrioritizedBuffer(size=flags.replay_buffer_size, directory=directory, max_steps=max(flags.batch_size, flags.replay_burn_in), batch_from_record=ExperienceBatch.from_record, name='experience_buffer')
+			return MemoryMappedBuffer(size=flags.replay_buffer_size, directory=directory, max_steps=max(flags.batch_size, flags.replay_burn_in), batch_from_record=ExperienceBatch.from_record, name='experience_buffer')
+		if flags.prioritized_replay:
+			return PrioritizedBuffer(size=flags.replay_buffer_size, compressor=self.build_compressor('experience_buffer'), byte_budget=byte_budget, name='experience_buffer')
+		return Buffer(size=flags.replay_buffer_size, compressor=self.build_compressor('experience_buffer'), byte_budget=byte_budget, name='experience_buffer')
+		
+	def build_compressor(self, name):
+		if not flags.replay_compression:
+			return None
+		return BatchCompressor(method=flags.replay_compression, cache_size=flags.replay_compression_cache_size, name=name)
+			
 	def is_global_network(self):
 		return self.global_network is None
 			
@@ -75,16 +162,50 @@ class BasicManager(object):
 			concat_size=concat_size, 
 			clip=self.clip[0], 
 			predict_reward=flags.predict_reward, 
-			training = self.training
+			training = self.training,
+			state_codec=self.state_codec
 		)
 		self.model_list.append(agent)
 			
 	def sync(self):
 		# assert not self.is_global_network(), 'you are trying to sync the global network with itself'
 		for i in range(self.model_size):
+			global_version = self.global_network.model_versions[i]
+			if self.model_versions[i] == global_version: # the global model has not been updated since the last sync
+				continue
 			agent = self.model_list[i]
 			sync = self.sync_list[i]
-			agent.sync(sync)
+			self.train_pipeline.call(lambda agent=agent, sync=sync: agent.sync(sync)) # after the queued train ops, if any: they must not see the new weights
+			self.model_versions[i] = global_version # the copied weights may be newer, in which case the next sync is redundant but harmless
+			self._sync_bytes += self.model_bytes[i]
+			
+	def periodic_sync(self): # sync before a new batch, allowing a policy lag of at most flags.sync_interval-1 batches
+		if self.sync_count % flags.sync_interval == 0:
+			self.sync()
+		self.sync_count += 1
+		
+	def increment_global_version(self, model_id):
+		global_network = self.global_network
+		with global_network.version_lock:
+			global_network.model_versions[model_id] += 1
+			
+	def add_to_step_counts(self, env_steps=0, replayed_steps=0):
+		global_network = self.global_network
+		with global_network.step_count_condition:
+			global_network.env_step_count += env_steps
+			global_network.replayed_step_count += replayed_steps
+			global_network.step_count_condition.notify_all()
+			
+	def get_replay_to_env_step_ratio(self): # measured, to be compared with flags.replay_ratio
+		global_network = self.global_network
+		if global_network.env_step_count == 0:
+			return 0
+		return global_network.replayed_step_count/global_network.env_step_count
+		
+	def wait_for_replay_ratio(self, timeout): # returns whether more steps can be replayed without exceeding flags.replay_ratio
+		global_network = self.global_network
+		with global_network.step_count_condition:
+			return global_network.step_count_condition.wait_for(lambda: global_network.replayed_step_count < flags.replay_ratio*global_network.env_step_count, timeout=timeout)
 			
 	def initialize_gradient_optimizer(self):
 		self.global_step = []
@@ -117,9 +238,27 @@ class BasicManager(object):
 		if self.training:
 			# build loss statistics
 			if flags.print_loss:
+				with self._loss_lock: # snapshot
+					loss_list = [{key: list(value) for key, value in loss_dict.items()} for loss_dict in self._loss_list]
 				for i in range(self.model_size):
-					for key, value in self._loss_list[i].items():
+					for key, value in loss_list[i].items():
 						stats['loss_{}{}_avg'.format(key,i)] = np.average(value)
+			# build inference statistics
+			if self.inference_server is not None:
+				stats.update(self.inference_server.get_statistics())
+			# build train input statistics
+			stats.update(self.train_pipeline.get_statistics())
+			# build buffer statistics
+			if flags.replay_ratio > 0 and not self.acting_only:
+				stats.update(self.experience_buffer.get_statistics())
+			if flags.predict_reward and not self.acting_only:
+				stats.update(self.reward_prediction_buffer.get_statistics())
+			# build sync statistics
+			if not self.is_global_network():
+				elapsed_time = time.time() - self._sync_start_time
+				stats['sync_bytes_per_second'] = self._sync_bytes/elapsed_time if elapsed_time > 0 else 0
+				if flags.replay_ratio > 0:
+					stats['replay_to_env_step_ratio'] = self.get_replay_to_env_step_ratio()
 		# build models usage statistics
 		if self.model_size > 1:
 			total_usage = 0
@@ -146,35 +285,82 @@ class BasicManager(object):
 			vars += agent.get_shared_keys()
 		return vars
 		
+	def get_weights(self):
+		return [agent.get_weights() for agent in self.model_list]
+		
+	def set_weights(self, weights):
+		for (agent, agent_weights) in zip(self.model_list, weights):
+			agent.set_weights(agent_weights)
+		
 	def reset(self):
 		self.step = 0
 		self.agent_id = 0
 		# Internal states
 		self.internal_states = None if flags.share_internal_state else [None]*self.model_size
 		if self.training:
+			# Burn-in prefixes for replay
+			if flags.replay_burn_in > 0:
+				self.burn_in_windows = self.build_burn_in_windows()
 			# Count based exploration
 			if flags.use_count_based_exploration_reward:
 				self.hash_state_table = {}
 			
+	def build_burn_in_windows(self): # one for every agent
+		return [BurnInWindow(flags.replay_burn_in) for _ in range(self.model_size)]
+		
+	def set_burn_in(self, batch, burn_in_windows):
+		for (agent, window) in enumerate(burn_in_windows):
+			batch.set_burn_in(agent, *window.get_prefix())
+			
 	def initialize_new_batch(self):
-		self.batch = ExperienceBatch(self.model_size)
+		self.batch = self.get_new_batch()
+		if self.training and flags.replay_burn_in > 0:
+			self.set_burn_in(self.batch, self.burn_in_windows)
+		
+	def get_new_batch(self):
+		if len(self.batch_pool) > 0:
+			batch = self.batch_pool.pop()
+			batch.clear()
+			return batch
+		return ExperienceBatch(self.model_size, capacity=flags.batch_size+1, action_depths=self.action_depths, state_codec=self.state_codec)
+		
+	def recycle_batch(self, batch): # call it only if nothing references the batch anymore
+		if flags.use_train_pipeline: # prefetched feeds may still reference the batch arrays
+			return
+		if len(self.batch_pool) < BATCH_POOL_SIZE:
+			self.batch_pool.append(batch)
 		
 	def estimate_value(self, agent_id, states, concats=None, internal_state=None):
 		return self.get_model(agent_id).predict_value(states=states, concats=concats, internal_state=internal_state)
 		
+	def estimate_action(self, agent_id, state, concat=None, internal_state=None):
+		if self.inference_server is not None: # batched together with the requests of the other workers
+			return self.inference_server.predict_action(model_id=agent_id, state=state, concat=concat, internal_state=internal_state).result()
+		action_batch, value_batch, policy_batch, new_internal_state = self.get_model(agent_id).predict_action(states=[state], concats=[concat], internal_state=internal_state)
+		return action_batch[0], value_batch[0], policy_batch[0], new_internal_state
+		
 	def act(self, act_function, state, concat=None):
 		agent_id = self.agent_id
-		agent = self.get_model(agent_id)
 		
 		internal_state = self.internal_states if flags.share_internal_state else self.internal_states[agent_id]
-		action_batch, value_batch, policy_batch, new_internal_state = agent.predict_action(states=[state], concats=[concat], internal_state=internal_state)
+		action, value, policy, new_internal_state = self.estimate_action(agent_id=agent_id, state=state, concat=concat, internal_state=internal_state)
 		if flags.share_internal_state:
 			self.internal_states = new_internal_state
 		else:
 			self.internal_states[agent_id] = new_internal_state
 		
-		action, value, policy = action_batch[0], value_batch[0], policy_batch[0]
 		new_state, extrinsic_reward, terminal = act_function(action)
+		total_reward = self.get_total_reward(extrinsic_reward, new_state)
+		if self.training:
+			self.batch.add_action(agent_id=agent_id, state=state, concat=concat, action=action, policy=policy, reward=total_reward, value=value, internal_state=internal_state)
+			if flags.replay_burn_in > 0:
+				self.burn_in_windows[agent_id].append(self.state_codec.encode_state(state), concat, internal_state)
+		# update step at the end of the action
+		self.step += 1
+		# return result
+		return new_state, value, action, total_reward, terminal, policy
+		
+	def get_total_reward(self, extrinsic_reward, new_state):
 		if self.training:
 			if flags.clip_reward:
 				extrinsic_reward = np.clip(extrinsic_reward, flags.min_reward, flags.max_reward)
@@ -184,13 +370,69 @@ class BasicManager(object):
 			if flags.use_count_based_exploration_reward: # intrinsic reward
 				intrinsic_reward += self.get_count_based_exploration_reward(new_state)
 
-		total_reward = np.array([extrinsic_reward, intrinsic_reward], dtype=np.float32)
-		if self.training:
-			self.batch.add_action(agent_id=agent_id, state=state, concat=concat, action=action, policy=policy, reward=total_reward, value=value, internal_state=internal_state)
+		return np.array([extrinsic_reward, intrinsic_reward], dtype=np.float32)
+		
+	# Vectorized environments: one trajectory (and one internal state) for each environment, with agent 0 only
+	def reset_environments(self, environment_count):
+		self.reset()
+		self.environment_internal_states = [None]*environment_count
+		if self.training and flags.replay_burn_in > 0:
+			self.environment_burn_in_windows = [self.build_burn_in_windows() for _ in range(environment_count)]
+		
+	def initialize_new_environment_batches(self):
+		self.environment_batches = [self.get_new_batch() for _ in self.environment_internal_states]
+		self.completed_batches = []
+		if self.training and flags.replay_burn_in > 0:
+			for (batch, burn_in_windows) in zip(self.environment_batches, self.environment_burn_in_windows):
+				self.set_burn_in(batch, burn_in_windows)
+		
+	def act_in_environments(self, act_function, states, concats=None):
+		agent_id = self.agent_id
+		if concats is None:
+			concats = [None]*len(states)
+		internal_states = self.environment_internal_states
+		action_batch, value_batch, policy_batch, self.environment_internal_states = self.get_model(agent_id).predict_parallel_action(states=states, concats=concats, internal_states=internal_states)
+		new_states, extrinsic_rewards, terminals = act_function(action_batch)
+		total_rewards = []
+		for i in range(len(states)):
+			total_reward = self.get_total_reward(extrinsic_rewards[i], new_states[i])
+			if self.training:
+				self.environment_batches[i].add_action(agent_id=agent_id, state=states[i], concat=concats[i], action=action_batch[i], policy=policy_batch[i], reward=total_reward, value=value_batch[i], internal_state=internal_states[i])
+				if flags.replay_burn_in > 0:
+					self.environment_burn_in_windows[i][agent_id].append(self.state_codec.encode_state(states[i]), concats[i], internal_states[i])
+			total_rewards.append(total_reward)
 		# update step at the end of the action
 		self.step += 1
 		# return result
-		return new_state, value, action, total_reward, terminal, policy
+		return new_states, value_batch, action_batch, total_rewards, terminals, policy_batch
+		
+	def complete_environment_batch(self, environment_id): # the episode of the environment has terminated
+		if self.training:
+			self.completed_batches.append(self.environment_batches[environment_id])
+			self.environment_batches[environment_id] = self.get_new_batch()
+			if flags.replay_burn_in > 0: # the next episode starts without prefix
+				for window in self.environment_burn_in_windows[environment_id]:
+					window.clear()
+		self.environment_internal_states[environment_id] = None
+		
+	def bootstrap_environments(self, states, concats=None):
+		agent_id = self.agent_id
+		if concats is None:
+			concats = [None]*len(states)
+		value_batch, _ = self.get_model(agent_id).predict_parallel_value(states=states, concats=concats, internal_states=self.environment_internal_states)
+		for i, batch in enumerate(self.environment_batches):
+			bootstrap = batch.bootstrap
+			bootstrap['internal_state'] = self.environment_internal_states[i]
+			bootstrap['agent_id'] = agent_id
+			bootstrap['state'] = self.state_codec.encode_state(states[i])
+			bootstrap['concat'] = concats[i]
+			bootstrap['value'] = value_batch[i]
+			
+	def process_environment_batches(self, global_step):
+		for batch in self.completed_batches + self.environment_batches:
+			if batch.get_size() > 0:
+				self.batch = batch
+				self.process_batch(global_step)
 
 	def get_count_based_exploration_reward(self, new_state):
 		if len(self.projection_dataset) < flags.projection_dataset_size:
@@ -211,6 +453,12 @@ class BasicManager(object):
 			return flags.positive_exploration_coefficient*exploration_bonus if exploration_bonus > 0 else flags.negative_exploration_coefficient*exploration_bonus
 		return 0
 			
+	def get_gamma(self, agent_id):
+		return flags.gamma
+		
+	def get_bootstrap_value(self, batch, agent_id):
+		return batch.bootstrap['value'] if 'value' in batch.bootstrap else 0.
+			
 	def compute_discounted_cumulative_reward(self, batch):
 		last_value = batch.bootstrap['value'] if 'value' in batch.bootstrap else 0.
 		batch.compute_discounted_cumulative_reward(agents=self.agents_set, last_value=last_value, gamma=flags.gamma, lambd=flags.lambd)
@@ -228,19 +476,19 @@ class BasicManager(object):
 		dcr = batch.discounted_cumulative_rewards
 		gae = batch.generalized_advantage_estimators
 		batch_error = []
+		train_feed_functions = {}
 		for i in range(self.model_size):
 			batch_size = len(states[i])
 			if batch_size > 0:
 				model = self.get_model(i)
 				# reward prediction
 				if model.predict_reward:
-					sampled_batch = self.reward_prediction_buffer.sample()
-					reward_prediction_states, reward_prediction_target = self.get_reward_prediction_tuple(sampled_batch)
+					reward_prediction_states, reward_prediction_target = self.reward_prediction_buffer.sample()
 				else:
 					reward_prediction_states = None
 					reward_prediction_target = None
-				# train
-				error, train_info = model.train(
+				# train feed, built later (eventually in another thread)
+				train_feed_functions[i] = functools.partial(model.get_train_feed,
 					states=states[i], concats=concats[i],
 					actions=actions[i], values=values[i],
 					policies=policies[i],
@@ -249,19 +497,114 @@ class BasicManager(object):
 					generalized_advantage_estimators=gae[i],
 					reward_prediction_states=reward_prediction_states,
 					reward_prediction_target=reward_prediction_target,
-					internal_state=internal_states[i][0]
+					internal_state=internal_states[i][0],
+					bootstrap_value=self.get_bootstrap_value(batch, i),
+					gamma=self.get_gamma(i)
+				)
+				if flags.accumulate_gradients:
+					self.accumulating_models.add(i)
+		# train: models with no samples in the batch are not trained
+		if flags.fused_training: # all the models in one session.run
+			model_id_groups = [sorted(train_feed_functions.keys())] if len(train_feed_functions) > 0 else []
+		else:
+			model_id_groups = [[i] for i in sorted(train_feed_functions.keys())]
+		for model_ids in model_id_groups:
+			train_future = self.train_pipeline.train(
+				train_function=functools.partial(self.run_train_ops, model_ids), 
+				get_feed_function=functools.partial(self.merge_feeds, [train_feed_functions[i] for i in model_ids])
+			) # with prefetching, training continues in background
+			train_future.add_done_callback(functools.partial(self.add_train_results, model_ids, batch_error=batch_error))
+		return batch_error # with prefetching, it is filled when the train ops complete
+		
+	def merge_feeds(self, get_feed_functions): # models have disjoint placeholders
+		feed_dict = {}
+		for get_feed_function in get_feed_functions:
+			feed_dict.update(get_feed_function())
+		return feed_dict
+		
+	def run_train_ops(self, model_ids, feed_dict): # returns the train result of every given model
+		if len(model_ids) == 1:
+			return [self.get_model(model_ids[0]).run_train_op(feed_dict)]
+		# one callable for every group of models and feed signature
+		models = [self.get_model(i) for i in model_ids]
+		feed_list = tuple(feed_dict.keys())
+		key = tuple(model_ids) + feed_list
+		train_callable = self._train_callables.get(key)
+		if train_callable is None:
+			train_callable = self._train_callables[key] = self.session.make_callable(fetches=[model.get_train_fetches() for model in models], feed_list=list(feed_list))
+		fetched_values = train_callable(*feed_dict.values())
+		return [model.build_train_result(values) for (model, values) in zip(models, fetched_values)]
+		
+	def add_train_results(self, model_ids, train_future, batch_error):
+		if train_future.exception() is not None:
+			return
+		for (model_id, (_, train_info)) in zip(model_ids, train_future.result()):
+			if not flags.accumulate_gradients: # otherwise global weights change only when accumulated gradients are applied
+				self.increment_global_version(model_id)
+			batch_error.append(train_info["critic"]) # the value loss is the squared TD error
+			# loss statistics
+			if flags.print_loss:
+				self.add_to_loss_statistics(model_id, train_info)
+		
+	def train_sequences(self, batches): # one gradient step per model, over the given batches
+		batch_error = []
+		for i in range(self.model_size):
+			sequences = [
+				{
+					'states': batch.states[i], 'concats': batch.concats[i],
+					'actions': batch.actions[i], 'values': batch.values[i],
+					'policies': batch.policies[i],
+					'rewards': batch.rewards[i],
+					'discounted_cumulative_rewards': batch.discounted_cumulative_rewards[i],
+					'generalized_advantage_estimators': batch.generalized_advantage_estimators[i],
+					'internal_state': batch.internal_states[i][0],
+					'bootstrap_value': self.get_bootstrap_value(batch, i)
+				}
+				for batch in batches
+				if len(batch.states[i]) > 0
+			]
+			if len(sequences) > 0:
+				model = self.get_model(i)
+				# reward prediction
+				if model.predict_reward:
+					reward_prediction_states, reward_prediction_target = self.reward_prediction_buffer.sample()
+				else:
+					reward_prediction_states = None
+					reward_prediction_target = None
+				# train
+				if flags.accumulate_gradients:
+					self.accumulating_models.add(i)
+				_, train_info = model.train_sequences(
+					sequences=sequences,
+					reward_prediction_states=reward_prediction_states,
+					reward_prediction_target=reward_prediction_target,
+					gamma=self.get_gamma(i)
 				)
-				batch_error.append(error)
+				if not flags.accumulate_gradients: # otherwise global weights change only when accumulated gradients are applied
+					self.increment_global_version(i)
+				batch_error.append(train_info["critic"]) # the value loss is the squared TD error
 				# loss statistics
 				if flags.print_loss:
-					for key, value in train_info.items():
-						if key not in self._loss_list[i]:
-							self._loss_list[i][key] = deque()
-						self._loss_list[i][key].append(value)
-						if len(self._loss_list[i][key]) > flags.match_count_for_evaluation: # remove old statistics
-							self._loss_list[i][key].popleft()
+					self.add_to_loss_statistics(i, train_info)
 		return batch_error
 		
+	def apply_accumulated_gradients(self): # a single global update for all the batches trained since the last one
+		accumulating_models = self.accumulating_models
+		self.accumulating_models = set()
+		for i in accumulating_models:
+			apply_future = self.train_pipeline.call(self.get_model(i).apply_accumulated_gradients) # after the queued train ops, if any
+			apply_future.add_done_callback(lambda future, model_id=i: self.increment_global_version(model_id))
+		
+	def add_to_loss_statistics(self, model_id, train_info):
+		loss_dict = self._loss_list[model_id]
+		with self._loss_lock:
+			for key, value in train_info.items():
+				if key not in loss_dict:
+					loss_dict[key] = deque()
+				loss_dict[key].append(value)
+				if len(loss_dict[key]) > flags.match_count_for_evaluation: # remove old statistics
+					loss_dict[key].popleft()
+		
 	def bootstrap(self, state, concat=None):
 		agent_id = self.agent_id
 		internal_state = self.internal_states if flags.share_internal_state else self.internal_states[agent_id]
@@ -269,84 +612,197 @@ class BasicManager(object):
 		bootstrap = self.batch.bootstrap
 		bootstrap['internal_state'] = internal_state
 		bootstrap['agent_id'] = agent_id
-		bootstrap['state'] = state
+		bootstrap['state'] = self.state_codec.encode_state(state)
 		bootstrap['concat'] = concat
 		bootstrap['value'] = value_batch[0]
 		
+	def get_bootstrap_list(self, batch): # (agent_id, state, concat, internal_state, bootstrap key) of every bootstrap value of the batch
+		bootstrap = batch.bootstrap
+		if 'value' not in bootstrap:
+			return []
+		return [(bootstrap['agent_id'], bootstrap['state'], bootstrap['concat'], bootstrap['internal_state'], 'value')]
+		
+	def replay_shared_value(self, batch, bootstrap_list): # replay the values of the agents sharing the internal state
+		# The shared state is unrolled through the interleaved steps of these agents exactly as it was while acting: one forward pass per run of consecutive steps of the same agent, each run starting from the final state of the previous one.
+		run_list = [] # [agent_id, first position, step count]
+		for (agent_id, pos) in batch.step_generator():
+			if agent_id not in self.agents_set:
+				continue
+			if len(run_list) > 0 and run_list[-1][0] == agent_id:
+				run_list[-1][2] += 1
+			else:
+				run_list.append([agent_id, pos, 1])
+		internal_state = batch.internal_states[run_list[0][0]][0] if len(run_list) > 0 else None
+		for (agent_id, first_pos, step_count) in run_list:
+			step_slice = slice(first_pos, first_pos+step_count)
+			value_batch, internal_state = self.estimate_value(agent_id=agent_id, states=list(batch.states[agent_id][step_slice]), concats=list(batch.concats[agent_id][step_slice]), internal_state=internal_state)
+			batch.set_action({'values':value_batch}, agent_id, step_slice)
+		for (agent_id, bootstrap_state, bootstrap_concat, bootstrap_internal_state, bootstrap_key) in bootstrap_list: # the bootstrap state follows the last step
+			value_batch, _ = self.estimate_value(agent_id=agent_id, states=[bootstrap_state], concats=[bootstrap_concat], internal_state=internal_state if len(run_list) > 0 else bootstrap_internal_state)
+			batch.bootstrap[bootstrap_key] = value_batch[0]
+		
 	def replay_value(self, batch): # replay values
-		# replay values
-		for (agent_id,pos) in batch.step_generator():
-			concat, state, internal_state = batch.get_action(['concats','states','internal_states'], agent_id, pos)
-			value_batch, _ = self.estimate_value(agent_id=agent_id, states=[state], concats=[concat], internal_state=internal_state)
-			batch.set_action({'values':value_batch[0]}, agent_id, pos)
-		if 'value' in batch.bootstrap:
-			bootstrap = batch.bootstrap
-			agent_id = bootstrap['agent_id']
-			value_batch, _ = self.estimate_value(agent_id=agent_id, states=[bootstrap['state']], concats=[bootstrap['concat']], internal_state=bootstrap['internal_state'])
-			bootstrap['value'] = value_batch[0]
+		# One forward pass per agent, unrolling the LSTM from the stored internal state at the start of the agent sequence; a bootstrap state continues the sequence of its agent.
+		# The agents sharing the internal state (flags.share_internal_state) are replayed together by replay_shared_value, in the order their steps were taken.
+		if flags.shared_replay: # other threads may be replaying the same stored batch
+			batch = batch.copy_with_own_values()
+		bootstrap_list = self.get_bootstrap_list(batch)
+		shared_agents = self.agents_set if flags.share_internal_state else set()
+		if len(shared_agents) > 0:
+			self.replay_shared_value(batch, [b for b in bootstrap_list if b[0] in shared_agents])
+		for agent_id in range(self.model_size):
+			if agent_id in shared_agents:
+				continue
+			states = batch.states[agent_id]
+			step_count = len(states)
+			separate_bootstrap_list = [b for b in bootstrap_list if b[0] == agent_id]
+			if step_count > 0:
+				states = list(states)
+				concats = list(batch.concats[agent_id])
+				if len(separate_bootstrap_list) > 0:
+					_, bootstrap_state, bootstrap_concat, _, bootstrap_key = separate_bootstrap_list[0]
+					states.append(bootstrap_state)
+					concats.append(bootstrap_concat)
+					separate_bootstrap_list = separate_bootstrap_list[1:]
+				value_batch, _ = self.estimate_value(agent_id=agent_id, states=states, concats=concats, internal_state=batch.internal_states[agent_id][0])
+				batch.set_action({'values':value_batch[:step_count]}, agent_id, slice(0,step_count))
+				if len(value_batch) > step_count:
+					batch.bootstrap[bootstrap_key] = value_batch[step_count]
+			for (_, bootstrap_state, bootstrap_concat, bootstrap_internal_state, bootstrap_key) in separate_bootstrap_list:
+				value_batch, _ = self.estimate_value(agent_id=agent_id, states=[bootstrap_state], concats=[bootstrap_concat], internal_state=bootstrap_internal_state)
+				batch.bootstrap[bootstrap_key] = value_batch[0]
 		return self.compute_discounted_cumulative_reward(batch)
 		
-	def add_to_reward_prediction_buffer(self, batch):
-		batch_size = batch.get_size(self.agents_set)
-		if batch_size < 2:
-			return
-		batch_extrinsic_reward = batch.get_cumulative_reward(self.agents_set)[0]
-		self.reward_prediction_buffer.put(batch=batch, type_id=1 if batch_extrinsic_reward != 0 else 0) # process batch only after sampling, for better perfomance
-			
-	def get_reward_prediction_tuple(self, batch):
-		flat_states = [batch.get_action('states', agent_id, pos) for (agent_id,pos) in batch.step_generator(self.agents_set)]
-		flat_rewards = [batch.get_action('rewards', agent_id, pos) for (agent_id,pos) in batch.step_generator(self.agents_set)]
-		states_count = len(flat_states)
-		length = min(3, states_count-1)
-		start_idx = np.random.randint(states_count-length) if states_count > length else 0
-		reward_prediction_states = [flat_states[start_idx+i] for i in range(length)]
-		reward_prediction_target = np.zeros((1,3))
-		
-		target_reward = flat_rewards[start_idx+length][0] # use only extrinsic rewards
-		if target_reward == 0:
-			reward_prediction_target[0][0] = 1.0 # zero
-		elif target_reward > 0:
-			reward_prediction_target[0][1] = 1.0 # positive
-		else:
-			reward_prediction_target[0][2] = 1.0 # negative
-		return reward_prediction_states, reward_prediction_target
+	def add_to_reward_prediction_buffer(self, batch): # the buffer copies the examples cut from the batch, it does not keep the batch
+		flat_states = batch.get_flat_field('states', self.agents_set)
+		if flat_states is None:
+			return False
+		flat_rewards = batch.get_flat_field('rewards', self.agents_set)
+		self.reward_prediction_buffer.add(states=flat_states, rewards=flat_rewards[:,0]) # use only extrinsic rewards
+		return False
 			
 	def add_to_replay_buffer(self, batch, batch_error):
 		batch_size = batch.get_size(self.agents_set)
 		if batch_size < 1:
-			return
+			return False
 		batch_reward = batch.get_cumulative_reward(self.agents_set)
 		batch_extrinsic_reward = batch_reward[0]
 		batch_intrinsic_reward = batch_reward[1]
 		batch_tot_reward = batch_extrinsic_reward + batch_intrinsic_reward
 		if batch_tot_reward == 0 and flags.save_only_batches_with_reward:
-			return
+			return False
 		if flags.replay_using_default_internal_state:
 			batch.reset_internal_states()
 		type_id = (1 if batch_intrinsic_reward > 0 else (2 if batch_extrinsic_reward > 0 else 0))
 		if flags.prioritized_replay:
-			self.experience_buffer.put(batch=batch, priority=batch_tot_reward, type_id=type_id)
+			self.experience_buffer.put(batch=batch, priority=self.get_replay_priority(batch_error, batch_tot_reward), type_id=type_id)
 		else:
 			self.experience_buffer.put(batch=batch, type_id=type_id)
+		return flags.replay_backend != 'MemoryMapped' and not flags.replay_server_address # memory-mapped buffers and replay servers store a copy of the batch
+		
+	def get_replay_priority(self, batch_error, batch_reward): # None for the max priority of the buffer
+		if flags.replay_priority == 'Loss': # batch_error may not be ready yet with prefetching, or not per batch in a round: the batch gets the max priority
+			return self.get_loss_priority(batch_error) if len(batch_error) > 0 else None
+		return batch_reward
 		
-	def replay_experience(self):
+	def get_loss_priority(self, batch_error):
+		return (sum(batch_error) + flags.replay_priority_epsilon)**flags.replay_priority_alpha
+		
+	def replay_experience(self, n=None): # replay n batches, Poisson(flags.replay_ratio) by default
 		if not self.experience_buffer.has_atleast(flags.replay_start):
 			return
-		n = np.random.poisson(flags.replay_ratio)
-		for _ in range(n):
-			old_batch = self.experience_buffer.sample()
-			self.train(self.replay_value(old_batch) if flags.replay_value else old_batch)
+		if n is None:
+			n = np.random.poisson(flags.replay_ratio)
+		if n == 0:
+			return
+		if not flags.prioritized_replay:
+			for old_batch in self.burn_in(self.experience_buffer.sample_batch(n)):
+				self.train(self.replay_value(old_batch) if flags.replay_value else old_batch)
+				self.add_to_step_counts(replayed_steps=old_batch.get_size(self.agents_set))
+			return
+		sample_list = self.experience_buffer.keyed_sample_batch(n)
+		batch_error_list = []
+		for old_batch in self.burn_in([old_batch for (old_batch, _, _, _) in sample_list]):
+			batch_error_list.append(self.train(self.replay_value(old_batch) if flags.replay_value else old_batch))
+			self.add_to_step_counts(replayed_steps=old_batch.get_size(self.agents_set))
+		if flags.replay_priority == 'Loss': # refresh the priorities of the replayed batches, all together
+			self.train_pipeline.flush() # wait for the losses
+			updated_list = [(idx, type_id, entry_id, self.get_loss_priority(batch_error)) for ((_, idx, type_id, entry_id), batch_error) in zip(sample_list, batch_error_list) if len(batch_error) > 0]
+			if len(updated_list) > 0: # the buffer skips the batches replaced in the meantime by other threads
+				idx_list, type_id_list, entry_id_list, priority_list = zip(*updated_list)
+				self.experience_buffer.update_priorities(idx_list, priority_list, type_id_list, entry_id_list)
+		
+	def burn_in(self, batches):
+		# Refresh the start internal states of the replayed batches, running every model on the burn-in prefixes of all the batches with a single forward pass.
+		# The stored batches keep their internal states.
+		if flags.replay_burn_in == 0:
+			return batches
+		burned_in_batches = []
+		for batch in batches:
+			batch = copy.copy(batch)
+			batch.start_internal_states = list(batch.start_internal_states)
+			burned_in_batches.append(batch)
+		for agent_id in range(self.model_size):
+			agent_batches = [batch for batch in burned_in_batches if batch.get_agent_size(agent_id) > 0 and batch.get_burn_in_size(agent_id) > 0]
+			if len(agent_batches) == 0:
+				continue
+			internal_states = self.get_model(agent_id).burn_in(
+				states_list=[batch.burn_in_states[agent_id] for batch in agent_batches], 
+				concats_list=[batch.burn_in_concats[agent_id] for batch in agent_batches], 
+				internal_states=[batch.burn_in_internal_states[agent_id] for batch in agent_batches]
+			)
+			for (batch, internal_state) in zip(agent_batches, internal_states):
+				batch.start_internal_states[agent_id] = internal_state
+		return burned_in_batches
+		
+	def train_round(self, batches, global_step):
+		# Synchronous training: the batches of all the threads are trained together, for flags.round_epochs epochs.
+		# Every epoch is split in flags.round_minibatch_count minibatches of whole (shuffled) batches, because LSTM sequences cannot be cut.
+		if flags.predict_reward:
+			for batch in batches:
+				self.add_to_reward_prediction_buffer(batch)
+			if self.reward_prediction_buffer.is_empty():
+				return # cannot train without reward prediction, wait until reward_prediction_buffer is not empty
+		minibatch_count = min(flags.round_minibatch_count, len(batches))
+		shuffled_batches = list(batches)
+		for _ in range(flags.round_epochs):
+			np.random.shuffle(shuffled_batches)
+			for minibatch_indices in np.array_split(np.arange(len(shuffled_batches)), minibatch_count):
+				self.sync() # start from the latest global weights
+				self.train_sequences([shuffled_batches[j] for j in minibatch_indices])
+				if flags.accumulate_gradients:
+					self.apply_accumulated_gradients()
+		self.add_to_step_counts(env_steps=sum(batch.get_size(self.agents_set) for batch in batches))
+		# experience replay (after training!)
+		if flags.replay_ratio > 0 and global_step > flags.replay_step:
+			if flags.replay_learner_count == 0: # otherwise replay learners do it
+				self.replay_experience()
+			for batch in batches:
+				self.add_to_replay_buffer(batch, []) # the losses of a minibatch are not per batch
+			if flags.accumulate_gradients:
+				self.apply_accumulated_gradients()
 		
 	def process_batch(self, global_step):
 		batch = self.compute_discounted_cumulative_reward(self.batch)
+		if flags.synchronous_training: # trained at the end of the round, together with the batches of the other threads
+			self.round_batches.append(batch)
+			return
+		batch_is_stored = False # whether a buffer keeps the batch
 		# reward prediction
 		if flags.predict_reward:
-			self.add_to_reward_prediction_buffer(batch) # do it before training, this way there will be at least one batch in the reward_prediction_buffer
+			batch_is_stored = self.add_to_reward_prediction_buffer(batch) # do it before training, this way there will be at least one example in the reward_prediction_buffer
 			if self.reward_prediction_buffer.is_empty():
 				return # cannot train without reward prediction, wait until reward_prediction_buffer is not empty
 		# train
 		batch_error = self.train(batch)
+		self.add_to_step_counts(env_steps=batch.get_size(self.agents_set))
 		# experience replay (after training!)
 		if flags.replay_ratio > 0 and global_step > flags.replay_step:
-			self.replay_experience()
-			self.add_to_replay_buffer(batch, batch_error)
\ No newline at end of file
+			if flags.replay_learner_count == 0: # otherwise replay learners do it
+				self.replay_experience()
+			batch_is_stored = self.add_to_replay_buffer(batch, batch_error) or batch_is_stored
+		# apply the gradients of the batch and of its replays all together
+		if flags.accumulate_gradients:
+			self.apply_accumulated_gradients()
+		if not batch_is_stored:
+			self.recycle_batch(batch)
\ No newline at end of file
@@ -41,7 +41,8 @@ class KMeansPartitioner(BasicManager):
 				concat_size=concat_size, 
 				clip=self.clip[i], 
 				predict_reward=flags.predict_reward, 
-				training = self.training
+				training = self.training,
+				state_codec=self.state_codec
 			)
 			self.model_list.append(agent)
 		# bind partition nets to training net
@@ -59,6 +60,8 @@ class KMeansPartitioner(BasicManager):
 	def sync_with_training_net(self):
 		for i in range(1,self.model_size):
 			self.model_list[i].sync(self.sync_list[i-1])
+			with self.version_lock:
+				self.model_versions[i] += 1
 		
 	def get_state_partition(self, state):
 		id = self.partitioner.predict([state.flatten()])[0]
@@ -79,7 +82,7 @@ class KMeansPartitioner(BasicManager):
 		with self.lock:
 			if not self.partitioner_trained:
 				for i in range(0,len(states),flags.partitioner_granularity):
-					state = states[i]
+					state = self.state_codec.decode_state(states[i]) # batch states are encoded
 					self.buffer.put(batch=state.flatten())
 					if self.buffer.is_full():
 						print ("Buffer is full, starting partitioner training")
@@ -36,7 +36,8 @@ class ReinforcementLearningPartitioner(BasicManager):
 			beta=flags.partitioner_beta, 
 			clip=self.clip[0], 
 			predict_reward=flags.predict_reward, 
-			training = self.training
+			training = self.training,
+			state_codec=self.state_codec
 		)
 		self.model_list.append(manager)
 		# the agents
@@ -53,7 +54,8 @@ class ReinforcementLearningPartitioner(BasicManager):
 				predict_reward=flags.predict_reward, 
 				training = self.training, 
 				parent = manager, 
-				sibling = self.model_list[1] if i > 0 else None # the first agent (non manager)
+				sibling = self.model_list[1] if i > 0 else None, # the first agent (non manager)
+				state_codec=self.state_codec
 			)
 			self.model_list.append(agent)
 			
@@ -65,10 +67,10 @@ class ReinforcementLearningPartitioner(BasicManager):
 		self.gradient_optimizer[0] = eval('tf.train.'+flags.partitioner_optimizer+'Optimizer')(learning_rate=self.learning_rate[0], use_locking=True)
 		
 	def get_state_partition(self, state, concat=None, internal_state=None):
-		action_batch, value_batch, policy_batch, new_internal_state = self.get_model(0).predict_action(states=[state], concats=[concat], internal_state=internal_state)
-		id = np.argwhere(action_batch[0]==1)[0][0]+1
+		action, value, policy, new_internal_state = self.estimate_action(agent_id=0, state=state, concat=concat, internal_state=internal_state)
+		id = np.argwhere(action==1)[0][0]+1
 		self.add_to_statistics(id)
-		return id, action_batch[0], value_batch[0], policy_batch[0], new_internal_state
+		return id, action, value, policy, new_internal_state
 		
 	def query_partitioner(self, step):
 		return step%flags.partitioner_granularity==0
@@ -102,6 +104,8 @@ class ReinforcementLearningPartitioner(BasicManager):
 			self.last_manager_reward = np.zeros(2) # [extrinsic, intrinsic] # N.B.: the query reward is unknown since bootstrap or a new query starts
 			if self.training:
 				self.batch.add_action(agent_id=0, state=state, concat=manager_concat, action=manager_action, policy=manager_policy, reward=self.last_manager_reward, value=manager_value, internal_state=internal_state)
+				if flags.replay_burn_in > 0:
+					self.burn_in_windows[0].append(self.state_codec.encode_state(state), manager_concat, internal_state)
 			
 		new_state, value, action, total_reward, terminal, policy = super().act(act_function, state, concat)
 		# keep query reward updated
@@ -120,12 +124,22 @@ class ReinforcementLearningPartitioner(BasicManager):
 			self.agent_id = new_agent_id
 		super().bootstrap(state, concat)
 		
-	def replay_value(self, batch): # replay values
-		if 'manager_value' in batch.bootstrap: # do it before calling super().replay_value(batch)
+	def get_bootstrap_list(self, batch):
+		bootstrap_list = super().get_bootstrap_list(batch)
+		if 'manager_value' in batch.bootstrap:
 			bootstrap = batch.bootstrap
-			value_batch, _ = self.estimate_value(agent_id=0, states=[bootstrap['state']], concats=[bootstrap['manager_concat']], internal_state=bootstrap['manager_internal_state'])
-			bootstrap['manager_value'] = value_batch[0]
-		return super().replay_value(batch)
+			bootstrap_list.append( (0, bootstrap['state'], bootstrap['manager_concat'], bootstrap['manager_internal_state'], 'manager_value') )
+		return bootstrap_list
+		
+	def get_gamma(self, agent_id):
+		if agent_id == 0:
+			return flags.partitioner_gamma
+		return super().get_gamma(agent_id)
+		
+	def get_bootstrap_value(self, batch, agent_id):
+		if agent_id == 0:
+			return batch.bootstrap['manager_value'] if 'manager_value' in batch.bootstrap else 0.
+		return super().get_bootstrap_value(batch, agent_id)
 		
 	def compute_discounted_cumulative_reward(self, batch):
 		batch.compute_discounted_cumulative_reward(agents=self.agents_set, last_value=batch.bootstrap['value'] if 'value' in batch.bootstrap else 0., gamma=flags.gamma, lambd=flags.lambd)
@@ -11,13 +11,16 @@ flags = options.get()
 
 from agent.loss.policy_loss import PolicyLoss
 from agent.loss.value_loss import ValueLoss
+from agent.loss.vtrace import VTrace
 from utils.distributions import Categorical, Normal
+from utils.observation_codec import ObservationCodec
 
 class BaseAC_Network(object):
 	lstm_units = 64 # the number of units of the LSTM
 		
-	def __init__(self, session, id, state_shape, action_shape, clip, device, predict_reward, concat_size=0, beta=None, training=True, parent=None, sibling=None):
+	def __init__(self, session, id, state_shape, action_shape, clip, device, predict_reward, concat_size=0, beta=None, training=True, parent=None, sibling=None, state_codec=None):
 		self.train_count = 0
+		self._callables = {} # session callables, one per fetch and feed signature
 		self.beta = beta if beta is not None else flags.beta
 		self.clip = clip
 		self.predict_reward = predict_reward
@@ -32,6 +35,7 @@ class BaseAC_Network(object):
 		self.policy_depth = action_shape[1] if len(action_shape) > 1 else 0 # number of discrete action types: set 0 for continuous control
 		self.concat_size = concat_size # the size of the vector concatenated with the CNN output before entering the LSTM
 		self.state_shape = state_shape # the shape of the input
+		self.state_codec = state_codec if state_codec is not None else ObservationCodec(state_shape) # states are fed encoded
 		# Create the network
 		self.create_network()
 		# Prepare loss
@@ -60,16 +64,17 @@ class BaseAC_Network(object):
 			self.old_action_batch = self._action_placeholder("old_action_batch")
 			self.cumulative_reward_batch = self._value_placeholder("cumulative_reward")
 			self.advantage_batch = self._value_placeholder("advantage")
-			self.lstm_initial_state = self._lstm_state_placeholder(batch_size=1, units=self.lstm_units, name="initial_lstm_state") # for stateful lstm
+			self.lstm_initial_state = self._lstm_state_placeholder(units=self.lstm_units, name="initial_lstm_state") # for stateful lstm, one row per sequence
 			self.lstm_default_state = self._lstm_default_state(batch_size=1, units=self.lstm_units)
+			self._sequence_placeholders(sequence_count=tf.shape(self.lstm_initial_state[0])[0])
 			# [Batch Normalization]
 			# _, self.state_batch_norm = self._batch_norm_layer(input=self.state_batch, scope="Global", name="State", share_trainables=False) # global
 			# [CNN]
-			self.cnn = self._cnn_layer(input=self.state_batch, scope=parent_scope_name)
+			self.cnn = self._cnn_layer(input=self.state_codec.decode_tensor(self.state_batch), scope=parent_scope_name)
 			# [Concat]
 			self.concat = self._concat_layer(input=self.cnn, concat=self.concat_batch, units=self.lstm_units, scope=parent_scope_name)
 			# [LSTM]
-			self.lstm, self.lstm_final_state = self._lstm_layer(input=self.concat, initial_state=self.lstm_initial_state, scope=sibling_scope_name)
+			self.lstm, self.lstm_final_state = self._lstm_layer(input=self.concat, initial_state=self.lstm_initial_state, sequence_length=self.sequence_length_batch, scope=sibling_scope_name)
 			# [Policy]
 			self.policy_batch = self._policy_layer(input=self.lstm, scope=scope_name)
 			# [Value]
@@ -78,7 +83,7 @@ class BaseAC_Network(object):
 			if self.predict_reward:
 				self.reward_prediction_state_batch = self._state_placeholder("reward_prediction_state")
 				# reusing with a different placeholder seems to cause memory leaks
-				reward_prediction_cnn = self._cnn_layer(input=self.reward_prediction_state_batch, scope=parent_scope_name)
+				reward_prediction_cnn = self._cnn_layer(input=self.state_codec.decode_tensor(self.reward_prediction_state_batch), scope=parent_scope_name)
 				self.reward_prediction_logits = self._reward_prediction_layer(input=reward_prediction_cnn, scope=parent_scope_name)
 		# Sample action, after getting keys
 		self.action_batch = self.sample_actions()
@@ -86,6 +91,7 @@ class BaseAC_Network(object):
 		# self.fentropy = self.get_feature_entropy(input=self.lstm, scope=scope_name)
 		# Print shapes
 		print( "    [{}]Input shape: {}".format(self.id, self.state_batch.get_shape()) )
+		print( "    [{}]State encoding: {} ({:.1f}x smaller than float32)".format(self.id, self.state_batch.dtype.name, self.state_codec.get_compression_ratio()) )
 		print( "    [{}]Concatenation shape: {}".format(self.id, self.concat_batch.get_shape()) )
 		print( "    [{}]Tower shape: {}".format(self.id, self.cnn.get_shape()) )
 		print( "    [{}]Concat shape: {}".format(self.id, self.concat.get_shape()) )
@@ -146,17 +152,17 @@ class BaseAC_Network(object):
 			# Return result
 			return input
 	
-	def _lstm_layer(self, input, initial_state, scope, name="", share_trainables=True):
+	def _lstm_layer(self, input, initial_state, scope, name="", share_trainables=True, sequence_length=None):
 		with tf.variable_scope(scope), tf.variable_scope("LSTM{}".format(name), reuse=tf.AUTO_REUSE) as variable_scope:
 			print( "    [{}]Building scope: {}".format(self.id, variable_scope.name) )
 			if len(input.get_shape()) > 2:
 				input = tf.layers.flatten(input)
-			sequence_length = [tf.shape(input)[0]]
-			state_shape = initial_state[0].get_shape().as_list()
-			batch_size = state_shape[0]
-			units = state_shape[1]
-			# Add batch dimension
-			input = tf.reshape(input, [-1, batch_size, input.get_shape().as_list()[-1]])
+			units = initial_state[0].get_shape().as_list()[1]
+			sequence_count = tf.shape(initial_state[0])[0] # 1 when training, one per worker/environment when acting in parallel
+			# Add batch dimension: the input is a time-major sequence of sequence_count rows
+			input = tf.reshape(input, [-1, sequence_count, input.get_shape().as_list()[-1]])
+			if sequence_length is None:
+				sequence_length = tf.fill([sequence_count], tf.shape(input)[0])
 			# Build LSTM cell
 			# lstm_cell = tf.contrib.model_pruning.MaskedBasicLSTMCell(num_units=units, forget_bias=1.0, state_is_tuple=True, activation=None)
 			lstm_cell = tf.nn.rnn_cell.BasicLSTMCell(num_units=units, state_is_tuple=True) # using BasicLSTMCell instead of LSTMCell
@@ -255,15 +261,36 @@ class BaseAC_Network(object):
 				advantage=self.advantage_batch, 
 				# entropy=self.fentropy, 
 				entropy=new_policy_distributions.entropy(), 
-				beta=self.beta
+				beta=self.beta,
+				step_mask=self.step_mask
 			)
+			critic_target = self.cumulative_reward_batch
+			# [V-trace]
+			if flags.use_vtrace: # off-policy corrected advantages and critic targets
+				self.reward_batch = self._value_placeholder("reward")
+				self.bootstrap_value = self._value_placeholder("bootstrap_value") # one per sequence
+				self.discount = self._scalar_placeholder("discount")
+				vtrace = VTrace(
+					log_ratio=policy_loss_builder.get_sequence_log_ratio(), 
+					value=self.value_batch, 
+					bootstrap_value=self.bootstrap_value, 
+					reward=self.reward_batch, 
+					discount=self.discount, 
+					rho_clip=flags.vtrace_rho_clip, 
+					c_clip=flags.vtrace_c_clip,
+					valid_mask=self.step_mask,
+					sequence_count=self.sequence_count
+				)
+				critic_target = vtrace.get_target_value()
+				policy_loss_builder.advantage = policy_loss_builder.mask(vtrace.get_advantage(critic_target))
 			self.policy_loss = policy_loss_builder.get()
 			# [Critic loss]
 			value_loss_builder = ValueLoss(
 				cliprange=self.clip, 
 				value=self.value_batch, 
 				old_value=self.old_value_batch, 
-				reward=self.cumulative_reward_batch
+				reward=critic_target,
+				step_mask=self.step_mask
 			)
 			self.value_loss = flags.value_coefficient * value_loss_builder.get() # usually critic has lower learning rate
 			# [Extra loss]
@@ -277,13 +304,33 @@ class BaseAC_Network(object):
 			self.total_loss = self.policy_loss+self.value_loss+self.extra_loss
 			
 	def minimize_local_loss(self, optimizer, global_step, global_var_list): # minimize loss and apply gradients to global vars.
+		if flags.accumulate_gradients: # build accumulators before the control dependencies, their initializers do not depend on batch normalization
+			if flags.accumulated_gradients_reduction not in ('Sum', 'Mean'):
+				raise ValueError("unknown accumulated_gradients_reduction {}, use Sum or Mean".format(flags.accumulated_gradients_reduction))
+			# accumulators are local variables: they are not saved in checkpoints, that can be restored with or without gradient accumulation
+			with tf.device(self.device), tf.variable_scope("GradientAccumulator{0}".format(self.id)):
+				gradient_accumulators = [tf.Variable(tf.zeros(var.get_shape(), dtype=var.dtype.base_dtype), trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES]) for var in global_var_list]
+				accumulated_batches = tf.Variable(0., trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES])
 		with tf.device(self.device) and tf.control_dependencies(self.update_keys): # control_dependencies is for batch normalization
 			var_refs = [v._ref() for v in self.get_shared_keys()]
 			local_gradients = tf.gradients(self.total_loss, var_refs, gate_gradients=False, aggregation_method=None, colocate_gradients_with_ops=False)
 			if flags.grad_norm_clip > 0:
 				local_gradients, _ = tf.clip_by_global_norm(local_gradients, flags.grad_norm_clip)
-			grads_and_vars = list(zip(local_gradients, global_var_list))
-			self.train_op = optimizer.apply_gradients(grads_and_vars, global_step=global_step)
+			if flags.accumulate_gradients: # the train op only sums local gradients, apply_accumulated_gradients_op applies their sum (or mean) to global vars
+				self.train_op = tf.group(accumulated_batches.assign_add(1.), *[accumulator.assign_add(gradient) for (accumulator, gradient) in zip(gradient_accumulators, local_gradients)])
+				if flags.accumulated_gradients_reduction == 'Mean':
+					accumulated_gradients = [accumulator/tf.maximum(1., accumulated_batches) for accumulator in gradient_accumulators]
+				else:
+					accumulated_gradients = [accumulator.read_value() for accumulator in gradient_accumulators]
+				apply_op = optimizer.apply_gradients(list(zip(accumulated_gradients, global_var_list)), global_step=global_step)
+				with tf.control_dependencies([apply_op]): # reset accumulators
+					self.apply_accumulated_gradients_op = tf.group(accumulated_batches.assign(0.), *[accumulator.assign(tf.zeros_like(accumulator)) for accumulator in gradient_accumulators])
+			else:
+				grads_and_vars = list(zip(local_gradients, global_var_list))
+				self.train_op = optimizer.apply_gradients(grads_and_vars, global_step=global_step)
+				
+	def apply_accumulated_gradients(self):
+		self.session.run(fetches=self.apply_accumulated_gradients_op)
 			
 	def bind_sync(self, src_network, name=None):
 		with tf.device(self.device), tf.name_scope(name, "Sync{0}".format(self.id),[]) as name:
@@ -301,41 +348,173 @@ class BaseAC_Network(object):
 	def get_shared_keys(self):
 		return self.shared_keys # get model variables
 		
-	def predict_action(self, states, concats=None, internal_state=None):
+	def get_weights(self):
+		return self.session.run(fetches=self.get_shared_keys())
+		
+	def set_weights(self, weights):
+		if not hasattr(self, 'weights_assign_op'): # built lazily: it is used only where the graph is not finalized (eg: actor processes)
+			with tf.device(self.device), tf.name_scope("SetWeights{0}".format(self.id)):
+				self.weights_placeholders = [tf.placeholder(dtype=var.dtype.base_dtype, shape=var.get_shape()) for var in self.get_shared_keys()]
+				self.weights_assign_op = tf.group(*[tf.assign(var, placeholder) for (var, placeholder) in zip(self.get_shared_keys(), self.weights_placeholders)])
+		self.session.run(fetches=self.weights_assign_op, feed_dict=dict(zip(self.weights_placeholders, weights)))
+		
+	def _get_callable(self, key, build_signature):
+		# Session.make_callable skips the per-call parsing of fetches and feeds done by session.run
+		run_callable = self._callables.get(key)
+		if run_callable is None:
+			fetches, feed_list = build_signature()
+			run_callable = self._callables[key] = self.session.make_callable(fetches=fetches, feed_list=feed_list)
+		return run_callable
+		
+	def _get_predict_feed_list(self):
+		feed_list = [self.state_batch, self.lstm_initial_state[0], self.lstm_initial_state[1]]
+		if self.concat_size > 0:
+			feed_list.append(self.concat_batch)
+		return feed_list
+		
+	def _get_predict_feed_values(self, states, concats, internal_state): # callables do not convert feeds to the placeholder type
+		states = self.state_codec.encode(states)
 		if internal_state is None:
 			internal_state = self.lstm_default_state
-		feed_dict = { self.state_batch : states, self.lstm_initial_state: internal_state }
 		if self.concat_size > 0:
-			feed_dict.update( { self.concat_batch : concats } )
+			return (states, internal_state[0], internal_state[1], np.asarray(concats, dtype=np.float32))
+		return (states, internal_state[0], internal_state[1])
+		
+	def get_predict_action_fetches(self): # action_batch, value_batch, policy_batch, new_internal_state
+		return [self.action_batch, self.value_batch, self.policy_batch, self.lstm_final_state]
+		
+	def get_predict_value_fetches(self): # value_batch, new_internal_state
+		return [self.value_batch, self.lstm_final_state]
+		
+	def predict_action(self, states, concats=None, internal_state=None):
+		predict_action_callable = self._get_callable('predict_action', lambda: (self.get_predict_action_fetches(), self._get_predict_feed_list()))
 		# return action_batch, value_batch, policy_batch, new_internal_state
-		return self.session.run(fetches=[self.action_batch, self.value_batch, self.policy_batch, self.lstm_final_state], feed_dict=feed_dict)
+		return predict_action_callable(*self._get_predict_feed_values(states, concats, internal_state))
+				
+	def predict_parallel_action(self, states, concats=None, internal_states=None):
+		# one step for each of the given sequences, with a single forward pass
+		internal_state = self._concatenate_internal_states(internal_states, len(states))
+		action_batch, value_batch, policy_batch, new_internal_state = self.predict_action(states=states, concats=concats, internal_state=internal_state)
+		# return action_batch, value_batch, policy_batch, new_internal_states
+		return action_batch, value_batch, policy_batch, self._split_internal_state(new_internal_state)
+				
+	def predict_parallel_value(self, states, concats=None, internal_states=None):
+		# one step for each of the given sequences, with a single forward pass
+		internal_state = self._concatenate_internal_states(internal_states, len(states))
+		value_batch, new_internal_state = self.predict_value(states=states, concats=concats, internal_state=internal_state)
+		# return value_batch, new_internal_states
+		return value_batch, self._split_internal_state(new_internal_state)
+		
+	def burn_in(self, states_list, concats_list=None, internal_states=None):
+		# Unroll the LSTM on many sequences (eg: the burn-in prefixes of the replayed batches) with a single forward pass.
+		# Sequences are padded to the longest one and laid out time-major, returns the final internal state of every sequence.
+		burn_in_callable = self._get_callable('burn_in', lambda: (self.lstm_final_state, self._get_predict_feed_list()+[self.sequence_length_batch]))
+		sequence_length = [len(states) for states in states_list]
+		states = self._pad_sequences([self.state_codec.encode(states) for states in states_list], max(sequence_length))
+		concats = self._pad_sequences(concats_list, max(sequence_length)) if self.concat_size > 0 else None
+		internal_state = self._concatenate_internal_states(internal_states, len(states_list))
+		final_state = burn_in_callable(*self._get_predict_feed_values(states, concats, internal_state), np.asarray(sequence_length, dtype=np.int32))
+		return self._split_internal_state(final_state)
+				
+	def _concatenate_internal_states(self, internal_states, sequence_count):
+		if internal_states is None:
+			internal_states = [None]*sequence_count
+		internal_states = [self.lstm_default_state if s is None else s for s in internal_states]
+		return (np.concatenate([s[0] for s in internal_states]), np.concatenate([s[1] for s in internal_states]))
+		
+	def _split_internal_state(self, internal_state):
+		state0, state1 = internal_state
+		return [(state0[i:i+1], state1[i:i+1]) for i in range(len(state0))]
 				
 	def predict_value(self, states, concats=None, internal_state=None):
-		if internal_state is None:
-			internal_state = self.lstm_default_state
-		feed_dict = { self.state_batch : states, self.lstm_initial_state: internal_state }
-		if self.concat_size > 0:
-			feed_dict.update( { self.concat_batch : concats } )
+		predict_value_callable = self._get_callable('predict_value', lambda: (self.get_predict_value_fetches(), self._get_predict_feed_list()))
 		#return value_batch, new_internal_state
-		return self.session.run(fetches=[self.value_batch, self.lstm_final_state], feed_dict=feed_dict)
+		return predict_value_callable(*self._get_predict_feed_values(states, concats, internal_state))
 				
-	def train(self, states, actions, rewards, values, policies, discounted_cumulative_rewards, generalized_advantage_estimators, concats=None, internal_state=None, reward_prediction_states=None, reward_prediction_target=None):
+	def train(self, states, actions, rewards, values, policies, discounted_cumulative_rewards, generalized_advantage_estimators, concats=None, internal_state=None, reward_prediction_states=None, reward_prediction_target=None, bootstrap_value=0., gamma=None):
+		feed_dict = self.get_train_feed(states, actions, rewards, values, policies, discounted_cumulative_rewards, generalized_advantage_estimators, concats, internal_state, reward_prediction_states, reward_prediction_target, bootstrap_value, gamma)
+		return self.run_train_op(feed_dict)
+		
+	def get_train_feed(self, states, actions, rewards, values, policies, discounted_cumulative_rewards, generalized_advantage_estimators, concats=None, internal_state=None, reward_prediction_states=None, reward_prediction_target=None, bootstrap_value=0., gamma=None):
 		self.train_count += len(states)
 		feed_dict = self.build_train_feed(states, actions, rewards, values, policies, discounted_cumulative_rewards, generalized_advantage_estimators, concats, internal_state, reward_prediction_states, reward_prediction_target)
-		# run train op
-		fetches=[
+		if flags.use_vtrace:
+			feed_dict.update( {
+				self.reward_batch: np.sum(rewards, -1), # extrinsic + intrinsic reward
+				self.bootstrap_value: [bootstrap_value],
+				self.discount: gamma if gamma is not None else flags.gamma
+			} )
+		return self.convert_feed(feed_dict)
+		
+	def convert_feed(self, feed_dict):
+		# Convert lists of arrays to contiguous arrays of the placeholder type, so that session.run has nothing left to convert.
+		# This is the host-side cost of a train step that a prefetching thread can overlap with the previous step.
+		converted_feed_dict = {}
+		for (key, value) in feed_dict.items():
+			if isinstance(key, tuple): # eg: the lstm state
+				for (sub_key, sub_value) in zip(key, value):
+					converted_feed_dict[sub_key] = np.ascontiguousarray(sub_value, dtype=sub_key.dtype.as_numpy_dtype)
+			else:
+				converted_feed_dict[key] = np.ascontiguousarray(value, dtype=key.dtype.as_numpy_dtype)
+		return converted_feed_dict
+		
+	def train_sequences(self, sequences, reward_prediction_states=None, reward_prediction_target=None, gamma=None):
+		# Train many sequences (eg: the batches of all the workers) with a single gradient step.
+		# Every sequence is a dict with the arguments of train; sequences are padded to the longest one and laid out time-major.
+		sequence_length = [len(sequence['states']) for sequence in sequences]
+		self.train_count += sum(sequence_length)
+		def pad(key): # shape: (max_length*len(sequences), ...)
+			return self._pad_sequences([sequence[key] for sequence in sequences], max(sequence_length))
+		internal_states = [sequence['internal_state'] for sequence in sequences]
+		feed_dict = self.build_train_feed(
+			states=pad('states'), actions=pad('actions'), rewards=pad('rewards'), values=pad('values'), policies=pad('policies'), 
+			discounted_cumulative_rewards=pad('discounted_cumulative_rewards'), generalized_advantage_estimators=pad('generalized_advantage_estimators'), 
+			concats=pad('concats') if self.concat_size > 0 else None, 
+			internal_state=self._concatenate_internal_states(internal_states, len(sequences)), 
+			reward_prediction_states=reward_prediction_states, reward_prediction_target=reward_prediction_target
+		)
+		feed_dict.update( self.build_sequence_feed(sequence_count=len(sequences), sequence_length=sequence_length) )
+		if flags.use_vtrace:
+			feed_dict.update( {
+				self.reward_batch: np.sum(pad('rewards'), -1), # extrinsic + intrinsic reward
+				self.bootstrap_value: [sequence['bootstrap_value'] for sequence in sequences],
+				self.discount: gamma if gamma is not None else flags.gamma
+			} )
+		return self.run_train_op(self.convert_feed(feed_dict))
+		
+	def build_sequence_feed(self, sequence_count, sequence_length):
+		return { self.sequence_length_batch: sequence_length }
+		
+	def _pad_sequences(self, sequences, max_length):
+		padded_sequences = []
+		for sequence in sequences:
+			sequence = np.asarray(sequence) # keep the type of encoded states
+			padding = np.zeros((max_length-len(sequence),)+sequence.shape[1:], dtype=sequence.dtype)
+			padded_sequences.append(np.concatenate([sequence, padding]))
+		return np.reshape(np.stack(padded_sequences, 1), (-1,)+padded_sequences[0].shape[1:]) # time-major
+		
+	def get_train_fetches(self):
+		return [
 			self.train_op, # Minimize gradients and copy them to global network
 			self.total_loss, 
 			self.policy_loss, self.value_loss, self.extra_loss, 
 			self.policy_kl_divergence, self.policy_clipping_frequency, self.policy_entropy_contribution
 		]
-		_, total_loss, policy_loss, value_loss, extra_loss, policy_kl_divergence, policy_clipping_frequency, policy_entropy_contribution = self.session.run(fetches=fetches, feed_dict=feed_dict)
+		
+	def build_train_result(self, fetched_values): # fetched_values are the values of get_train_fetches
+		_, total_loss, policy_loss, value_loss, extra_loss, policy_kl_divergence, policy_clipping_frequency, policy_entropy_contribution = fetched_values
 		# build and return loss dict
 		train_info = {"actor": policy_loss, "critic": value_loss, "actor_kl_divergence": policy_kl_divergence, "actor_clipping_frequency": policy_clipping_frequency, "actor_entropy_contribution": policy_entropy_contribution}
 		if self.predict_reward:
 			train_info.update( {"extra": extra_loss} )
 		return total_loss, train_info
 		
+	def run_train_op(self, feed_dict): # feed_dict must be converted: its keys are placeholders, not tuples of placeholders
+		# run train op, with a callable for every train signature (eg: with or without reward prediction)
+		feed_list = tuple(feed_dict.keys())
+		train_callable = self._get_callable(('train',)+feed_list, lambda: (self.get_train_fetches(), list(feed_list)))
+		return self.build_train_result(train_callable(*feed_dict.values()))
+		
 	def build_train_feed(self, states, actions, rewards, values, policies, discounted_cumulative_rewards, generalized_advantage_estimators, concats, internal_state, reward_prediction_states, reward_prediction_target):
 		values = np.reshape(values,[-1])
 		if flags.use_GAE: # Schulman, John, et al. "High-dimensional continuous control using generalized advantage estimation." arXiv preprint arXiv:1506.02438 (2015).
@@ -347,7 +526,7 @@ class BaseAC_Network(object):
 		if internal_state is None:
 			internal_state = self.lstm_default_state
 		feed_dict={
-				self.state_batch: states,
+				self.state_batch: self.state_codec.encode(states),
 				self.advantage_batch: advantages,
 				self.cumulative_reward_batch: cumulative_rewards,
 				self.old_value_batch: values,
@@ -359,7 +538,7 @@ class BaseAC_Network(object):
 			feed_dict.update( {self.concat_batch : concats} )
 		if self.predict_reward:
 			feed_dict.update( {
-				self.reward_prediction_state_batch: reward_prediction_states,
+				self.reward_prediction_state_batch: self.state_codec.encode(reward_prediction_states),
 				self.reward_prediction_labels: reward_prediction_target
 			} )
 		return feed_dict
@@ -395,6 +574,13 @@ class BaseAC_Network(object):
 	def _value_placeholder(self, name=None, batch_size=None):
 		return tf.placeholder(dtype=tf.float32, shape=[batch_size], name=name)
 		
+	def _sequence_placeholders(self, sequence_count):
+		# Many sequences can be trained at once, laid out time-major and padded to the length of the longest one
+		self.sequence_count = sequence_count
+		step_count = tf.shape(self.state_batch)[0] // sequence_count
+		self.sequence_length_batch = tf.placeholder_with_default(input=tf.fill([sequence_count], step_count), shape=[None], name="sequence_length")
+		self.step_mask = tf.reshape(tf.transpose(tf.sequence_mask(self.sequence_length_batch, maxlen=step_count)), [-1]) # False for padding steps
+		
 	def _scalar_placeholder(self, name=None):
 		return tf.placeholder(dtype=tf.float32, shape=(), name=name)
 		
@@ -403,7 +589,7 @@ class BaseAC_Network(object):
 		input = tf.zeros(shape if batch_size is not None else [1] + shape[1:]) # default value
 		return tf.placeholder_with_default(input=input, shape=shape, name=name) # with default we can use batch normalization directly on it
 
-	def _state_placeholder(self, name=None, batch_size=None):
-		shape = [batch_size] + list(self.state_shape)
-		input = tf.zeros(shape if batch_size is not None else [1] + shape[1:]) # default value
+	def _state_placeholder(self, name=None, batch_size=None): # encoded states
+		shape = [batch_size] + list(self.state_codec.get_encoded_shape())
+		input = tf.zeros(shape if batch_size is not None else [1] + shape[1:], dtype=self.state_codec.dtype) # default value
 		return tf.placeholder_with_default(input=input, shape=shape, name=name) # with default we can use batch normalization directly on it
\ No newline at end of file
@@ -31,10 +31,12 @@ class NoLSTMAC_Network(BaseAC_Network):
 			self.old_action_batch = self._action_placeholder("old_action_batch")
 			self.cumulative_reward_batch = self._value_placeholder("cumulative_reward")
 			self.advantage_batch = self._value_placeholder("advantage")
+			self.sequence_count_batch = tf.placeholder_with_default(input=1, shape=(), name="sequence_count") # there is no internal state to get it from
+			self._sequence_placeholders(sequence_count=self.sequence_count_batch)
 			# [Batch Normalization]
 			# _, self.state_batch_norm = self._batch_norm_layer(input=self.state_batch, scope="Global", name="State", share_trainables=False) # global
 			# [CNN]
-			self.cnn = self._cnn_layer(input=self.state_batch, scope=scope_name)
+			self.cnn = self._cnn_layer(input=self.state_codec.decode_tensor(self.state_batch), scope=scope_name)
 			# [Concat]
 			self.concat = self._concat_layer(input=self.cnn, concat=self.concat_batch, units=self.lstm_units, scope=scope_name)
 			# [Policy]
@@ -45,7 +47,7 @@ class NoLSTMAC_Network(BaseAC_Network):
 			if self.predict_reward:
 				self.reward_prediction_state_batch = self._state_placeholder("reward_prediction_state")
 				# reusing with a different placeholder seems to cause memory leaks
-				reward_prediction_cnn = self._cnn_layer(input=self.reward_prediction_state_batch, scope=scope_name)
+				reward_prediction_cnn = self._cnn_layer(input=self.state_codec.decode_tensor(self.reward_prediction_state_batch), scope=scope_name)
 				self.reward_prediction_logits = self._reward_prediction_layer(input=reward_prediction_cnn, scope=scope_name)
 		# Sample action, after getting keys
 		self.action_batch = self.sample_actions()
@@ -53,6 +55,7 @@ class NoLSTMAC_Network(BaseAC_Network):
 		# self.fentropy = self.get_feature_entropy(input=self.cnn, scope=scope_name)
 		# Print shapes
 		print( "    [{}]Input shape: {}".format(self.id, self.state_batch.get_shape()) )
+		print( "    [{}]State encoding: {} ({:.1f}x smaller than float32)".format(self.id, self.state_batch.dtype.name, self.state_codec.get_compression_ratio()) )
 		print( "    [{}]Concatenation shape: {}".format(self.id, self.concat_batch.get_shape()) )
 		print( "    [{}]Tower shape: {}".format(self.id, self.cnn.get_shape()) )
 		print( "    [{}]Concat shape: {}".format(self.id, self.concat.get_shape()) )
@@ -62,19 +65,42 @@ class NoLSTMAC_Network(BaseAC_Network):
 			print( "    [{}]Reward prediction logits shape: {}".format(self.id, self.reward_prediction_logits.get_shape()) )
 		print( "    [{}]Action shape: {}".format(self.id, self.action_batch.get_shape()) )
 			
-	def predict_action(self, states, concats=None, internal_state=None):
-		feed_dict = { self.state_batch : states }
+	def _get_predict_feed_list(self):
+		feed_list = [self.state_batch]
 		if self.concat_size > 0:
-			feed_dict.update( { self.concat_batch : concats } )
-		# return action_batch, value_batch, policy_batch, new_internal_state
-		return self.session.run(fetches=[self.action_batch, self.value_batch, self.policy_batch, self.cnn], feed_dict=feed_dict)
-				
-	def predict_value(self, states, concats=None, internal_state=None):
-		feed_dict = { self.state_batch : states }
+			feed_list.append(self.concat_batch)
+		return feed_list
+		
+	def _get_predict_feed_values(self, states, concats, internal_state): # callables do not convert feeds to the placeholder type
+		states = self.state_codec.encode(states)
 		if self.concat_size > 0:
-			feed_dict.update( { self.concat_batch : concats } )
-		#return value_batch, new_internal_state
-		return self.session.run(fetches=[self.value_batch, self.cnn], feed_dict=feed_dict)
+			return (states, np.asarray(concats, dtype=np.float32))
+		return (states,)
+			
+	def get_predict_action_fetches(self): # there is no internal state, self.cnn is fetched in its place
+		return [self.action_batch, self.value_batch, self.policy_batch, self.cnn]
+		
+	def get_predict_value_fetches(self):
+		return [self.value_batch, self.cnn]
+				
+	def predict_parallel_action(self, states, concats=None, internal_states=None):
+		action_batch, value_batch, policy_batch, _ = self.predict_action(states=states, concats=concats)
+		# return action_batch, value_batch, policy_batch, new_internal_states
+		return action_batch, value_batch, policy_batch, [None]*len(states)
+				
+	def predict_parallel_value(self, states, concats=None, internal_states=None):
+		value_batch, _ = self.predict_value(states=states, concats=concats)
+		# return value_batch, new_internal_states
+		return value_batch, [None]*len(states)
+				
+	def burn_in(self, states_list, concats_list=None, internal_states=None): # there is no internal state to refresh
+		return [None]*len(states_list)
+		
+	def _concatenate_internal_states(self, internal_states, sequence_count):
+		return None
+		
+	def build_sequence_feed(self, sequence_count, sequence_length):
+		return { self.sequence_count_batch: sequence_count, self.sequence_length_batch: sequence_length }
 		
 	def build_train_feed(self, states, actions, rewards, values, policies, discounted_cumulative_rewards, generalized_advantage_estimators, concats, internal_state, reward_prediction_states, reward_prediction_target):
 		values = np.reshape(values,[-1])
@@ -85,7 +111,7 @@ class NoLSTMAC_Network(BaseAC_Network):
 			cumulative_rewards = np.reshape(discounted_cumulative_rewards,[-1])
 			advantages = cumulative_rewards - values
 		feed_dict={
-				self.state_batch: states,
+				self.state_batch: self.state_codec.encode(states),
 				self.advantage_batch: advantages,
 				self.cumulative_reward_batch: cumulative_rewards,
 				self.old_value_batch: values,
@@ -96,7 +122,7 @@ class NoLSTMAC_Network(BaseAC_Network):
 			feed_dict.update( {self.concat_batch : concats} )
 		if self.predict_reward:
 			feed_dict.update( {
-				self.reward_prediction_state_batch: reward_prediction_states,
+				self.reward_prediction_state_batch: self.state_codec.encode(reward_prediction_states),
 				self.reward_prediction_labels: reward_prediction_target
 			} )
 		return feed_dict
\ No newline at end of file
@@ -34,17 +34,17 @@ class SAAC_Network(BaseAC_Network):
 			return input
 			
 	# no dropout!
-	def _lstm_layer(self, input, initial_state, scope, name="", share_trainables=True):
+	def _lstm_layer(self, input, initial_state, scope, name="", share_trainables=True, sequence_length=None):
 		with tf.variable_scope(scope), tf.variable_scope("LSTM{}".format(name), reuse=tf.AUTO_REUSE) as variable_scope:
 			print( "    [{}]Building scope: {}".format(self.id, variable_scope.name) )
 			if len(input.get_shape()) > 2:
 				input = tf.layers.flatten(input)
-			sequence_length = [tf.shape(input)[0]]
-			state_shape = initial_state[0].get_shape().as_list()
-			batch_size = state_shape[0]
-			units = state_shape[1]
-			# Add batch dimension
-			input = tf.reshape(input, [-1, batch_size, input.get_shape().as_list()[-1]])
+			units = initial_state[0].get_shape().as_list()[1]
+			sequence_count = tf.shape(initial_state[0])[0] # 1 when training, one per worker/environment when acting in parallel
+			# Add batch dimension: the input is a time-major sequence of sequence_count rows
+			input = tf.reshape(input, [-1, sequence_count, input.get_shape().as_list()[-1]])
+			if sequence_length is None:
+				sequence_length = tf.fill([sequence_count], tf.shape(input)[0])
 			# Build LSTM cell
 			# lstm_cell = tf.contrib.model_pruning.MaskedBasicLSTMCell(num_units=units, forget_bias=1.0, state_is_tuple=True, activation=None)
 			lstm_cell = tf.nn.rnn_cell.BasicLSTMCell(num_units=units, state_is_tuple=True) # using BasicLSTMCell instead of LSTMCell
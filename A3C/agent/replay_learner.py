@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import traceback
+import time
+
+from agent.client import Worker
+
+import options
+flags = options.get()
+
+MAX_CONSECUTIVE_FAILURES = 10
+
+class ReplayLearner(Worker):
+	# Trains continuously, in its own thread and with its own local network, on the experience replay buffer shared with the workers.
+	# This way the workers do not stop acting while batches are replayed.
+	# With flags.replay_learner_throttling, a learner waits while the measured ratio between replayed and collected steps is above flags.replay_ratio.
+	# A learner stops (raising) after MAX_CONSECUTIVE_FAILURES failed replays in a row.
+
+	def __init__(self, thread_index, session, global_network, device, environment):
+		self.shape_environment = environment # used only for getting shapes
+		self.consecutive_failures = 0
+		super().__init__(thread_index=thread_index, session=session, global_network=global_network, device=device, training=True)
+
+	def create_environment(self):
+		return self.shape_environment
+
+	def process(self, global_step=0): # replay one batch, if the buffer is ready and the replay ratio allows it
+		try:
+			local_network = self.local_network
+			if global_step <= flags.replay_step or not local_network.experience_buffer.has_atleast(flags.replay_start):
+				time.sleep(flags.synchronization_sleep) # wait for the workers to fill the buffer
+				return
+			if flags.replay_learner_throttling and not local_network.wait_for_replay_ratio(timeout=1):
+				return
+			local_network.sync()
+			local_network.replay_experience(n=1)
+			if flags.accumulate_gradients:
+				local_network.apply_accumulated_gradients()
+			self.consecutive_failures = 0
+		except Exception:
+			traceback.print_exc()
+			self.consecutive_failures += 1
+			if self.consecutive_failures >= MAX_CONSECUTIVE_FAILURES:
+				raise RuntimeError("replay learner {} stopped after {} consecutive failures".format(self.thread_index, self.consecutive_failures))
@@ -13,11 +13,17 @@ import logging
 import time
 import sys
 import _pickle as pickle # CPickle
+import multiprocessing
 from multiprocessing import Queue
 
 from environment.environment import Environment
-from agent.client import Worker
+from agent.client import Worker, VectorizedWorker
+from agent.actor import LearnerWorker
+from agent.replay_learner import ReplayLearner
 import utils.plots as plt
+from utils.sharded_buffer import ShardedBuffer
+from utils.buffer_checkpoint import ExperienceBufferCheckpoint, RewardPredictionBufferCheckpoint
+from agent.batch import ExperienceBatch
 from agent.manager import *
 
 import options
@@ -49,17 +55,44 @@ class Application(object):
 		self.global_step = 0
 		self.stop_requested = False
 		self.terminate_reqested = False
+		self.buffer_checkpoints = {} # incremental checkpoints of the buffers, by name
 		self.build_network()
 			
 	def build_network(self):
 		# global network
-		self.global_network = Worker(thread_index=0, session=self.session, global_network=None, device=self.device).local_network
+		global_worker = Worker(thread_index=0, session=self.session, global_network=None, device=self.device)
+		self.global_network = global_worker.local_network
 		# local networks
 		self.trainers = []
-		for i in range(flags.parallel_size):
-			self.trainers.append( Worker(thread_index=i+1, session=self.session, global_network=self.global_network, device=self.device) )
+		if flags.use_actor_processes: # workers act in their own process and train in this one
+			if flags.partition_count > 1 and flags.partitioner_type == 'KMeans':
+				raise ValueError("actor processes do not support the KMeans partitioner, set partitioner_type or partition_count")
+			self.actor_context = multiprocessing.get_context('spawn') # a forked process would inherit the tensorflow runtime
+			self.shared_global_step = self.actor_context.Value('l', 0)
+			trajectory_queue = self.actor_context.Queue(maxsize=flags.actor_queue_size*flags.parallel_size) if flags.central_learner else None
+			for i in range(flags.parallel_size):
+				self.trainers.append( LearnerWorker(thread_index=i+1, session=self.session, global_network=self.global_network, device=self.device, environment=global_worker.environment, context=self.actor_context, trajectory_queue=trajectory_queue) )
+			if flags.central_learner: # the first learner trains the trajectories of all the actors
+				self.trainers[0].set_actors(self.trainers)
+		else:
+			worker_class = VectorizedWorker if flags.environment_count > 1 else Worker
+			for i in range(flags.parallel_size):
+				self.trainers.append( worker_class(thread_index=i+1, session=self.session, global_network=self.global_network, device=self.device) )
+		# replay learners
+		if flags.replay_ratio > 0 and flags.replay_learner_count > 0:
+			if not (flags.shared_replay or flags.replay_server_address):
+				raise ValueError("replay learners need an experience replay buffer shared with the workers: set shared_replay or replay_server_address")
+			if flags.predict_reward: # the reward prediction examples are kept by every worker, a learner would train on its own empty buffer
+				raise ValueError("replay learners do not support predict_reward: set replay_learner_count to 0 or predict_reward to False")
+			self.replay_learners = [
+				ReplayLearner(thread_index=flags.parallel_size+i+1, session=self.session, global_network=self.global_network, device=self.device, environment=global_worker.environment)
+				for i in range(flags.replay_learner_count)
+			]
+		else:
+			self.replay_learners = []
 		# initialize variables
 		self.session.run(tf.global_variables_initializer()) # do it before loading checkpoint
+		self.session.run(tf.local_variables_initializer()) # eg: gradient accumulators, not saved in checkpoints
 		# load checkpoint
 		self.load_checkpoint()
 		# print graph summary
@@ -124,6 +157,17 @@ class Application(object):
 	
 			diff_global_step = trainer.process(self.global_step)
 			self.global_step += diff_global_step
+			if flags.use_actor_processes:
+				self.shared_global_step.value = self.global_step
+			if flags.synchronous_training: # wait for the batches of the other threads, the last thread to arrive trains them all
+				try:
+					self.round_barrier.wait()
+				except threading.BrokenBarrierError: # aborted by save or Ctrl+C
+					if self.terminate_reqested:
+						trainer.stop()
+						if parallel_index == 0:
+							self.save()
+					return
 			# print global statistics
 			if trainer.terminal:
 				info = self.get_global_statistics(clients=self.trainers)
@@ -137,7 +181,7 @@ class Application(object):
 				with self.sync_lock:
 					self.sync_count += 1 # thread p ended
 					# print('sum before', self.sync_count)
-					if self.sync_count == flags.parallel_size: # all threads are ended
+					if self.sync_count == len(self.train_threads): # all threads are ended
 						self.sync_event.set() # start synching
 				event_is_set = self.sync_event.wait()
 				# print('event set: ', event_is_set, parallel_index)
@@ -147,22 +191,61 @@ class Application(object):
 					if self.sync_count == 0: # all threads can start
 						self.sync_event.clear() # synching completed
 			# do it after synching threads
-			if self.stop_requested:
+			train_exit = self.round_exit if flags.synchronous_training else self.get_train_exit() # in synchronous training all the threads take the decision of the round
+			if train_exit == 'stop':
 				return
-			if self.terminate_reqested:
+			if train_exit == 'terminate':
 				trainer.stop()
 				if parallel_index == 0:
 					self.save()
 				return
-			if self.global_step > flags.max_time_step:
+			if train_exit == 'end':
 				trainer.stop()
 				return
-			if self.global_step > self.next_save_steps:
+			if train_exit == 'save':
 				if parallel_index == 0: # Save checkpoint
 					self.save()
 				else:
 					return		
 
+	def get_train_exit(self): # why the training threads have to leave their loop, None if they have to go on
+		if self.stop_requested:
+			return 'stop'
+		if self.terminate_reqested:
+			return 'terminate'
+		if self.global_step > flags.max_time_step:
+			return 'end'
+		if self.global_step > self.next_save_steps:
+			return 'save'
+		return None
+
+	def replay_function(self, learner_index):
+		""" Replay batches until the workers stop. """
+		learner = self.replay_learners[learner_index]
+		while not (self.stop_requested or self.terminate_reqested) and self.global_step <= flags.max_time_step:
+			learner.process(self.global_step)
+
+	def start_replay_threads(self):
+		self.replay_threads = [threading.Thread(target=self.replay_function, args=(i,)) for i in range(len(self.replay_learners))]
+		for t in self.replay_threads:
+			t.start()
+
+	def train_round(self):
+		""" Train together the batches collected by all the threads during the last round.
+		Called by the last thread reaching the round barrier, while the others are waiting.
+		"""
+		batches = []
+		for trainer in self.trainers:
+			batches += trainer.local_network.round_batches
+			trainer.local_network.round_batches = []
+		if len(batches) > 0:
+			self.trainers[0].local_network.train_round(batches, self.global_step)
+		self.round_exit = self.get_train_exit() # decided once for all the threads of the round
+
+	def build_round_barrier(self):
+		self.round_exit = None
+		self.round_barrier = threading.Barrier(len(self.train_threads), action=self.train_round)
+
 	def get_global_statistics(self, clients):
 		dictionaries = [client.stats for client in clients if client.terminated_episodes >= flags.match_count_for_evaluation]
 		used_clients = len(dictionaries) # ignore the first flags.match_count_for_evaluation objects from data, because they are too noisy
@@ -170,18 +253,32 @@ class Application(object):
 			return {}
 		return {k: sum(d[k] for d in dictionaries if k in d)/used_clients for k in dictionaries[0]}
 		
+	def get_train_thread_count(self):
+		if flags.use_actor_processes and flags.central_learner:
+			return 1
+		return flags.parallel_size
+		
 	def train(self):
 		# run training threads
-		self.train_threads = [threading.Thread(target=self.train_function, args=(i,)) for i in range(flags.parallel_size)]
-		signal.signal(signal.SIGINT, self.signal_handler)
+		self.train_threads = [threading.Thread(target=self.train_function, args=(i,)) for i in range(self.get_train_thread_count())]
 		# set start time
 		self.start_time = time.time() - self.elapsed_time
 		if flags.synchronize_threads: # build synchronization vector
 			self.sync_event = threading.Event()
 			self.sync_lock = threading.Lock()
 			self.sync_count = 0
+		if flags.synchronous_training:
+			self.build_round_barrier()
+		if flags.use_inference_server:
+			self.global_network.inference_server.start()
+		if flags.use_actor_processes:
+			self.shared_global_step.value = self.global_step
+			for trainer in self.trainers:
+				trainer.start_actor(context=self.actor_context, global_step=self.shared_global_step)
+		signal.signal(signal.SIGINT, self.signal_handler) # after building the round barrier
 		for t in self.train_threads:
 			t.start()
+		self.start_replay_threads()
 		print('Press Ctrl+C to stop')
 		signal.pause()
 	
@@ -214,9 +311,13 @@ class Application(object):
 		Called from thread-0.
 		"""
 		self.stop_requested = True
+		if flags.synchronous_training: # release the threads waiting for the end of the round
+			self.round_barrier.abort()
 		for (i, t) in enumerate(self.train_threads): # Wait for all other threads to stop
 			if i != 0: # cannot join current thread
 				t.join()
+		for t in self.replay_threads:
+			t.join()
 	
 		# Save
 		if not os.path.exists(flags.checkpoint_dir):
@@ -246,12 +347,15 @@ class Application(object):
 		if not self.terminate_reqested:
 			self.stop_requested = False
 			self.next_save_steps += flags.save_interval_step
+			if flags.synchronous_training:
+				self.build_round_barrier()
 			# Restart other threads
-			for i in range(flags.parallel_size):
+			for i in range(len(self.train_threads)):
 				if i != 0: # current thread is already running
 					thread = threading.Thread(target=self.train_function, args=(i,))
 					self.train_threads[i] = thread
 					thread.start()
+			self.start_replay_threads()
 					
 	def save_important_information(self, path):
 		trainers_count = len(self.trainers)
@@ -259,38 +363,63 @@ class Application(object):
 		persistent_memory["train_count_matrix"] = [[] for _ in range(trainers_count)]
 		# Experience replay
 		if flags.replay_ratio > 0:
-			persistent_memory["experience_buffers"] = [None for _ in range(trainers_count)]
-		# Reward prediction
-		if flags.predict_reward:
-			persistent_memory["reward_prediction_buffers"] = [None for _ in range(trainers_count)]
+			if flags.replay_server_address: # shared by all the workers, the server saves its buffer by itself
+				self.get_experience_buffers()[0].flush()
+			elif flags.replay_backend != 'Memory': # memory-mapped buffers are saved in their own files
+				for experience_buffer in self.get_experience_buffers():
+					experience_buffer.flush()
+		# Experience replay and reward prediction buffers, saved incrementally in their own directories
+		for (name, buffer) in self.get_checkpointed_buffers():
+			self.get_buffer_checkpoint(name).save(buffer, self.global_step)
+		# Train counters
 		for i in range(trainers_count):
-			trainer = self.trainers[i]
-			# train counters
 			train_count_matrix = persistent_memory["train_count_matrix"][i]
-			for model in trainer.local_network.model_list:
+			for model in self.trainers[i].local_network.model_list:
 				train_count_matrix.append(model.train_count)
-			# experience buffer
-			if flags.replay_ratio > 0:
-				persistent_memory["experience_buffers"][i] = trainer.local_network.experience_buffer
-			if flags.predict_reward:
-				persistent_memory["reward_prediction_buffers"][i] = trainer.local_network.reward_prediction_buffer
 		with open(path, 'wb') as file:
 			pickle.dump(persistent_memory, file)
 			
+	def get_experience_buffers(self): # one per trainer, or a single one shared by all the trainers
+		if flags.shared_replay:
+			return [self.global_network.experience_buffer]
+		return [trainer.local_network.experience_buffer for trainer in self.trainers]
+		
+	def get_checkpointed_buffers(self): # (name, buffer) of the buffers saved with a BufferCheckpoint, the shards of a sharded buffer are saved separately
+		result = []
+		if flags.replay_ratio > 0 and flags.replay_backend == 'Memory' and not flags.replay_server_address:
+			for (i, experience_buffer) in enumerate(self.get_experience_buffers()):
+				if isinstance(experience_buffer, ShardedBuffer):
+					result += [('experience_buffer_{}/shard_{}'.format(i, j), shard) for (j, shard) in enumerate(experience_buffer.shards)]
+				else:
+					result.append(('experience_buffer_{}'.format(i), experience_buffer))
+		if flags.predict_reward:
+			result += [('reward_prediction_buffer_{}'.format(i), trainer.local_network.reward_prediction_buffer) for (i, trainer) in enumerate(self.trainers)]
+		return result
+		
+	def get_buffer_checkpoint(self, name):
+		if name not in self.buffer_checkpoints:
+			directory = os.path.join(flags.checkpoint_dir, 'buffers', name)
+			if name.startswith('reward_prediction_buffer'):
+				self.buffer_checkpoints[name] = RewardPredictionBufferCheckpoint(directory=directory, compaction_threshold=flags.buffer_checkpoint_compaction)
+			else:
+				self.buffer_checkpoints[name] = ExperienceBufferCheckpoint(directory=directory, batch_from_record=ExperienceBatch.from_record, compaction_threshold=flags.buffer_checkpoint_compaction)
+		return self.buffer_checkpoints[name]
+			
 	def load_important_information(self, path):
 		with open(path, 'rb') as file:
-			persistent_memory = pickle.load(file)
+			persistent_memory = pickle.load(file) # buffers pickled by older checkpoints are ignored
 			
+		# train counters
 		for (i, trainer) in enumerate(self.trainers):
-			# train counters
 			for (j, model) in enumerate(trainer.local_network.model_list):
 				model.train_count = persistent_memory["train_count_matrix"][i][j]
-			# experience buffer
-			if flags.replay_ratio > 0:
-				trainer.local_network.experience_buffer = persistent_memory["experience_buffers"][i]
-			if flags.predict_reward:
-				trainer.local_network.reward_prediction_buffer = persistent_memory["reward_prediction_buffers"][i]
+		# experience replay and reward prediction buffers
+		for (name, buffer) in self.get_checkpointed_buffers():
+			if not self.get_buffer_checkpoint(name).load(buffer):
+				print("Buffer {} not found in checkpoint".format(name))
 		
 	def signal_handler(self, signal, frame):
 		print('You pressed Ctrl+C!')
-		self.terminate_reqested = True
\ No newline at end of file
+		self.terminate_reqested = True
+		if flags.synchronous_training: # threads waiting for the end of the round would never see the request
+			self.round_barrier.abort()
\ No newline at end of file
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+import traceback
+import queue
+import time
+from concurrent.futures import Future
+
+class TrainPipeline(object):
+	# The thread of the worker converts batches into feed arrays and enqueues them, a background thread runs the train ops.
+	# This way the host-side conversion of the next batch overlaps with the computation of the previous one.
+	# At most capacity converted batches wait in the queue: when the queue is full the worker blocks.
+	# When not started, batches are converted and trained in the calling thread (still measuring the time spent converting them).
+
+	def __init__(self, capacity):
+		self.queue = queue.Queue(maxsize=capacity)
+		self.running = False
+		self.thread = None
+		# Statistics
+		self._feed_time = 0
+		self._run_time = 0
+
+	def start(self):
+		if self.running:
+			return
+		self.running = True
+		self.thread = threading.Thread(target=self.serve)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		self.running = False
+
+	def get_feed(self, get_feed_function):
+		start = time.time()
+		feed_dict = get_feed_function()
+		self._feed_time += time.time() - start
+		return feed_dict
+
+	def run_train_op(self, train_function, feed_dict):
+		start = time.time()
+		result = train_function(feed_dict)
+		self._run_time += time.time() - start
+		return result
+
+	def train(self, train_function, get_feed_function):
+		# returns a future of the train result
+		feed_dict = self.get_feed(get_feed_function)
+		return self.call(lambda: self.run_train_op(train_function, feed_dict))
+
+	def call(self, function):
+		# returns a future of the function result, functions are called in the same order they are given
+		future = Future()
+		if not self.running: # no prefetching: run in the calling thread
+			future.set_result(function())
+			return future
+		self.queue.put( (function, future) )
+		return future
+
+	def flush(self): # wait for all the queued train ops
+		self.call(lambda: None).result()
+
+	def serve(self):
+		while self.running:
+			try:
+				function, future = self.queue.get(timeout=1)
+			except queue.Empty:
+				continue
+			try:
+				result = function()
+			except Exception as e:
+				traceback.print_exc()
+				future.set_exception(e)
+				continue
+			future.set_result(result)
+
+	def get_statistics(self):
+		train_time = self._feed_time + self._run_time
+		if train_time == 0:
+			return {}
+		return {"train_feed_time_fraction": self._feed_time/train_time}
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import tensorflow as tf
+import numpy as np
+import time
+from environment.environment import Environment
+from agent.network import *
+
+import options
+flags = options.get()
+
+BENCHMARK_STEPS = 2000
+
+def time_per_call(function, steps):
+	function() # warm up
+	start = time.time()
+	for _ in range(steps):
+		function()
+	return (time.time() - start)/steps
+
+def main(argv):
+	# Microbenchmark of the 1-state act and value paths: session.run with a feed_dict against precompiled session callables
+	environment = Environment.create_environment(flags.env_type, 0, False)
+	concat_size = environment.get_concatenation_size() if flags.use_concatenation else 0
+	session = tf.Session(config=tf.ConfigProto(device_count={'GPU': 0}))
+	network = eval('{}_Network'.format(flags.network))(
+		session=session,
+		id='Benchmark',
+		device="/cpu:0",
+		state_shape=environment.get_state_shape(),
+		action_shape=environment.get_action_shape(),
+		concat_size=concat_size,
+		clip=flags.clip,
+		predict_reward=False,
+		training=False
+	)
+	session.run(tf.global_variables_initializer())
+	session.graph.finalize()
+
+	states = [np.zeros(environment.get_state_shape(), dtype=np.float32)]
+	concats = [np.zeros(concat_size, dtype=np.float32)]
+	feed_list = network._get_predict_feed_list()
+	feed_values = network._get_predict_feed_values(states, concats, None)
+	feed_dict = dict(zip(feed_list, feed_values))
+	action_fetches = network.get_predict_action_fetches() # the same fetches of the callables, for a like-for-like comparison
+	value_fetches = network.get_predict_value_fetches()
+
+	results = {
+		"act session.run": time_per_call(lambda: session.run(fetches=action_fetches, feed_dict=feed_dict), BENCHMARK_STEPS),
+		"act callable": time_per_call(lambda: network.predict_action(states=states, concats=concats), BENCHMARK_STEPS),
+		"value session.run": time_per_call(lambda: session.run(fetches=value_fetches, feed_dict=feed_dict), BENCHMARK_STEPS),
+		"value callable": time_per_call(lambda: network.predict_value(states=states, concats=concats), BENCHMARK_STEPS),
+	}
+	for key, value in results.items():
+		print( "{}: {:.1f} us per call".format(key, value*1e6) )
+
+if __name__ == '__main__':
+	tf.app.run()
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import argparse
+import time
+from utils.buffer import PrioritizedBuffer
+
+parser = argparse.ArgumentParser(description='benchmark the prioritized replay buffer')
+parser.add_argument('--sizes', nargs='+', type=int, default=[10**3, 10**4, 10**5], help='buffer sizes, every buffer is filled with 3*size Python-level puts before timing')
+parser.add_argument('--operations', type=int, default=10**4, help='number of timed operations per size')
+parser.add_argument('--sample_size', type=int, default=32, help='number of batches sampled per call')
+ARGS = parser.parse_args()
+print("ARGS:", ARGS)
+
+def time_per_call(function, calls):
+	start = time.time()
+	for _ in range(calls):
+		function()
+	return (time.time() - start)/calls
+
+for size in ARGS.sizes:
+	buffer = PrioritizedBuffer(size=size)
+	type_ids = [0,1,2]
+	for type_id in type_ids: # fill the buffer
+		for i in range(size):
+			buffer.put(batch=i, priority=np.random.random(), type_id=type_id)
+	results = {
+		"put": time_per_call(lambda: buffer.put(batch=0, priority=np.random.random(), type_id=np.random.choice(type_ids)), ARGS.operations), # with eviction
+		"sample": time_per_call(buffer.sample, ARGS.operations),
+		"sample_batch({})".format(ARGS.sample_size): time_per_call(lambda: buffer.sample_batch(ARGS.sample_size), ARGS.operations//ARGS.sample_size),
+		"update_priority": time_per_call(lambda: buffer.update_priority(idx=np.random.randint(size), priority=np.random.random(), type_id=np.random.choice(type_ids)), ARGS.operations),
+		"update_priorities({})".format(ARGS.sample_size): time_per_call(lambda: buffer.update_priorities(idx_list=np.random.randint(size, size=ARGS.sample_size), priority_list=np.random.random(ARGS.sample_size), type_id_list=np.random.choice(type_ids, size=ARGS.sample_size)), ARGS.operations//ARGS.sample_size),
+	}
+	for key, value in results.items():
+		print( "size {}, {}: {:.1f} us per call".format(size, key, value*1e6) )
@@ -4,6 +4,7 @@ from __future__ import division
 from __future__ import print_function
 
 import numpy as np
+from utils.observation_codec import ObservationCodec
 import options
 flags = options.get()
 
@@ -58,3 +59,14 @@ class Environment(object):
 		
 	def get_screen_shape(self):
 		return self.get_state_shape()
+		
+	def get_state_dtype(self): # the type of the state values
+		return np.float32
+		
+	def get_state_range(self): # (min, max) of the state values, None if unknown
+		return None
+		
+	def get_state_codec(self):
+		if not flags.compact_states:
+			return ObservationCodec(self.get_state_shape())
+		return ObservationCodec.create(state_shape=self.get_state_shape(), dtype=self.get_state_dtype(), value_range=self.get_state_range())
@@ -49,6 +49,15 @@ class GymEnvironment(environment.Environment):
 			shape = shape + (1,)
 		return shape
 		
+	def get_state_dtype(self):
+		return self.game.observation_space.dtype
+		
+	def get_state_range(self):
+		observation_space = self.game.observation_space
+		if not hasattr(observation_space, 'low'): # not a box
+			return None
+		return (np.min(observation_space.low), np.max(observation_space.high))
+		
 	def stop(self):
 		self.game.close()
 		
@@ -25,6 +25,12 @@ class RogueEnvironment(environment.Environment):
 		
 	def get_state_shape(self):
 		return self.game.state_generator._shape
+		
+	def get_state_dtype(self): # the state generators fill grids with small integer codes
+		return np.uint8
+		
+	def get_state_range(self):
+		return (0, 255)
 	
 	def __init__(self, thread_index):
 		environment.Environment.__init__(self)
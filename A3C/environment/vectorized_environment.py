@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+from environment.environment import Environment
+
+class VectorizedEnvironment(Environment):
+	# Owns environment_count copies of the same environment and steps them together.
+	# Environments are not reset automatically: whoever steps them has to call reset_environment after a terminal state.
+
+	def __init__(self, env_type, thread_index, training, environment_count):
+		Environment.__init__(self)
+		self.thread_index = thread_index
+		self.environments = [Environment.create_environment(env_type, thread_index, training) for _ in range(environment_count)]
+
+	def get_environment_count(self):
+		return len(self.environments)
+
+	def get_action_shape(self):
+		return self.environments[0].get_action_shape()
+
+	def get_state_shape(self):
+		return self.environments[0].get_state_shape()
+
+	def get_screen_shape(self):
+		return self.environments[0].get_screen_shape()
+
+	def get_concatenation_size(self):
+		return self.environments[0].get_concatenation_size()
+
+	def get_state_codec(self):
+		return self.environments[0].get_state_codec()
+
+	def get_concatenations(self):
+		return [environment.get_concatenation() for environment in self.environments]
+
+	def get_last_states(self):
+		return [environment.last_state for environment in self.environments]
+
+	def reset(self):
+		for environment in self.environments:
+			environment.reset()
+
+	def reset_environment(self, environment_id):
+		self.environments[environment_id].reset()
+
+	def stop(self):
+		for environment in self.environments:
+			environment.stop()
+
+	def process(self, action_vectors):
+		new_states = []
+		rewards = []
+		terminals = []
+		for (environment, action_vector) in zip(self.environments, action_vectors):
+			state, reward, terminal = environment.process(action_vector)
+			new_states.append(state)
+			rewards.append(reward)
+			terminals.append(terminal)
+		return new_states, np.array(rewards, dtype=np.float32), np.array(terminals)
+
+	def get_statistics(self):
+		dictionaries = [environment.get_statistics() for environment in self.environments]
+		return {k: sum(d[k] for d in dictionaries if k in d)/len(dictionaries) for k in dictionaries[0]}
+
+	def get_frame_info(self, network, value, action, reward, policy):
+		return self.environments[0].get_frame_info(network=network, value=value, action=action, reward=reward, policy=policy)
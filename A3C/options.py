@@ -14,6 +14,7 @@ def build():
 	# tf.app.flags.DEFINE_string("env_type", "MontezumaRevenge-ram-v0", "environment types: rogue, car_controller, sentipolc, or environments from https://gym.openai.com/envs")
 	# tf.app.flags.DEFINE_string("env_type", "sentipolc", "environment types: rogue, car_controller, sentipolc, or environments from https://gym.openai.com/envs")
 	tf.app.flags.DEFINE_string("env_type", "rogue", "environment types: rogue, car_controller, sentipolc, or environments from https://gym.openai.com/envs")
+	tf.app.flags.DEFINE_boolean("compact_states", True, "Whether to keep states in batches, replay buffers and feeds with the compact encoding allowed by the environment (eg: uint8, or bit-packed binary states), decoding them to float32 inside the graph")
 # Gradient optimization parameters
 	tf.app.flags.DEFINE_string("network", "BaseAC", "neural network: BaseAC, TowersAC, HybridTowersAC, SAAC, NoLSTMAC")
 	tf.app.flags.DEFINE_string("optimizer", "Adam", "gradient optimizer: Adadelta, AdagradDA, Adagrad, Adam, Ftrl, GradientDescent, Momentum, ProximalAdagrad, ProximalGradientDescent, RMSProp") # default is Adam, for vanilla A3C is RMSProp
@@ -24,6 +25,11 @@ def build():
 	tf.app.flags.DEFINE_string("loss_type", "sum", "type of loss reduction: sum, mean")
 	tf.app.flags.DEFINE_string("policy_loss", "PPO", "policy loss function: Vanilla, PPO")
 	tf.app.flags.DEFINE_string("value_loss", "PVO", "value loss function: Vanilla, PVO")
+# V-trace: Espeholt, Lasse, et al. "IMPALA: Scalable distributed deep-RL with importance weighted actor-learner architectures." arXiv preprint arXiv:1802.01561 (2018).
+	# V-trace corrects for the lag between the acting policy and the trained one (eg: with actor processes, experience replay or the inference server)
+	tf.app.flags.DEFINE_boolean("use_vtrace", False, "Whether to replace advantages and critic targets with their V-trace off-policy corrected estimates")
+	tf.app.flags.DEFINE_float("vtrace_rho_clip", 1.0, "V-trace truncation level of the importance weights used for advantages and value targets")
+	tf.app.flags.DEFINE_float("vtrace_c_clip", 1.0, "V-trace truncation level of the trace-cutting importance weights")
 # Partitioner parameters
 	# Partition count > 0 reduces algorithm speed, because also a partitioner is trained
 	tf.app.flags.DEFINE_integer("partition_count", 5, "Number of partitions of the input space. Set to 1 for no partitions.")
@@ -55,7 +61,8 @@ def build():
 	tf.app.flags.DEFINE_boolean("use_concatenation", True, "Whether to add as extra network input a 1D vector containing useful information to concat to some layer.")
 # Reward Prediction: Jaderberg, Max, et al. "Reinforcement learning with unsupervised auxiliary tasks." arXiv preprint arXiv:1611.05397 (2016).
 	tf.app.flags.DEFINE_boolean("predict_reward", False, "Whether to predict rewards. This should be useful with sparse rewards.") # N.B.: Cause of memory leaks! (probably because of tf scope reuse)
-	tf.app.flags.DEFINE_integer("reward_prediction_buffer_size", 2**7, "Maximum number of batches stored in the reward prediction buffer")
+	tf.app.flags.DEFINE_integer("reward_prediction_buffer_size", 2**10, "Maximum number of examples (windows of 3 consecutive states) of every reward class (zero, positive, negative) stored in the reward prediction buffer")
+	tf.app.flags.DEFINE_float("reward_prediction_buffer_megabytes", 0, "Maximum size in megabytes of the reward prediction buffers of all the workers, split evenly among workers and reward classes. Set 0 for no limit.")
 # Count-Based Exploration: Tang, Haoran, et al. "# Exploration: A study of count-based exploration for deep reinforcement learning." Advances in Neural Information Processing Systems. 2017.
 	tf.app.flags.DEFINE_boolean("use_count_based_exploration_reward", True, "States are mapped to hash codes (using Locality-sensitive hashing), which allows to count their occurrences with a hash table. These counts are then used to compute a reward bonus according to the classic count-based exploration theory.")
 	tf.app.flags.DEFINE_float("positive_exploration_coefficient", 0.1, "Bonus coefficient for the possitive part of the count-based exploration reward. exploration_bonus = 2/np.sqrt(self.hash_state_table[state_hash]) - 1. if exploration_bonus > 0 exploration_bonus*=positive_exploration_coefficient.")
@@ -68,11 +75,25 @@ def build():
 	tf.app.flags.DEFINE_integer("replay_step", 10**3, "Start populating buffer when global step is greater than replay_step.")
 	tf.app.flags.DEFINE_boolean("replay_value", False, "Whether to recompute values, advantages and discounted cumulative rewards") # default is True
 	tf.app.flags.DEFINE_integer("replay_buffer_size", 2**6, "Maximum number of batches stored in the experience replay buffer")
+	tf.app.flags.DEFINE_float("replay_buffer_megabytes", 0, "Maximum size in megabytes of the experience replay buffers of all the workers, split evenly among workers and batch types. Set 0 for no limit. Not supported with replay_backend MemoryMapped.")
 	tf.app.flags.DEFINE_integer("replay_start", 1, "Buffer minimum size before starting replay. Should be greater than 0 and lower than replay_buffer_size.")
+	tf.app.flags.DEFINE_integer("replay_burn_in", 0, "Number of steps before every batch stored with it as burn-in prefix (R2D2). When replaying the batch, the internal state is refreshed by running the current network on the prefix, with one forward pass per model for all the replayed batches. Set 0 for replaying with the internal state stored in the batch.")
 	tf.app.flags.DEFINE_boolean("replay_using_default_internal_state", False, "Whether to use old internal state when replaying, or to use the default one")
+	tf.app.flags.DEFINE_boolean("shared_replay", False, "Whether all the workers should put and sample their batches in a single experience replay buffer owned by the global network, made of parallel_size shards with a lock each")
+	tf.app.flags.DEFINE_integer("replay_learner_count", 0, "Number of replay learner threads, training continuously on the experience replay buffer (shared_replay or replay_server_address) while the workers only act and train on-policy. Not compatible with predict_reward. Set 0 for replaying in the workers, after every batch.")
+	tf.app.flags.DEFINE_boolean("replay_learner_throttling", True, "Whether replay learners should wait while the measured ratio between replayed and collected steps is above replay_ratio")
+	tf.app.flags.DEFINE_string("replay_backend", "Memory", "Storage of the experience replay buffer: Memory or MemoryMapped. MemoryMapped keeps the batches in memory-mapped files in checkpoint_dir/replay, they are not pickled with the checkpoint and survive restarts.")
+	tf.app.flags.DEFINE_string("replay_server_address", "", "host:port (or Unix socket path) of a replay server started with replay_server.py, keeping the experience replay buffer of the workers of one or more training processes. Empty for a buffer in this process. The buffer of the server is always prioritized: batches are put with priority 1 when prioritized_replay is False.")
+	tf.app.flags.DEFINE_string("replay_server_authkey", "replay", "Authentication key of the replay server")
+	tf.app.flags.DEFINE_string("replay_compression", "", "Compression of the states of the batches in the experience replay buffer (with replay_backend Memory): zlib, lzma, delta (the difference with the previous frame, then zlib), or empty for none")
+	tf.app.flags.DEFINE_integer("replay_compression_cache_size", 8, "Number of decompressed batches kept in the cache of every compressed buffer")
+	tf.app.flags.DEFINE_float("buffer_checkpoint_compaction", 0.5, "Buffers (with replay_backend Memory) are saved in checkpoint_dir/buffers as append-only segments holding only what changed since the previous save. When more than this fraction of the entries in the segments of a buffer are dead (eg: evicted), its live entries are rewritten in a single segment.")
 	tf.app.flags.DEFINE_boolean("save_only_batches_with_reward", True, "Save in the replay buffer only those batches with extrinsic reward different from 0") # default is True
 # Prioritized Experience Replay: Schaul, Tom, et al. "Prioritized experience replay." arXiv preprint arXiv:1511.05952 (2015).
 	tf.app.flags.DEFINE_boolean("prioritized_replay", False, "Whether to use prioritized sampling (if replay_ratio > 0)")
+	tf.app.flags.DEFINE_string("replay_priority", "Loss", "Priority of a batch in the replay buffer (if prioritized_replay): Loss or Reward. Loss is the value loss of the last training on the batch (new batches whose loss is not known yet get the max priority), Reward is the batch reward.")
+	tf.app.flags.DEFINE_float("replay_priority_epsilon", 1e-2, "Added to the loss of a batch to get its priority (if replay_priority is Loss), so that batches with a near zero loss can still be sampled")
+	tf.app.flags.DEFINE_float("replay_priority_alpha", 1., "Exponent of the loss priority (if replay_priority is Loss): 0 for uniform sampling, 1 for sampling proportional to the loss")
 # Reward clip
 	tf.app.flags.DEFINE_boolean("clip_reward", False, "Whether to clip the reward between min_reward and max_reward") # default is False
 	tf.app.flags.DEFINE_float("min_reward", 0, "Minimum reward for clipping") # default is -1
@@ -82,10 +103,30 @@ def build():
 	tf.app.flags.DEFINE_float("value_coefficient", 0.5, "value coefficient for tuning Critic learning rate") # default is 0.5, for openAI is 0.25
 	tf.app.flags.DEFINE_float("beta", 0.001, "entropy regularization constant") # default is 0.001, for openAI is 0.01
 	tf.app.flags.DEFINE_integer("parallel_size", 4, "parallel thread size")
+	# Actor processes are not limited by the GIL: environment steps and act forward passes run in parallel
+	tf.app.flags.DEFINE_boolean("use_actor_processes", False, "Whether each one of the parallel_size workers should act in its own process, with its own environment and a CPU copy of the policy, shipping trajectories to a learner thread of the main process")
+	tf.app.flags.DEFINE_integer("actor_queue_size", 4, "Max. number of trajectories waiting to be trained for each actor process")
+	tf.app.flags.DEFINE_integer("actor_sync_interval", 1, "Number of trained trajectories after which the learner sends the new weights to the actor process")
+	tf.app.flags.DEFINE_boolean("central_learner", False, "Whether the trajectories of all the actor processes should be trained by a single learner thread (IMPALA-style), instead of one learner thread per actor")
+	tf.app.flags.DEFINE_integer("central_learner_batch_count", 8, "Max. number of waiting trajectories trained together by the central learner, with one gradient step per minibatch as in a synchronous round (see round_epochs and round_minibatch_count)")
+	tf.app.flags.DEFINE_integer("environment_count", 1, "Number of environments stepped together by each thread, with one forward pass per step. Requires partition_count < 2")
 	tf.app.flags.DEFINE_integer("batch_size", 8, "Max. batch size") # default is 8
+	# The inference server makes workers act with the global network, coalescing their requests in batches
+	tf.app.flags.DEFINE_boolean("use_inference_server", False, "Whether to run the act requests of all the threads as batched forward passes of the global network, instead of one session.run per step and thread")
+	tf.app.flags.DEFINE_integer("inference_batch_size", 0, "Max. number of act requests per batched forward pass. Set 0 for parallel_size")
+	tf.app.flags.DEFINE_float("inference_max_wait", 1e-3, "Max. number of seconds an act request waits for its batch to fill up")
 	# Synchronizing threads slows down the algorithm but it can improve learning statistics
 	tf.app.flags.DEFINE_boolean("synchronize_threads", False, "Whether to wait other threads before starting new batch. More useful when batch size is big.") # Set to false for A2C or true for A3C
 	tf.app.flags.DEFINE_float("synchronization_sleep", 0.01, "A waiting thread checks synchronization constraints every n seconds")
+	tf.app.flags.DEFINE_integer("sync_interval", 1, "Copy the global weights to the local network every n batches. Only the models updated since the last copy are copied.")
+	tf.app.flags.DEFINE_boolean("fused_training", False, "Whether to train all the models (eg: the partitions) that have samples in a batch with a single session.run")
+	tf.app.flags.DEFINE_boolean("accumulate_gradients", False, "Whether to sum locally the gradients of a batch and of its replays, applying them to the global network with a single update")
+	tf.app.flags.DEFINE_string("accumulated_gradients_reduction", "Sum", "How the accumulated gradients are applied (if accumulate_gradients): Sum or Mean. Sum gives the same update as applying every batch, Mean the update of a single batch.")
+	tf.app.flags.DEFINE_boolean("use_train_pipeline", False, "Whether to convert batches into feed arrays in the worker thread while a background thread runs the previous train ops. Local weights may lag behind by one batch.")
+	tf.app.flags.DEFINE_integer("train_pipeline_capacity", 2, "Max. number of converted batches waiting to be trained (if use_train_pipeline)")
+	tf.app.flags.DEFINE_boolean("synchronous_training", False, "Whether to train the batches of all the threads together, with one large gradient step per round (A2C). Threads wait each other at the end of every batch.")
+	tf.app.flags.DEFINE_integer("round_epochs", 1, "Number of training epochs over the batches of a synchronous round (if synchronous_training) or of the trajectories of the central learner. Use more than 1 epoch only with PPO.")
+	tf.app.flags.DEFINE_integer("round_minibatch_count", 1, "Number of minibatches of whole shuffled batches per round epoch (if synchronous_training or central_learner)")
 	# Taking gamma < 1 introduces bias into the policy gradient estimate, regardless of the value functions accuracy.
 	tf.app.flags.DEFINE_float("gamma", 0.99, "discount factor for rewards") # default is 0.95, for openAI is 0.99
 # Generalized Advantage Estimation: Schulman, John, et al. "High-dimensional continuous control using generalized advantage estimation." arXiv preprint arXiv:1506.02438 (2015).
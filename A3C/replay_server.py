@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+import argparse
+from utils.buffer import PrioritizedBuffer
+from utils.replay_server import ReplayServer
+
+parser = argparse.ArgumentParser(description='run a replay server shared by the workers of many training processes (see the replay_server_address option)')
+parser.add_argument('--address', default='localhost:6000', help='host:port of a TCP socket (eg: 0.0.0.0:6000 for other hosts), or the path of a Unix socket')
+parser.add_argument('--authkey', default='replay', help='the replay_server_authkey of the training processes')
+parser.add_argument('--size', type=int, default=2**10, help='maximum number of batches of every type')
+parser.add_argument('--megabytes', type=float, default=0, help='maximum size in megabytes of the compressed batches, 0 for no limit')
+parser.add_argument('--checkpoint', default=None, help='file where the buffer is saved when the training processes save their checkpoints, and loaded at start')
+ARGS = parser.parse_args()
+print("ARGS:", ARGS)
+
+server = ReplayServer(
+	buffer=PrioritizedBuffer(size=ARGS.size, byte_budget=int(ARGS.megabytes*2**20), name='replay_server'), 
+	address=ARGS.address, 
+	authkey=ARGS.authkey.encode(), 
+	checkpoint_path=ARGS.checkpoint
+)
+if server.load():
+	print("Replay server loaded {} batches from {}".format(server.buffer.count(), ARGS.checkpoint))
+try:
+	server.serve_forever()
+finally:
+	server.close()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from agent.batch import ExperienceBatch
+
+# ExperienceBatch.compute_discounted_cumulative_reward must match the step-by-step loop it replaced.
+# Both versions run the same float64 operations in the same order (y[t] = x[t] + gamma*y[t+1]), so they are expected to match bitwise.
+# The baseline promotes values to float64 as numpy 1.x does when a float32 scalar meets a python float; the tolerance only absorbs the rounding of a different lfilter build.
+GAMMA = 0.99
+PARTITIONER_GAMMA = 0.9
+LAMBD = 0.95
+TOLERANCE = 1e-12
+
+def baseline(batch, agents, last_value, gamma, lambd): # the loop used before the vectorization
+	discounted_cumulative_rewards = {i: [] for i in agents}
+	generalized_advantage_estimators = {i: [] for i in agents}
+	discounted_cumulative_reward = np.float64(last_value)
+	generalized_advantage_estimator = 0.0
+	last_value = np.float64(last_value)
+	for (agent,pos) in batch.reversed_step_generator(agents):
+		reward, value = batch.get_action(['rewards','values'], agent, pos)
+		reward = np.sum(reward) # extrinsic + intrinsic reward
+		value = np.float64(value)
+		discounted_cumulative_reward = reward + gamma*discounted_cumulative_reward
+		generalized_advantage_estimator = reward + gamma*last_value - value + gamma*lambd*generalized_advantage_estimator
+		discounted_cumulative_rewards[agent].insert(0, discounted_cumulative_reward)
+		generalized_advantage_estimators[agent].insert(0, generalized_advantage_estimator)
+		last_value = value
+	return discounted_cumulative_rewards, generalized_advantage_estimators
+
+def build_batch(random, model_size, steps, manager_probability):
+	# the manager (agent 0) acts every few steps, the workers act in between: their steps are interleaved
+	batch = ExperienceBatch(model_size)
+	for _ in range(steps):
+		agent = 0 if model_size == 1 or random.random_sample() < manager_probability else random.randint(1, model_size)
+		reward = random.randn(2) * (random.random_sample(2) < 0.3) # sparse extrinsic and intrinsic rewards
+		value = np.float32(random.randn())
+		batch.add_action(agent_id=agent, state=np.zeros(1), concat=None, action=np.zeros(1), policy=np.zeros(1), reward=reward, value=value)
+	return batch
+
+def check_agents(batch, agents, last_value, gamma):
+	expected_rewards, expected_advantages = baseline(batch, agents, last_value, gamma, LAMBD)
+	batch.compute_discounted_cumulative_reward(agents=agents, last_value=last_value, gamma=gamma, lambd=LAMBD)
+	for agent in agents:
+		for (expected, result) in [(expected_rewards[agent], batch.discounted_cumulative_rewards[agent]), (expected_advantages[agent], batch.generalized_advantage_estimators[agent])]:
+			expected = np.array(expected, dtype=np.float64)
+			result = np.array(result, dtype=np.float64)
+			assert expected.shape == result.shape, "agent {}: {} steps expected, {} computed".format(agent, expected.shape, result.shape)
+			np.testing.assert_allclose(result, expected, rtol=TOLERANCE, atol=TOLERANCE, err_msg="agent {}".format(agent))
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("model_size,steps,manager_probability", [
+	(1, 60, 0.), # a single agent
+	(2, 60, 0.2), # the manager and one worker
+	(3, 60, 0.2),
+	(5, 60, 0.2), # the default partition_count
+	(5, 7, 0.5), # a short batch, some workers may not act at all
+	(3, 200, 0.05), # long runs of worker steps
+])
+def test_interleaved_agents(seed, model_size, steps, manager_probability):
+	random = np.random.RandomState(seed)
+	batch = build_batch(random, model_size, steps, manager_probability)
+	last_value = random.randn()
+	workers = set(range(1, model_size))
+	# as in ReinforcementLearningPartitioner.compute_discounted_cumulative_reward: all the agents with gamma, then the manager alone with its own gamma
+	check_agents(batch, set(range(model_size)), last_value, GAMMA)
+	check_agents(batch, [0], last_value, PARTITIONER_GAMMA)
+	if len(workers) > 0:
+		check_agents(batch, workers, last_value, GAMMA)
+
+def test_single_step():
+	batch = ExperienceBatch(1)
+	batch.add_action(agent_id=0, state=np.zeros(1), concat=None, action=np.zeros(1), policy=np.zeros(1), reward=np.array([1.,0.5]), value=np.float32(0.25))
+	batch.compute_discounted_cumulative_reward(agents=[0], last_value=2., gamma=GAMMA, lambd=LAMBD)
+	assert np.isclose(batch.discounted_cumulative_rewards[0][0], 1.5 + GAMMA*2.)
+	assert np.isclose(batch.generalized_advantage_estimators[0][0], 1.5 + GAMMA*2. - 0.25)
@@ -1,26 +1,42 @@
 # -*- coding: utf-8 -*-
 import numpy as np
 from collections import deque
-from sortedcontainers import SortedDict
+from utils.segment_tree import SumSegmentTree, MinSegmentTree
+
+def get_byte_size(batch): # the bytes held by a stored batch
+	if hasattr(batch, 'get_byte_size'):
+		return batch.get_byte_size()
+	return np.asarray(batch).nbytes
 
 class Buffer(object):
 	# __slots__ = ('types', 'size', 'batches')
+	# Every type keeps at most size batches. If byte_budget > 0, every type also keeps at most byte_budget/type_count bytes (the managers use 3 type ids):
+	# batches are evicted with the same policy used when the type is full, but the last batch of a type is always kept.
+	# If more than type_count types are put, the budget is split among all of them and every type is shrunk to its new share.
 	
-	def __init__(self, size):
+	def __init__(self, size, compressor=None, byte_budget=0, type_count=3, name='buffer'):
 		self.size = size
+		self.compressor = compressor # if not None, batches are stored compressed
+		self.byte_budget = byte_budget
+		self.type_count = type_count
+		self.name = name # prefix of the statistics
 		self.clean()
 		
 	def clean(self):
 		self.types = {}
 		self.batches = []
+		self.byte_sizes = [] # the bytes of every stored batch
+		self.type_bytes = [] # the bytes of every type
+		self.entry_ids = [] # a unique increasing id for every stored batch, used by incremental checkpoints
+		self.next_entry_id = 0
 		
 	def get_batches(self, type_id=None):
 		if type_id is None:
 			result = []
 			for value in self.types.values():
-				result += self.batches[value]
+				result += [self.unpack(batch) for batch in self.batches[value]]
 			return result
-		return self.batches[self.get_type(type_id)]
+		return [self.unpack(batch) for batch in self.batches[self.get_type(type_id)]]
 
 	def has_atleast(self, frames, type=None):
 		return self.count(type) >= frames
@@ -47,7 +63,11 @@ class Buffer(object):
 		return not self.has_atleast(1, type)
 		
 	def get_type(self, type_id):
-		self.add_type(type_id)
+		if type_id not in self.types:
+			self.add_type(type_id)
+			if self.byte_budget > 0 and len(self.types) > self.type_count: # the share of every type has shrunk
+				for type in self.types.values():
+					self.fit_budget(type)
 		return self.types[type_id]
 		
 	def add_type(self, type_id):
@@ -55,78 +75,226 @@ class Buffer(object):
 			return
 		self.types[type_id] = len(self.types)
 		self.batches.append(deque())
+		self.byte_sizes.append(deque())
+		self.type_bytes.append(0)
+		self.entry_ids.append(deque())
+		
+	def get_bytes(self, type=None):
+		if type is None:
+			return sum(self.type_bytes)
+		return self.type_bytes[type]
+		
+	def is_over_budget(self, type):
+		return self.byte_budget > 0 and self.type_bytes[type] > self.byte_budget/max(self.type_count, len(self.types))
+		
+	def fit_budget(self, type):
+		while self.is_over_budget(type) and self.count(type) > 1:
+			self.evict(type)
 
+	def new_entry_id(self):
+		entry_id = self.next_entry_id
+		self.next_entry_id += 1
+		return entry_id
+		
+	def get_entries(self): # (entry_id, type_id, priority, packed batch) of every stored batch, priority is None for not prioritized buffers
+		result = []
+		for (type_id, type) in self.types.items():
+			result += [(entry_id, type_id, None, batch) for (entry_id, batch) in zip(self.entry_ids[type], self.batches[type])]
+		return result
+		
+	def restore_entry(self, entry_id, type_id, priority, batch): # put a batch of a checkpoint, with its entry id
+		self.next_entry_id = entry_id
+		self.put(batch=batch, type_id=type_id)
+		
+	def pack(self, batch):
+		return batch if self.compressor is None else self.compressor.compress(batch)
+		
+	def unpack(self, batch):
+		return batch if self.compressor is None else self.compressor.decompress(batch)
+		
+	def get_statistics(self):
+		stats = {} if self.compressor is None else self.compressor.get_statistics()
+		stats[self.name + '_bytes'] = self.get_bytes()
+		for (type_id, type) in self.types.items():
+			stats['{}_type{}_bytes'.format(self.name, type_id)] = self.get_bytes(type)
+		return stats
+			
 	def put(self, batch, type_id=0): # put batch into buffer
 		type = self.get_type(type_id)
 		if self.is_full(type):
-			self.batches[type].popleft()
+			self.remove_oldest(type)
+		batch = self.pack(batch)
+		byte_size = get_byte_size(batch)
 		self.batches[type].append(batch)
+		self.byte_sizes[type].append(byte_size)
+		self.type_bytes[type] += byte_size
+		self.entry_ids[type].append(self.new_entry_id())
+		self.fit_budget(type)
+			
+	def evict(self, type): # the batch removed to fit the byte budget
+		self.remove_oldest(type)
+			
+	def remove_oldest(self, type):
+		self.batches[type].popleft()
+		self.type_bytes[type] -= self.byte_sizes[type].popleft()
+		self.entry_ids[type].popleft()
 
 	def sample(self):
 		# assert self.has_atleast(frames=1)
 		type = np.random.choice( [value for value in self.types.values() if not self.is_empty(value)] )
 		id = np.random.randint(0, len(self.batches[type]))
-		return self.batches[type][id]
+		return self.unpack(self.batches[type][id])
+		
+	def sample_batch(self, k):
+		return [self.sample() for _ in range(k)]
 
 class PrioritizedBuffer(Buffer):
+	# Batches of every type are kept in size slots. A sum tree samples slots proportionally to their priority (negative priorities count as zero),
+	# a min tree finds the slot with the lowest priority, that is replaced when the type is full.
+	# Batches put without priority get the max priority seen so far, as in PER (Schaul, Tom, et al. "Prioritized experience replay." ICLR 2016).
 	
 	def clean(self):
 		super().clean()
-		self.prefixsum = []
-		self.priorities = []
+		self.max_priority = 1.
+		self.sum_trees = []
+		self.min_trees = []
+		self.free_slots = []
 		
 	def get_batches(self, type_id=None):
 		if type_id is None:
 			result = []
 			for type in self.types.values():
-				result += self.batches[type].values()
+				result += self.get_type_batches(type)
 			return result
-		return self.batches[self.get_type(type_id)].values()
+		return self.get_type_batches(self.get_type(type_id))
+		
+	def get_type_batches(self, type):
+		return [self.unpack(batch) for batch in self.batches[type] if batch is not None]
+		
+	def count(self, type=None):
+		if type is None:
+			return sum(self.count(type) for type in self.types.values())
+		return self.size - len(self.free_slots[type])
 		
 	def add_type(self, type_id):
 		if type_id in self.types:
 			return
 		self.types[type_id] = len(self.types)
-		self.batches.append(SortedDict())
-		self.prefixsum.append([])
-		self.priorities.append({})
-		
-	def get_priority_from_unique(self, unique):
-		return float(unique.split('#', 1)[0])
+		self.batches.append([None]*self.size)
+		self.byte_sizes.append(np.zeros(self.size, dtype=np.int64))
+		self.type_bytes.append(0)
+		self.entry_ids.append(np.full(self.size, -1, dtype=np.int64)) # -1 for free slots
+		self.sum_trees.append(SumSegmentTree(self.size))
+		self.min_trees.append(MinSegmentTree(self.size))
+		self.free_slots.append(list(range(self.size-1,-1,-1)))
 		
-	def build_unique(self, priority, count):
-		return '{:.5f}#{}'.format(priority,count) # new batch has higher unique priority than old ones with same shared priority
-		
-	def put(self, batch, priority, type_id=0): # O(log)
+	def put(self, batch, priority=None, type_id=0): # O(log)
+		if priority is None:
+			priority = self.max_priority
 		type = self.get_type(type_id)
 		if self.is_full(type):
-			old_unique_batch_priority, _ = self.batches[type].popitem(index=0) # argument with lowest priority is always 0 because buffer is sorted by priority
-			old_priority = self.get_priority_from_unique(old_unique_batch_priority)
-			if old_priority in self.priorities[type] and self.priorities[type][old_priority] == 1: # remove from priority dictionary in order to prevent buffer overflow
-				del self.priorities[type][old_priority]
-		priority_count = self.priorities[type][priority] if priority in self.priorities[type] else 0
-		priority_count = (priority_count % self.size) + 1 # modular counter to avoid overflow
-		self.priorities[type][priority] = priority_count
-		unique_batch_priority = self.build_unique(priority,priority_count)
-		self.batches[type].update({unique_batch_priority: batch}) # O(log)
-		self.prefixsum[type] = None # compute prefixsum only if needed, when sampling
-		
-	def keyed_sample(self): # O(n) after a new put, O(log) otherwise
-		type_id = np.random.choice( [key for key,value in self.types.items() if not self.is_empty(value)] )
-		type = self.get_type(type_id)
-		if self.prefixsum[type] is None: # compute prefixsum
-			self.prefixsum[type] = np.cumsum([self.get_priority_from_unique(k) for k in self.batches[type].keys()]) # O(n)
-		mass = np.random.random() * self.prefixsum[type][-1]
-		idx = np.searchsorted(self.prefixsum[type], mass) # O(log) # Find arg of leftmost item greater than or equal to x
-		keys = self.batches[type].keys()
-		if idx == len(keys): # this may happen when self.prefixsum[type] is negative
-			idx = -1
-		return self.batches[type][keys[idx]], idx, type_id
-		
-	def sample(self): # O(n) after a new put, O(log) otherwise
+			idx = self.min_trees[type].argmin() # replace the batch with lowest priority
+		else:
+			idx = self.free_slots[type].pop()
+		batch = self.pack(batch)
+		byte_size = get_byte_size(batch)
+		self.batches[type][idx] = batch
+		self.type_bytes[type] += byte_size - self.byte_sizes[type][idx]
+		self.byte_sizes[type][idx] = byte_size
+		self.entry_ids[type][idx] = self.new_entry_id()
+		self.set_priority(type, idx, priority)
+		self.fit_budget(type)
+		
+	def evict(self, type):
+		self.remove_slot(type, self.min_trees[type].argmin()) # the batch with lowest priority
+			
+	def remove_slot(self, type, idx): # O(log)
+		self.batches[type][idx] = None
+		self.sum_trees[type][idx] = 0.
+		self.min_trees[type][idx] = float("inf")
+		self.type_bytes[type] -= self.byte_sizes[type][idx]
+		self.byte_sizes[type][idx] = 0
+		self.entry_ids[type][idx] = -1
+		self.free_slots[type].append(idx)
+		
+	def set_priority(self, type, idx, priority): # O(log)
+		self.max_priority = max(self.max_priority, priority)
+		self.sum_trees[type][idx] = max(0., priority)
+		self.min_trees[type][idx] = priority
+		
+	def get_entries(self): # O(n)
+		result = []
+		for (type_id, type) in self.types.items():
+			min_tree = self.min_trees[type]
+			result += [(int(self.entry_ids[type][idx]), type_id, float(min_tree[idx]), self.batches[type][idx]) for idx in self.get_occupied_slots(type)]
+		return result
+		
+	def restore_entry(self, entry_id, type_id, priority, batch):
+		self.next_entry_id = entry_id
+		self.put(batch=batch, priority=priority, type_id=type_id)
+		
+	def keyed_sample(self): # O(log)
+		return self.keyed_sample_batch(1)[0]
+		
+	def keyed_sample_batch(self, k): # O(k*log)
+		# every sample is (batch, idx, type_id, entry_id), the type is chosen uniformly among the not empty ones
+		type_ids = [key for key,value in self.types.items() if not self.is_empty(value)]
+		sampled_type_ids = np.random.choice(type_ids, size=k)
+		result = []
+		for type_id in type_ids:
+			type_count = np.count_nonzero(sampled_type_ids == type_id)
+			if type_count == 0:
+				continue
+			type = self.types[type_id]
+			idx_list = self.sample_slots(type, type_count)
+			result += [(self.unpack(self.batches[type][idx]), idx, type_id, int(self.entry_ids[type][idx])) for idx in idx_list]
+		return result
+		
+	def sample_slots(self, type, k):
+		sum_tree = self.sum_trees[type]
+		total_priority = sum_tree.reduce()
+		if total_priority <= 0: # no batch has positive priority, sample uniformly
+			return np.random.choice(self.get_occupied_slots(type), size=k)
+		idx_list = np.minimum(sum_tree.find_prefixsum_idx(np.random.random(k) * total_priority), self.size-1)
+		for i, idx in enumerate(idx_list):
+			if self.is_free_slot(type, idx): # rounding errors may lead to an empty slot
+				idx_list[i] = np.random.choice(self.get_occupied_slots(type))
+		return idx_list
+		
+	def is_free_slot(self, type, idx): # O(1)
+		return self.min_trees[type][idx] == float("inf")
+		
+	def get_occupied_slots(self, type): # O(n)
+		min_tree = self.min_trees[type]
+		return np.flatnonzero(min_tree.tree[min_tree.capacity:min_tree.capacity+self.size] < float("inf"))
+		
+	def sample(self): # O(log)
 		return self.keyed_sample()[0]
+		
+	def sample_batch(self, k): # O(k*log)
+		return [batch for (batch, _, _, _) in self.keyed_sample_batch(k)]
+
+	# With the entry ids of the samples, the updates of slots freed or replaced since they were sampled are skipped:
+	# the priority of a batch is never given to another one, and a freed slot never gets back a finite priority.
 
-	def update_priority(self, idx, priority, type_id=0): # O(log)
+	def update_priority(self, idx, priority, type_id=0, entry_id=None): # O(log)
 		type = self.get_type(type_id)
-		_, batch = self.batches[type].popitem(index=idx) # argument with lowest priority is always 0 because buffer is sorted by priority
-		self.put(batch, priority, type_id)
\ No newline at end of file
+		if entry_id is None or self.entry_ids[type][idx] == entry_id:
+			self.set_priority(type, idx, priority)
+		
+	def update_priorities(self, idx_list, priority_list, type_id_list, entry_id_list=None): # O(k*log), in bulk for every type
+		idx_list = np.asarray(idx_list)
+		priority_list = np.asarray(priority_list, dtype=np.float64)
+		type_id_list = np.asarray(type_id_list)
+		for type_id in np.unique(type_id_list):
+			type = self.get_type(type_id)
+			type_mask = type_id_list == type_id
+			if entry_id_list is not None:
+				type_mask[type_mask] = self.entry_ids[type][idx_list[type_mask]] == np.asarray(entry_id_list)[type_mask]
+			if np.any(type_mask):
+				self.set_priorities(type, idx_list[type_mask], priority_list[type_mask])
+				
+	def set_priorities(self, type, idx_list, priority_list): # O(k*log)
+		self.max_priority = max(self.max_priority, np.max(priority_list))
+		self.sum_trees[type].update(idx_list, np.maximum(0., priority_list))
+		self.min_trees[type].update(idx_list, priority_list)
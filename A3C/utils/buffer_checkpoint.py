@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import numpy as np
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+NONE_FIELDS_KEY = '__none__' # the names of the fields of a record with value None
+NOT_SAVED = -1
+
+class BufferCheckpoint(object):
+	# Incremental checkpoint of a buffer in directory: a save writes only the entries added since the previous save, as a new append-only segment.
+	# Segments are .npz files of numpy arrays (loaded without pickle), the manifest is a json file listing the segments and the state of the buffer (eg: which entries are alive).
+	# The manifest is replaced atomically after the segment is written: a crash while saving leaves the previous checkpoint valid.
+	# When more than compaction_threshold of the entries in the segments are dead (eg: evicted), the live ones are rewritten in a single segment.
+	kind = 'buffer'
+
+	def __init__(self, directory, compaction_threshold=0.5):
+		self.directory = directory
+		self.compaction_threshold = compaction_threshold
+		self.manifest = None # the manifest of the last save or load, None if the content of directory does not belong to this run
+
+	def get_path(self, name):
+		return os.path.join(self.directory, name)
+
+	def read_manifest(self):
+		path = self.get_path(MANIFEST_NAME)
+		if not os.path.exists(path):
+			return None
+		with open(path, 'r', encoding='utf-8') as file:
+			manifest = json.load(file)
+		if manifest.get('kind') != self.kind or manifest.get('format_version', 0) > FORMAT_VERSION:
+			raise ValueError("{} has a {} checkpoint of version {}, expected a {} checkpoint of version at most {}".format(path, manifest.get('kind'), manifest.get('format_version'), self.kind, FORMAT_VERSION))
+		return manifest
+
+	def write_manifest(self, manifest):
+		temporary_path = self.get_path(MANIFEST_NAME + '.tmp')
+		with open(temporary_path, 'w', encoding='utf-8') as file:
+			json.dump(manifest, file)
+		os.replace(temporary_path, self.get_path(MANIFEST_NAME))
+		self.manifest = manifest
+
+	def new_manifest(self):
+		return {'kind': self.kind, 'format_version': FORMAT_VERSION, 'next_segment': 0, 'segments': []}
+
+	def write_segment(self, manifest, arrays, entry_count): # appends a segment to manifest, that is not written yet
+		name = 'segment_{:06d}.npz'.format(manifest['next_segment'])
+		for (key, value) in arrays.items():
+			if value.dtype.hasobject:
+				raise ValueError("field {} cannot be saved without pickle".format(key))
+		temporary_path = self.get_path(name + '.tmp')
+		with open(temporary_path, 'wb') as file:
+			np.savez(file, **arrays)
+		os.replace(temporary_path, self.get_path(name))
+		manifest['next_segment'] += 1
+		manifest['segments'].append({'name': name, 'entries': entry_count})
+
+	def read_segments(self, manifest):
+		for segment in manifest['segments']:
+			with np.load(self.get_path(segment['name']), allow_pickle=False) as arrays:
+				yield segment, arrays
+
+	def remove_unlisted_files(self, manifest): # segments replaced by a compaction, or written by an interrupted save
+		listed_names = set(segment['name'] for segment in manifest['segments'])
+		for name in os.listdir(self.directory):
+			if name.startswith('segment_') and name not in listed_names:
+				os.remove(self.get_path(name))
+
+	def get_next_free_segment(self): # segments are never overwritten
+		segment_numbers = [int(name[len('segment_'):].split('.')[0]) for name in os.listdir(self.directory) if name.startswith('segment_')]
+		return max(segment_numbers) + 1 if len(segment_numbers) > 0 else 0
+
+	def get_stored_entry_count(self, manifest):
+		return sum(segment['entries'] for segment in manifest['segments'])
+
+	def needs_compaction(self, manifest, live_count, new_count):
+		stored_count = self.get_stored_entry_count(manifest) + new_count
+		return stored_count > 0 and (stored_count - live_count)/stored_count > self.compaction_threshold
+
+	def save(self, buffer, global_step):
+		os.makedirs(self.directory, exist_ok=True)
+		manifest = self.manifest
+		if manifest is None: # start a new checkpoint, the segments of the old one are removed after the new manifest is written
+			manifest = self.new_manifest()
+			manifest['next_segment'] = self.get_next_free_segment()
+		else:
+			manifest = json.loads(json.dumps(manifest)) # a copy, the current manifest stays valid until the new one is written
+		self.save_buffer(buffer, manifest)
+		manifest['global_step'] = global_step
+		self.write_manifest(manifest)
+		self.remove_unlisted_files(manifest)
+
+	def load(self, buffer): # returns whether the buffer has been loaded
+		manifest = self.read_manifest()
+		if manifest is None:
+			return False
+		self.load_buffer(buffer, manifest)
+		self.manifest = manifest
+		return True
+
+	def save_buffer(self, buffer, manifest):
+		raise NotImplementedError()
+
+	def load_buffer(self, buffer, manifest):
+		raise NotImplementedError()
+
+class ExperienceBufferCheckpoint(BufferCheckpoint):
+	# Checkpoint of a Buffer or PrioritizedBuffer of batches stored with batch.get_record() and loaded with batch_from_record(record).
+	# Entries are identified by the entry ids of the buffer, the manifest keeps the id, type and priority of the live ones.
+	kind = 'experience_buffer'
+
+	def __init__(self, directory, batch_from_record, compaction_threshold=0.5):
+		super().__init__(directory, compaction_threshold)
+		self.batch_from_record = batch_from_record
+
+	def new_manifest(self):
+		manifest = super().new_manifest()
+		manifest['next_entry_id'] = 0
+		manifest['live_entries'] = []
+		return manifest
+
+	def get_entry_arrays(self, buffer, entries):
+		arrays = {}
+		for (entry_id, _, _, batch) in entries:
+			record = buffer.unpack(batch).get_record()
+			none_fields = []
+			for (name, value) in record.items():
+				if value is None:
+					none_fields.append(name)
+				else:
+					arrays['{}:{}'.format(entry_id, name)] = np.asarray(value)
+			arrays['{}:{}'.format(entry_id, NONE_FIELDS_KEY)] = np.array(none_fields, dtype=np.str_)
+		return arrays
+
+	def save_buffer(self, buffer, manifest):
+		entries = buffer.get_entries()
+		new_entries = [entry for entry in entries if entry[0] >= manifest['next_entry_id']]
+		if self.needs_compaction(manifest, live_count=len(entries), new_count=len(new_entries)):
+			manifest['segments'] = []
+			new_entries = entries
+		if len(new_entries) > 0:
+			self.write_segment(manifest, self.get_entry_arrays(buffer, new_entries), entry_count=len(new_entries))
+		manifest['next_entry_id'] = buffer.next_entry_id
+		manifest['live_entries'] = [[entry_id, int(type_id), priority] for (entry_id, type_id, priority, _) in entries]
+
+	def load_buffer(self, buffer, manifest):
+		live_entries = {entry_id: (type_id, priority) for (entry_id, type_id, priority) in manifest['live_entries']}
+		records = {}
+		for (_, arrays) in self.read_segments(manifest):
+			for key in arrays.files:
+				entry_id, name = key.split(':', 1)
+				entry_id = int(entry_id)
+				if entry_id not in live_entries:
+					continue
+				record = records.setdefault(entry_id, {})
+				if name == NONE_FIELDS_KEY:
+					record.update((str(none_name), None) for none_name in arrays[key])
+				else:
+					record[name] = arrays[key]
+		buffer.clean()
+		for entry_id in sorted(records.keys()): # in the order they were put
+			type_id, priority = live_entries[entry_id]
+			buffer.restore_entry(entry_id, type_id, priority, self.batch_from_record(records[entry_id]))
+		buffer.next_entry_id = manifest['next_entry_id']
+
+class RewardPredictionBufferCheckpoint(BufferCheckpoint):
+	# Checkpoint of a RewardPredictionBuffer: segments keep the examples added to every class since the previous save, from the oldest.
+	# Loading puts the examples of all the segments in order, the rings end up as they were saved.
+	kind = 'reward_prediction_buffer'
+
+	def new_manifest(self):
+		manifest = super().new_manifest()
+		manifest['added_counts'] = None
+		return manifest
+
+	def get_example_arrays(self, buffer, example_counts):
+		arrays = {}
+		for (reward_class, count) in enumerate(example_counts):
+			if count > 0:
+				arrays['class{}.states'.format(reward_class)], arrays['class{}.lengths'.format(reward_class)] = buffer.get_recent_examples(reward_class, count)
+		return arrays
+
+	def save_buffer(self, buffer, manifest):
+		live_counts = buffer.counts
+		if manifest['added_counts'] is None:
+			new_counts = live_counts
+		else:
+			new_counts = np.minimum(live_counts, buffer.added_counts - np.array(manifest['added_counts']))
+		if self.needs_compaction(manifest, live_count=int(np.sum(live_counts)), new_count=int(np.sum(new_counts))):
+			manifest['segments'] = []
+			new_counts = live_counts
+		if np.sum(new_counts) > 0:
+			self.write_segment(manifest, self.get_example_arrays(buffer, new_counts), entry_count=int(np.sum(new_counts)))
+		manifest['added_counts'] = [int(count) for count in buffer.added_counts]
+
+	def load_buffer(self, buffer, manifest):
+		buffer.clean()
+		for (_, arrays) in self.read_segments(manifest):
+			for reward_class in range(len(buffer.counts)):
+				if 'class{}.states'.format(reward_class) in arrays.files:
+					buffer.restore_examples(reward_class, arrays['class{}.states'.format(reward_class)], arrays['class{}.lengths'.format(reward_class)])
+		if manifest['added_counts'] is not None:
+			buffer.added_counts = np.array(manifest['added_counts'], dtype=np.int64)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import lzma
+import time
+import zlib
+from collections import OrderedDict
+import numpy as np
+
+class CompressedBatch(object):
+	# A batch whose state arrays are kept as compressed bytes, one block per agent
+	__slots__ = ('key', 'batch', 'blocks')
+
+	def __init__(self, key, batch, blocks):
+		self.key = key # unique, for caching the decompressed batch
+		self.batch = batch # the batch without states
+		self.blocks = blocks # (bytes, shape, dtype) or None, for every agent
+		
+	def get_byte_size(self):
+		return self.batch.get_byte_size() + sum(len(block[0]) for block in self.blocks if block is not None)
+
+class BatchCompressor(object):
+	# Compresses the states of the batches entering a buffer and decompresses them when they are sampled.
+	# Methods: zlib, lzma, or delta (the difference with the previous frame, then zlib). All of them are lossless:
+	# deltas are computed on the integer view of the states, with wrap-around.
+	# The last cache_size decompressed batches are kept in a LRU cache. As with uncompressed buffers, changes to the fields of a sampled batch are kept, except for states.
+
+	def __init__(self, method, cache_size, name):
+		if method not in ['zlib', 'lzma', 'delta']:
+			raise ValueError("unknown compression method {}, use zlib, lzma or delta".format(method))
+		self.method = method
+		self.cache_size = cache_size
+		self.name = name # prefix of the statistics
+		self.cache = OrderedDict()
+		self.next_key = 0
+		# Statistics
+		self._raw_bytes = 0
+		self._compressed_bytes = 0
+		self._compression_time = 0
+		self._compression_count = 0
+		self._decompression_time = 0
+		self._decompression_count = 0
+
+	def __getstate__(self): # the cache is not pickled
+		state = self.__dict__.copy()
+		state['cache'] = OrderedDict()
+		return state
+
+	def compress(self, batch):
+		start = time.time()
+		blocks = [None if array is None else self.compress_array(array) for array in batch.get_state_arrays()]
+		self.next_key += 1
+		compressed_batch = CompressedBatch(key=self.next_key, batch=batch.copy_with_state_arrays([None]*len(blocks)), blocks=blocks)
+		self._compression_time += time.time() - start
+		self._compression_count += 1
+		return compressed_batch
+
+	def decompress(self, compressed_batch):
+		batch = self.cache.get(compressed_batch.key)
+		if batch is not None:
+			self.cache.move_to_end(compressed_batch.key)
+			return batch
+		start = time.time()
+		batch = compressed_batch.batch.copy_with_state_arrays([None if block is None else self.decompress_array(*block) for block in compressed_batch.blocks])
+		self._decompression_time += time.time() - start
+		self._decompression_count += 1
+		self.cache[compressed_batch.key] = batch
+		if len(self.cache) > self.cache_size:
+			self.cache.popitem(last=False)
+		return batch
+
+	def compress_array(self, array):
+		array = np.ascontiguousarray(array)
+		if self.method == 'delta':
+			frames = array.view(np.dtype('i{}'.format(array.dtype.itemsize))) # bit-exact integer view
+			data = zlib.compress(np.concatenate([frames[:1], np.diff(frames, axis=0)]).tobytes())
+		elif self.method == 'lzma':
+			data = lzma.compress(array.tobytes())
+		else:
+			data = zlib.compress(array.tobytes())
+		self._raw_bytes += array.nbytes
+		self._compressed_bytes += len(data)
+		return (data, array.shape, array.dtype)
+
+	def decompress_array(self, data, shape, dtype):
+		if self.method == 'delta':
+			integer_dtype = np.dtype('i{}'.format(dtype.itemsize))
+			deltas = np.frombuffer(zlib.decompress(data), dtype=integer_dtype).reshape(shape)
+			return np.cumsum(deltas, axis=0, dtype=integer_dtype).view(dtype)
+		if self.method == 'lzma':
+			return np.frombuffer(lzma.decompress(data), dtype=dtype).reshape(shape).copy()
+		return np.frombuffer(zlib.decompress(data), dtype=dtype).reshape(shape).copy()
+
+	def get_statistics(self):
+		stats = {}
+		if self._compressed_bytes > 0:
+			stats[self.name + '_compression_ratio'] = self._raw_bytes/self._compressed_bytes
+		if self._compression_count > 0:
+			stats[self.name + '_compression_time'] = self._compression_time/self._compression_count
+		if self._decompression_count > 0:
+			stats[self.name + '_decompression_time'] = self._decompression_time/self._decompression_count
+		return stats
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+import os
+from glob import glob
+from collections import deque
+import numpy as np
+from utils.buffer import Buffer, PrioritizedBuffer
+
+NONE_LENGTH = -1 # the record has the field, with value None
+MISSING_LENGTH = -2 # the record has not the field
+STEP_FIELD_PREFIX = 'steps.' # fields with a variable number of rows
+
+def check_dtype(path, array, dtype): # values of another type would be cast silently
+	if array.dtype != np.dtype(dtype):
+		raise ValueError("{} has type {}, expected {}: was it created with a different state encoding?".format(path, array.dtype, np.dtype(dtype)))
+
+def open_array(path, shape, dtype, fill_value=None): # a memory-mapped .npy file, created if missing
+	if os.path.exists(path):
+		array = np.load(path, mmap_mode='r+')
+		if array.shape != tuple(shape):
+			raise ValueError("{} has shape {}, expected {}: was it created with a different buffer size?".format(path, array.shape, tuple(shape)))
+		check_dtype(path, array, dtype)
+		return array
+	array = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=tuple(shape))
+	if fill_value is not None:
+		array[:] = fill_value
+	return array
+
+class RecordFile(object):
+	# size slots of records, a record is a dict of named numpy arrays (or None values).
+	# Every field is stored in its own memory-mapped .npy file of shape (size,)+field_shape, created when the field is first seen.
+	# Fields named with the STEP_FIELD_PREFIX have a variable first dimension, up to max_steps rows.
+	# The index keeps for every field and slot the number of rows of the field (0 for fixed-shape fields), NONE_LENGTH or MISSING_LENGTH.
+	# Reading a record touches only the pages of its slot.
+
+	def __init__(self, directory, size, max_steps):
+		self.directory = directory
+		self.size = size
+		self.max_steps = max_steps
+		os.makedirs(os.path.join(directory, 'fields'), exist_ok=True)
+		self.occupied = self.open_array('occupied', shape=(size,), dtype=np.bool_, fill_value=False)
+		self.data = {}
+		self.index = {}
+		self.reopened_fields = set() # fields of a previous run whose type has not been checked yet
+		for index_path in glob(self.get_field_path('*', 'index')): # fields of a previous run
+			name = os.path.basename(index_path)[:-len('.index.npy')]
+			self.index[name] = open_array(index_path, shape=(size,), dtype=np.int32)
+			if os.path.exists(self.get_field_path(name, 'data')):
+				self.data[name] = np.load(self.get_field_path(name, 'data'), mmap_mode='r+')
+				self.reopened_fields.add(name)
+
+	def open_array(self, name, shape, dtype, fill_value=None): # an array stored with the records, eg: their priorities
+		return open_array(os.path.join(self.directory, name + '.npy'), shape, dtype, fill_value)
+
+	def get_field_path(self, name, kind):
+		return os.path.join(self.directory, 'fields', '{}.{}.npy'.format(name, kind))
+
+	def is_step_field(self, name):
+		return name.startswith(STEP_FIELD_PREFIX)
+
+	def get_field_data(self, name, value):
+		data = self.data.get(name)
+		if data is None:
+			shape = ((self.max_steps,) + value.shape[1:]) if self.is_step_field(name) else value.shape
+			data = self.data[name] = open_array(self.get_field_path(name, 'data'), shape=(self.size,)+shape, dtype=value.dtype)
+		elif name in self.reopened_fields: # the first record of this run with the field
+			check_dtype(self.get_field_path(name, 'data'), data, value.dtype)
+			self.reopened_fields.discard(name)
+		return data
+
+	def get_field_index(self, name):
+		index = self.index.get(name)
+		if index is None:
+			index = self.index[name] = open_array(self.get_field_path(name, 'index'), shape=(self.size,), dtype=np.int32, fill_value=MISSING_LENGTH)
+		return index
+
+	def put(self, idx, record):
+		self.occupied[idx] = False # until the whole record is written
+		for name, value in record.items():
+			index = self.get_field_index(name)
+			if value is None:
+				index[idx] = NONE_LENGTH
+				continue
+			value = np.asarray(value)
+			data = self.get_field_data(name, value)
+			if self.is_step_field(name):
+				if len(value) > self.max_steps or value.shape[1:] != data.shape[2:]:
+					raise ValueError("field {} has shape {}, at most {} rows of shape {} fit in a record".format(name, value.shape, self.max_steps, data.shape[2:]))
+				data[idx,:len(value)] = value
+				index[idx] = len(value)
+			else:
+				if value.shape != data.shape[1:]:
+					raise ValueError("field {} has shape {}, expected {}".format(name, value.shape, data.shape[1:]))
+				data[idx] = value
+				index[idx] = 0
+		for name, index in self.index.items():
+			if name not in record:
+				index[idx] = MISSING_LENGTH
+		self.occupied[idx] = True
+
+	def get(self, idx): # a copy of the record, None if the slot is empty
+		if not self.occupied[idx]:
+			return None
+		record = {}
+		for name, index in self.index.items():
+			length = index[idx]
+			if length == MISSING_LENGTH:
+				continue
+			if length == NONE_LENGTH:
+				record[name] = None
+			elif self.is_step_field(name):
+				record[name] = np.array(self.data[name][idx,:length])
+			else:
+				record[name] = np.array(self.data[name][idx])
+		return record
+
+	def remove(self, idx):
+		self.occupied[idx] = False
+
+	def get_bytes(self): # allocated on disk
+		return sum(array.nbytes for array in [self.occupied] + list(self.index.values()) + list(self.data.values()))
+
+	def flush(self): # write the dirty pages to disk
+		self.occupied.flush()
+		for array in list(self.index.values()) + list(self.data.values()):
+			array.flush()
+
+class RecordSlots(object):
+	# A list of size batches (None for empty slots) over a RecordFile, as used by PrioritizedBuffer
+
+	def __init__(self, record_file, batch_from_record):
+		self.file = record_file
+		self.batch_from_record = batch_from_record
+
+	def __len__(self):
+		return self.file.size
+
+	def __getitem__(self, idx):
+		record = self.file.get(idx)
+		return None if record is None else self.batch_from_record(record)
+
+	def __setitem__(self, idx, batch):
+		if batch is None:
+			self.file.remove(idx)
+		else:
+			self.file.put(idx, batch.get_record())
+
+	def __iter__(self):
+		return (self[idx] for idx in range(len(self)))
+
+class RecordDeque(object):
+	# A FIFO queue of at most size batches over a RecordFile, as used by Buffer. The start and the length of the queue are stored with the records.
+
+	def __init__(self, record_file, batch_from_record):
+		self.file = record_file
+		self.batch_from_record = batch_from_record
+		self.ring = record_file.open_array('ring', shape=(2,), dtype=np.int64, fill_value=0) # start, length
+
+	def __len__(self):
+		return int(self.ring[1])
+
+	def get_slot(self, pos):
+		if pos < 0:
+			pos += len(self)
+		if pos < 0 or pos >= len(self):
+			raise IndexError("deque index out of range")
+		return (int(self.ring[0]) + pos) % self.file.size
+
+	def __getitem__(self, pos):
+		return self.batch_from_record(self.file.get(self.get_slot(pos)))
+
+	def __iter__(self):
+		return (self[pos] for pos in range(len(self)))
+
+	def append(self, batch):
+		if len(self) == self.file.size:
+			self.popleft()
+		self.file.put((int(self.ring[0]) + len(self)) % self.file.size, batch.get_record())
+		self.ring[1] += 1
+
+	def popleft(self):
+		slot = self.get_slot(0)
+		self.file.remove(slot)
+		self.ring[0] = (slot + 1) % self.file.size
+		self.ring[1] -= 1
+
+class MemoryMappedStorage(object):
+	# Keeps the batches of a buffer in memory-mapped files, a RecordFile for every type in directory/type_<type_id>.
+	# Batches are stored with batch.get_record() and loaded with batch_from_record(record): a sampled batch is a copy.
+	# Only the index of the records stays in RAM, the buffer survives restarts: types already in directory are reopened by clean.
+	# Record files are preallocated: the bytes of the buffer are those allocated on disk, a byte budget is not supported.
+
+	def __init__(self, size, directory, max_steps, batch_from_record, **kwargs):
+		if kwargs.get('byte_budget', 0) > 0:
+			raise ValueError("memory-mapped buffers do not support a byte budget")
+		self.directory = directory
+		self.max_steps = max_steps
+		self.batch_from_record = batch_from_record
+		super().__init__(size, **kwargs)
+
+	def clean(self):
+		super().clean()
+		self.record_files = []
+		for type_directory in sorted(glob(os.path.join(self.directory, 'type_*'))):
+			self.add_type(int(os.path.basename(type_directory)[len('type_'):]))
+
+	def open_record_file(self, type_id):
+		record_file = RecordFile(directory=os.path.join(self.directory, 'type_{}'.format(type_id)), size=self.size, max_steps=self.max_steps)
+		self.record_files.append(record_file)
+		return record_file
+
+	def get_bytes(self, type=None):
+		if type is None:
+			return sum(record_file.get_bytes() for record_file in self.record_files)
+		return self.record_files[type].get_bytes()
+
+	def flush(self):
+		for record_file in self.record_files:
+			record_file.flush()
+
+class MemoryMappedBuffer(MemoryMappedStorage, Buffer):
+
+	def add_type(self, type_id):
+		if type_id in self.types:
+			return
+		self.types[type_id] = len(self.types)
+		self.batches.append(RecordDeque(self.open_record_file(type_id), self.batch_from_record))
+		self.byte_sizes.append(deque([0]*len(self.batches[-1]))) # the sizes of reopened batches are unknown
+		self.type_bytes.append(0)
+		self.entry_ids.append(deque([-1]*len(self.batches[-1]))) # the batches are saved in their own files, not in checkpoints
+
+class MemoryMappedPrioritizedBuffer(MemoryMappedStorage, PrioritizedBuffer):
+
+	def clean(self):
+		self.priorities = [] # stored with the records, for rebuilding the segment trees after a restart
+		super().clean()
+
+	def add_type(self, type_id):
+		if type_id in self.types:
+			return
+		super().add_type(type_id)
+		type = self.types[type_id]
+		record_file = self.open_record_file(type_id)
+		self.batches[type] = RecordSlots(record_file, self.batch_from_record)
+		self.priorities.append(record_file.open_array('priorities', shape=(self.size,), dtype=np.float64, fill_value=float("inf")))
+		occupied_slots = np.flatnonzero(record_file.occupied)
+		if len(occupied_slots) > 0: # reopened
+			priorities = self.priorities[type][occupied_slots]
+			self.max_priority = max(self.max_priority, np.max(priorities))
+			self.sum_trees[type].update(occupied_slots, np.maximum(0., priorities))
+			self.min_trees[type].update(occupied_slots, priorities)
+			self.entry_ids[type][occupied_slots] = np.arange(self.next_entry_id, self.next_entry_id+len(occupied_slots)) # new ids, for checking the priority updates
+			self.next_entry_id += len(occupied_slots)
+			self.free_slots[type] = [idx for idx in self.free_slots[type] if not record_file.occupied[idx]]
+
+	def set_priority(self, type, idx, priority):
+		super().set_priority(type, idx, priority)
+		self.priorities[type][idx] = priority
+
+	def set_priorities(self, type, idx_list, priority_list):
+		super().set_priorities(type, idx_list, priority_list)
+		self.priorities[type][idx_list] = priority_list
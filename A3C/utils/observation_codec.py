@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+import numpy as np
+
+class ObservationCodec(object):
+	# Compact encoding of the states of an environment, used by batches, replay buffers and feeds.
+	# States are encoded when they enter a batch or a feed, and decoded to float32 only inside the graph.
+	# This codec casts states to dtype: it is lossless for integer states in the range of dtype.
+
+	@staticmethod
+	def create(state_shape, dtype, value_range):
+		# the most compact codec for states of the given dtype with values in value_range (None if unbounded)
+		if value_range is None or not np.issubdtype(dtype, np.integer):
+			return ObservationCodec(state_shape)
+		low, high = value_range
+		if low >= 0 and high <= 1:
+			return BitPackedCodec(state_shape)
+		for compact_dtype in [np.uint8, np.int8, np.uint16, np.int16]:
+			info = np.iinfo(compact_dtype)
+			if info.min <= low and high <= info.max:
+				return ObservationCodec(state_shape, compact_dtype)
+		return ObservationCodec(state_shape)
+
+	def __init__(self, state_shape, dtype=np.float32):
+		self.state_shape = tuple(state_shape)
+		self.dtype = np.dtype(dtype)
+
+	def get_encoded_shape(self):
+		return self.state_shape
+
+	def get_compression_ratio(self): # with respect to float32 states
+		return 4*np.prod(self.state_shape)/(self.dtype.itemsize*np.prod(self.get_encoded_shape()))
+
+	def is_encoded(self, states):
+		return states.dtype == self.dtype and states.shape[1:] == self.get_encoded_shape()
+
+	def encode(self, states): # states can be already encoded
+		states = np.asarray(states)
+		if self.is_encoded(states):
+			return states
+		return states.astype(self.dtype)
+
+	def encode_state(self, state):
+		return self.encode([state])[0]
+
+	def decode(self, states):
+		return np.asarray(states, dtype=np.float32)
+
+	def decode_state(self, state):
+		return self.decode([state])[0]
+
+	def decode_tensor(self, states):
+		return tf.cast(states, tf.float32)
+
+class BitPackedCodec(ObservationCodec):
+	# Binary states, packed 8 values per byte
+
+	def __init__(self, state_shape):
+		super().__init__(state_shape, np.uint8)
+		self.state_size = int(np.prod(self.state_shape))
+
+	def get_encoded_shape(self):
+		return ((self.state_size+7)//8,)
+
+	def encode(self, states):
+		states = np.asarray(states)
+		if self.is_encoded(states):
+			return states
+		return np.packbits(np.reshape(states, (len(states), self.state_size)) != 0, axis=-1)
+
+	def decode(self, states):
+		bits = np.unpackbits(np.asarray(states, dtype=np.uint8), axis=-1)[:,:self.state_size]
+		return np.reshape(bits, (-1,)+self.state_shape).astype(np.float32)
+
+	def decode_tensor(self, states):
+		bit_masks = tf.constant([128,64,32,16,8,4,2,1], dtype=tf.uint8) # the most significant bit first, as in np.packbits
+		bits = tf.not_equal(tf.bitwise.bitwise_and(tf.expand_dims(states, -1), bit_masks), 0)
+		bits = tf.reshape(tf.cast(bits, tf.float32), [-1, self.get_encoded_shape()[0]*8])[:,:self.state_size]
+		return tf.reshape(bits, [-1]+list(self.state_shape))
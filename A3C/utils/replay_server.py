@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+import threading
+import time
+import traceback
+import zlib
+from multiprocessing.connection import Listener, Client
+
+def parse_address(address): # host:port for a TCP socket, otherwise the path of a Unix socket
+	host, separator, port = address.rpartition(':')
+	if separator and port.isdigit():
+		return (host, int(port))
+	return address
+
+def encode_batch(batch): # the record of the batch, pickled and compressed
+	return zlib.compress(pickle.dumps(batch.get_record(), protocol=pickle.HIGHEST_PROTOCOL))
+
+def decode_batch(data, batch_from_record):
+	return batch_from_record(pickle.loads(zlib.decompress(data)))
+
+class ReplayServer(object):
+	# Serves a PrioritizedBuffer to the workers of many processes (or hosts), through a Listener socket.
+	# Every connection is served by its own thread, the buffer is guarded by a single lock.
+	# The buffer keeps batches as they were sent by the clients (compressed records), it never decodes them:
+	# its byte budget counts compressed bytes and the server does not need the environment or tensorflow.
+	# Priorities of sampled batches are updated by slot and entry id: an update for a slot replaced (or evicted) since the batch was sampled is skipped.
+	REQUESTS = ('put', 'keyed_sample_batch', 'update_priorities', 'count', 'get_statistics', 'flush')
+
+	def __init__(self, buffer, address, authkey, checkpoint_path=None):
+		self.buffer = buffer
+		self.address = address
+		self.authkey = authkey
+		self.checkpoint_path = checkpoint_path # where flush saves the buffer
+		self.lock = threading.Lock()
+		self.listener = None
+		# Statistics
+		self._connection_count = 0
+
+	def load(self):
+		if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+			return False
+		with open(self.checkpoint_path, 'rb') as file:
+			self.buffer = pickle.load(file)
+		return True
+
+	def serve_forever(self):
+		self.listener = Listener(parse_address(self.address), authkey=self.authkey)
+		print("Replay server listening on {}".format(self.listener.address))
+		while True:
+			try:
+				connection = self.listener.accept()
+			except (OSError, EOFError) as e: # eg: a client with the wrong authkey
+				print("Replay server refused a connection: {}".format(e))
+				continue
+			thread = threading.Thread(target=self.serve_connection, args=(connection,))
+			thread.daemon = True
+			thread.start()
+
+	def close(self):
+		if self.listener is not None:
+			self.listener.close()
+
+	def serve_connection(self, connection):
+		with self.lock:
+			self._connection_count += 1
+		try:
+			while True:
+				try:
+					name, args = connection.recv()
+				except EOFError: # the client has gone away
+					return
+				try:
+					if name not in self.REQUESTS:
+						raise ValueError("unknown replay server request {}".format(name))
+					response = ('ok', getattr(self, name)(*args))
+				except Exception:
+					response = ('error', traceback.format_exc())
+				connection.send(response)
+		finally:
+			with self.lock:
+				self._connection_count -= 1
+			connection.close()
+
+	def put(self, data, priority, type_id):
+		with self.lock:
+			self.buffer.put(batch=data, priority=priority, type_id=type_id)
+
+	def keyed_sample_batch(self, k):
+		with self.lock:
+			return self.buffer.keyed_sample_batch(k)
+
+	def update_priorities(self, idx_list, priority_list, type_id_list, entry_id_list):
+		with self.lock:
+			self.buffer.update_priorities(idx_list, priority_list, type_id_list, entry_id_list)
+
+	def count(self):
+		with self.lock:
+			return self.buffer.count()
+
+	def get_statistics(self):
+		with self.lock:
+			stats = self.buffer.get_statistics()
+			stats[self.buffer.name + '_count'] = self.buffer.count()
+			stats[self.buffer.name + '_connections'] = self._connection_count
+		return stats
+
+	def flush(self): # save the buffer, if the server has a checkpoint
+		if self.checkpoint_path is None:
+			return
+		with self.lock:
+			data = pickle.dumps(self.buffer, protocol=pickle.HIGHEST_PROTOCOL)
+		os.makedirs(os.path.dirname(os.path.abspath(self.checkpoint_path)), exist_ok=True)
+		temporary_path = self.checkpoint_path + '.tmp'
+		with open(temporary_path, 'wb') as file:
+			file.write(data)
+		os.replace(temporary_path, self.checkpoint_path) # a crash while saving keeps the previous checkpoint
+
+class ReplayClient(object):
+	# The interface of a PrioritizedBuffer over a connection to a ReplayServer, used by the workers in place of their own buffer.
+	# Batches are sent as compressed records (see ExperienceBatch.get_record) and rebuilt with batch_from_record: a sampled batch is a copy.
+	# Batches put without priority get priority 1, so that buffers without prioritized replay are sampled uniformly.
+	# A client is thread-safe, but its requests are serialized: give every worker its own client.
+
+	def __init__(self, address, authkey, batch_from_record, name='replay_client'):
+		self.address = address
+		self.authkey = authkey
+		self.batch_from_record = batch_from_record
+		self.name = name # prefix of the statistics
+		self.lock = threading.Lock()
+		self.connect()
+		# Statistics
+		self._request_time = 0
+		self._request_count = 0
+
+	def connect(self):
+		self.connection = Client(parse_address(self.address), authkey=self.authkey)
+
+	def __getstate__(self): # connections cannot be pickled
+		state = self.__dict__.copy()
+		del state['connection']
+		del state['lock']
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.lock = threading.Lock()
+		self.connect()
+
+	def request(self, name, *args):
+		start = time.time()
+		with self.lock:
+			self.connection.send((name, args))
+			status, result = self.connection.recv()
+		self._request_time += time.time() - start
+		self._request_count += 1
+		if status == 'error':
+			raise RuntimeError("replay server request {} failed:\n{}".format(name, result))
+		return result
+
+	def count(self, type=None): # types are not visible to clients
+		return self.request('count')
+
+	def has_atleast(self, frames, type=None):
+		return self.count() >= frames
+
+	def is_empty(self, type=None):
+		return not self.has_atleast(1)
+
+	def put(self, batch, priority=1., type_id=0): # priority None for the max priority of the server buffer
+		self.request('put', encode_batch(batch), None if priority is None else float(priority), type_id)
+
+	def keyed_sample(self):
+		return self.keyed_sample_batch(1)[0]
+
+	def keyed_sample_batch(self, k): # every sample is (batch, idx, type_id, entry_id)
+		return [(decode_batch(data, self.batch_from_record), idx, type_id, entry_id) for (data, idx, type_id, entry_id) in self.request('keyed_sample_batch', k)]
+
+	def sample(self):
+		return self.keyed_sample()[0]
+
+	def sample_batch(self, k):
+		return [batch for (batch, _, _, _) in self.keyed_sample_batch(k)]
+
+	def update_priority(self, idx, priority, type_id=0, entry_id=None):
+		self.update_priorities([idx], [priority], [type_id], None if entry_id is None else [entry_id])
+
+	def update_priorities(self, idx_list, priority_list, type_id_list, entry_id_list=None):
+		self.request('update_priorities', [int(idx) for idx in idx_list], [float(priority) for priority in priority_list], list(type_id_list), None if entry_id_list is None else [int(entry_id) for entry_id in entry_id_list])
+
+	def flush(self): # the server saves its buffer
+		self.request('flush')
+
+	def get_statistics(self):
+		stats = self.request('get_statistics')
+		if self._request_count > 0:
+			stats[self.name + '_request_time'] = self._request_time/self._request_count
+		return stats
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+REWARD_CLASSES = 3 # zero, positive, negative
+
+def get_reward_classes(rewards): # 0 for zero rewards, 1 for positive ones, 2 for negative ones
+	rewards = np.asarray(rewards)
+	return np.where(rewards == 0, 0, np.where(rewards > 0, 1, 2))
+
+class RewardPredictionBuffer(object):
+	# Examples for reward prediction: windows of (at most) window_size consecutive states, labelled with the class of the reward that follows them.
+	# Windows are cut when a batch is added and copied into preallocated arrays, a ring of size examples for every class.
+	# Sampling is stratified: a class is chosen uniformly among the not empty ones, then an example of the class, both in O(1).
+	# If byte_budget > 0, the size of every ring is reduced to fit its share of the budget.
+
+	def __init__(self, size, window_size=3, byte_budget=0, name='reward_prediction_buffer'):
+		self.size = size
+		self.window_size = window_size
+		self.byte_budget = byte_budget
+		self.name = name # prefix of the statistics
+		self.clean()
+
+	def clean(self):
+		self.capacity = 0 # examples of every class, known when the first window is added
+		self.states = None # shape: (REWARD_CLASSES, capacity, window_size)+state_shape
+		self.lengths = None # the number of states of every example
+		self.counts = np.zeros(REWARD_CLASSES, dtype=np.int64)
+		self.next_slots = np.zeros(REWARD_CLASSES, dtype=np.int64)
+		self.added_counts = np.zeros(REWARD_CLASSES, dtype=np.int64) # examples added since the buffer was created, used by incremental checkpoints
+
+	def allocate(self, state):
+		example_bytes = self.window_size*state.nbytes
+		self.capacity = self.size
+		if self.byte_budget > 0:
+			self.capacity = int(max(1, min(self.size, self.byte_budget//(REWARD_CLASSES*example_bytes))))
+		self.states = np.zeros((REWARD_CLASSES, self.capacity, self.window_size)+state.shape, dtype=state.dtype)
+		self.lengths = np.zeros((REWARD_CLASSES, self.capacity), dtype=np.int32)
+
+	def count(self, reward_class=None):
+		if reward_class is None:
+			return int(np.sum(self.counts))
+		return int(self.counts[reward_class])
+
+	def is_empty(self):
+		return self.count() == 0
+
+	def add(self, states, rewards):
+		# states and rewards (extrinsic) of consecutive steps. Every window of length states is an example, labelled with the reward of the step after it.
+		# Returns whether some example has been added.
+		step_count = len(states)
+		length = min(self.window_size, step_count-1)
+		if length < 1:
+			return False
+		states = np.asarray(states)
+		if self.states is None:
+			self.allocate(states[0])
+		window_count = step_count-length
+		windows = np.stack([states[i:i+window_count] for i in range(length)], axis=1) # shape: (window_count, length)+state_shape
+		reward_classes = get_reward_classes(rewards[length:])
+		for reward_class in range(REWARD_CLASSES):
+			self.put_windows(reward_class, windows[reward_classes == reward_class], length)
+		return True
+
+	def put_windows(self, reward_class, windows, lengths): # lengths is the length of all the windows, or an array with the length of every window
+		windows = windows[-self.capacity:] # the most recent ones, if they do not fit
+		lengths = np.asarray(lengths)
+		if lengths.ndim > 0:
+			lengths = lengths[-self.capacity:]
+		window_count = len(windows)
+		if window_count == 0:
+			return
+		slots = (self.next_slots[reward_class] + np.arange(window_count)) % self.capacity
+		self.states[reward_class, slots, :windows.shape[1]] = windows
+		self.lengths[reward_class, slots] = lengths
+		self.next_slots[reward_class] = (self.next_slots[reward_class] + window_count) % self.capacity
+		self.counts[reward_class] = min(self.capacity, self.counts[reward_class] + window_count)
+		self.added_counts[reward_class] += window_count
+
+	def get_recent_examples(self, reward_class, count): # states and lengths of the last count examples of the class, from the oldest
+		slots = (self.next_slots[reward_class] - count + np.arange(count)) % max(1, self.capacity)
+		return self.states[reward_class, slots], self.lengths[reward_class, slots]
+
+	def restore_examples(self, reward_class, states, lengths): # put the examples of a checkpoint
+		if len(states) == 0:
+			return
+		if self.states is None:
+			self.allocate(states[0][0])
+		self.put_windows(reward_class, states[:,:self.window_size], lengths)
+
+	def sample(self): # the states of an example and its one-hot target, with shape (1, REWARD_CLASSES)
+		reward_class = np.random.choice(np.flatnonzero(self.counts))
+		idx = np.random.randint(self.counts[reward_class])
+		target = np.zeros((1,REWARD_CLASSES))
+		target[0][reward_class] = 1.0
+		return self.states[reward_class, idx, :self.lengths[reward_class, idx]], target
+
+	def get_bytes(self):
+		return 0 if self.states is None else self.states.nbytes + self.lengths.nbytes
+
+	def get_statistics(self):
+		stats = {self.name + '_bytes': self.get_bytes()}
+		for reward_class in range(REWARD_CLASSES):
+			stats['{}_class{}_count'.format(self.name, reward_class)] = self.count(reward_class)
+		return stats
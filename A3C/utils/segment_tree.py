@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+class SegmentTree(object):
+	# Complete binary tree stored in an array: leaves are in [capacity, 2*capacity), node i is the reduction of nodes 2i and 2i+1.
+	# Updates are O(log n), the reduction of all the leaves is O(1).
+
+	def __init__(self, capacity, operation, neutral_element):
+		self.capacity = 1
+		while self.capacity < capacity: # a power of 2
+			self.capacity *= 2
+		self.operation = operation
+		self.neutral_element = neutral_element
+		self.tree = np.full(2*self.capacity, neutral_element, dtype=np.float64)
+
+	def __setitem__(self, idx, value): # O(log n)
+		idx += self.capacity
+		self.tree[idx] = value
+		idx //= 2
+		while idx >= 1:
+			self.tree[idx] = self.operation(self.tree[2*idx], self.tree[2*idx+1])
+			idx //= 2
+
+	def update(self, idx_list, values): # the same as many __setitem__, with one vectorized step per level of the tree
+		idx = np.asarray(idx_list, dtype=np.int64) + self.capacity
+		if len(idx) == 0:
+			return
+		self.tree[idx] = values
+		idx = np.unique(idx // 2)
+		while idx[0] >= 1:
+			self.tree[idx] = self.operation(self.tree[2*idx], self.tree[2*idx+1])
+			idx = np.unique(idx // 2)
+
+	def __getitem__(self, idx):
+		return self.tree[self.capacity + idx]
+
+	def reduce(self):
+		return self.tree[1]
+
+class SumSegmentTree(SegmentTree):
+
+	def __init__(self, capacity):
+		super().__init__(capacity=capacity, operation=np.add, neutral_element=0.)
+
+	def find_prefixsum_idx(self, masses): # O(k*log n) for k masses, all the levels of the tree are visited in one vectorized step
+		# for every mass, the highest idx such that sum(tree[:idx]) <= mass
+		masses = np.array(masses, dtype=np.float64)
+		idx = np.ones(len(masses), dtype=np.int64)
+		while idx[0] < self.capacity: # all the indices are at the same level
+			left = 2*idx
+			left_sum = self.tree[left]
+			go_right = masses >= left_sum
+			masses -= left_sum*go_right
+			idx = left + go_right
+		return idx - self.capacity
+
+class MinSegmentTree(SegmentTree):
+
+	def __init__(self, capacity):
+		super().__init__(capacity=capacity, operation=np.minimum, neutral_element=float("inf"))
+
+	def argmin(self): # O(log n)
+		idx = 1
+		while idx < self.capacity:
+			left = 2*idx
+			idx = left if self.tree[left] <= self.tree[left+1] else left+1
+		return idx - self.capacity
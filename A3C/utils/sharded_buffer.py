@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import itertools
+import threading
+import numpy as np
+
+class ShardedBuffer(object):
+	# A buffer shared by many threads, made of shards (eg: Buffer or PrioritizedBuffer) with a lock each.
+	# Batches are put into the shards in round robin, so concurrent puts rarely wait for the same lock.
+	# Samples are spread over the shards proportionally to their size, every shard keeps its own types (eg: type_id 0/1/2).
+	# Keys of prioritized samples are (shard_id, idx), the entry id of a sample lets its shard skip a stale priority update (see PrioritizedBuffer).
+
+	def __init__(self, shards):
+		self.shards = shards
+		self.locks = [threading.Lock() for _ in shards]
+		self.next_shard = itertools.count()
+
+	def __getstate__(self): # locks cannot be pickled
+		return {'shards': self.shards}
+
+	def __setstate__(self, state):
+		self.__init__(state['shards'])
+
+	def count(self, type=None):
+		return sum(shard.count(type) for shard in self.shards)
+
+	def has_atleast(self, frames, type=None):
+		return self.count(type) >= frames
+
+	def is_empty(self, type=None):
+		return not self.has_atleast(1, type)
+
+	def get_batches(self, type_id=None):
+		result = []
+		for (shard, lock) in zip(self.shards, self.locks):
+			with lock:
+				result += shard.get_batches(type_id)
+		return result
+
+	def put(self, batch, **kwargs): # the arguments of the put of the shards, eg: priority and type_id
+		shard_id = next(self.next_shard) % len(self.shards)
+		with self.locks[shard_id]:
+			self.shards[shard_id].put(batch=batch, **kwargs)
+
+	def get_sample_counts(self, k): # how many samples to draw from every shard
+		counts = np.array([shard.count() for shard in self.shards], dtype=np.float64)
+		if counts.sum() == 0:
+			return np.zeros(len(self.shards), dtype=np.int64)
+		return np.random.multinomial(k, counts/counts.sum())
+
+	def sample(self):
+		return self.sample_batch(1)[0]
+
+	def sample_batch(self, k):
+		result = []
+		for (shard_id, shard_k) in enumerate(self.get_sample_counts(k)):
+			if shard_k > 0:
+				with self.locks[shard_id]:
+					result += self.shards[shard_id].sample_batch(shard_k)
+		return result
+
+	def keyed_sample(self):
+		return self.keyed_sample_batch(1)[0]
+
+	def keyed_sample_batch(self, k): # every sample is (batch, (shard_id, idx), type_id, entry_id)
+		result = []
+		for (shard_id, shard_k) in enumerate(self.get_sample_counts(k)):
+			if shard_k > 0:
+				with self.locks[shard_id]:
+					result += [(batch, (shard_id, idx), type_id, entry_id) for (batch, idx, type_id, entry_id) in self.shards[shard_id].keyed_sample_batch(shard_k)]
+		return result
+
+	def update_priority(self, idx, priority, type_id=0, entry_id=None):
+		shard_id, shard_idx = idx
+		with self.locks[shard_id]:
+			self.shards[shard_id].update_priority(shard_idx, priority, type_id, entry_id)
+
+	def update_priorities(self, idx_list, priority_list, type_id_list, entry_id_list=None):
+		if entry_id_list is None:
+			entry_id_list = [None]*len(idx_list)
+		for shard_id in set(shard_id for (shard_id, _) in idx_list):
+			shard_updates = [(shard_idx, priority, type_id, entry_id) for ((update_shard_id, shard_idx), priority, type_id, entry_id) in zip(idx_list, priority_list, type_id_list, entry_id_list) if update_shard_id == shard_id]
+			shard_idx_list, shard_priority_list, shard_type_id_list, shard_entry_id_list = zip(*shard_updates)
+			if None in shard_entry_id_list:
+				shard_entry_id_list = None
+			with self.locks[shard_id]:
+				self.shards[shard_id].update_priorities(shard_idx_list, shard_priority_list, shard_type_id_list, shard_entry_id_list)
+
+	def flush(self): # for memory-mapped shards
+		for (shard, lock) in zip(self.shards, self.locks):
+			with lock:
+				shard.flush()
+
+	def get_statistics(self): # bytes are summed over the shards, the other statistics are averaged
+		shard_stats = []
+		for (shard, lock) in zip(self.shards, self.locks):
+			with lock:
+				shard_stats.append(shard.get_statistics())
+		stats = {}
+		for key in set(key for s in shard_stats for key in s):
+			values = [s[key] for s in shard_stats if key in s]
+			stats[key] = sum(values) if key.endswith('_bytes') else sum(values)/len(values)
+		return stats
@@ -0,0 +1,21 @@
+#!/bin/bash
+# Train with the experience replay buffer kept by a local replay server process.
+# More training processes (eg: on other hosts, with a TCP address) can share the same server.
+
+pkill -9 -f python
+pkill -9 -f rogue
+
+MY_PATH="`dirname \"$0\"`"
+cd $MY_PATH
+. .env/bin/activate
+
+if [ ! -d "log" ]; then
+  mkdir log
+fi
+
+REPLAY_SERVER_ADDRESS="localhost:6000"
+python3 ./A3C/replay_server.py --address $REPLAY_SERVER_ADDRESS --checkpoint ./checkpoint/replay_server.pkl &
+REPLAY_SERVER_PID=$!
+trap "kill $REPLAY_SERVER_PID" EXIT
+sleep 1 # wait for the server to listen
+python3 ./A3C/train.py --replay_server_address=$REPLAY_SERVER_ADDRESS